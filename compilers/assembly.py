@@ -0,0 +1,182 @@
+"""
+In-memory representation of tpa and tpc programs, passed between tpa_producer, tpc_compiler, tpc_optimizer and the
+byte assembler.
+
+An instruction is a list of strings: the mnemonic followed by its operands, spelled exactly as in the text files,
+for example ['load', '%0', '$12']. Text is only produced when a .tpa or .tpc file is explicitly requested.
+"""
+
+import compilers.errors as errs
+import compilers.tokens_lib as tl
+
+
+class AsmClass:
+    def __init__(self, name: str, ptr: str, mro: list, methods: list):
+        self.name = name
+        self.ptr = ptr  # address of the class pointer, like '$2140'
+        self.mro = mro  # tpa: names of super classes, tpc: pointers of all classes in mro, starts with self
+        self.methods = methods  # tpa: full poly names of methods, tpc: function pointers
+
+
+class AsmFunction:
+    def __init__(self, name: str, ptr: str, body: list, inline=False, abstract=False):
+        self.name = name
+        self.ptr = ptr
+        self.body = body  # list of instructions, ends with 'stop'
+        self.inline = inline
+        self.abstract = abstract
+
+    def title(self) -> str:
+        title = f"fn {self.name} {self.ptr}"
+        if self.inline:
+            title += " inline"
+        if self.abstract:
+            title += " abstract"
+        return title
+
+
+class AsmProgram:
+    def __init__(self, resolved=False):
+        self.resolved = resolved  # whether class headers and function calls are resolved to pointers (tpc)
+
+        self.version = 0
+        self.bits = 0
+        self.stack_size = 0
+        self.global_length = 0
+        self.literal = []  # list of int
+        self.classes = []
+        self.functions = []
+        self.entry = []
+
+    def copy_header(self, resolved: bool):
+        """
+        Returns a new program with the same header, but no classes, functions or entry.
+        """
+        program = AsmProgram(resolved)
+        program.version = self.version
+        program.bits = self.bits
+        program.stack_size = self.stack_size
+        program.global_length = self.global_length
+        program.literal = self.literal
+        return program
+
+    def to_lines(self) -> list:
+        lines = ["version", str(self.version),
+                 "bits", str(self.bits),
+                 "stack_size", str(self.stack_size),
+                 "global_length", str(self.global_length),
+                 "literal", " ".join([str(b) for b in self.literal]),
+                 "classes"]
+        for clazz in self.classes:
+            if self.resolved:
+                lines.append(" ".join(["class", clazz.name, "mro"] + clazz.mro + ["methods"] + clazz.methods))
+            else:
+                lines.append(f"class {clazz.name} {clazz.ptr}")
+                lines.append("mro")
+                lines.extend(["    " + name for name in clazz.mro])
+                lines.append("methods")
+                lines.extend(["    " + name for name in clazz.methods])
+                lines.append("endclass")
+                lines.append("")
+        lines.append("")
+
+        for fn in self.functions:
+            lines.append(fn.title())
+            lines.extend([format_inst(inst) for inst in fn.body])
+            lines.append("")
+
+        lines.append("entry")
+        lines.extend([format_inst(inst) for inst in self.entry])
+        return lines
+
+    def write(self, file_name: str):
+        with open(file_name, "w") as wf:
+            wf.write("\n".join(self.to_lines()))
+
+
+def format_inst(inst: list) -> str:
+    mne = inst[0]
+    s = "    " + mne
+    s += " " * max(14 - len(mne), 1)
+    for i in range(1, len(inst)):
+        x = inst[i]
+        s += x
+        s += " " * max(8 - len(x), 1)
+    return s.rstrip()
+
+
+def split_inst(line: str) -> list:
+    """
+    Splits a text line to an instruction, with comments removed.
+    """
+    parts = [part for part in line.split(" ") if len(part) > 0]
+    for j in range(len(parts)):
+        part = parts[j]
+        if part == ";" or part.startswith(";", 0, -1):
+            return parts[:j]
+    return parts
+
+
+def read_program(file_name: str) -> AsmProgram:
+    """
+    Reads a .tpa or .tpc file.
+    """
+    with open(file_name, "r") as rf:
+        lines = [line.strip() for line in rf.readlines()]
+
+    program = AsmProgram()
+    cur_body = None
+    i = 0
+    length = len(lines)
+    while i < length:
+        line = lines[i]
+        if line == "version":
+            program.version = int(lines[i + 1])
+            i += 1
+        elif line == "bits":
+            program.bits = int(lines[i + 1])
+            i += 1
+        elif line == "stack_size":
+            program.stack_size = int(lines[i + 1])
+            i += 1
+        elif line == "global_length":
+            program.global_length = int(lines[i + 1])
+            i += 1
+        elif line == "literal":
+            program.literal = [int(lit) for lit in lines[i + 1].split(" ") if len(lit) > 0]
+            i += 1
+        elif line == "classes":
+            pass
+        elif line.startswith("class "):
+            parts = split_inst(line)
+            if len(parts) > 2 and parts[2] == "mro":  # tpc: class name mro $ptr... methods $ptr...
+                methods_index = parts.index("methods")
+                mro = parts[3:methods_index]
+                program.resolved = True
+                program.classes.append(AsmClass(parts[1], mro[0], mro, parts[methods_index + 1:]))
+            else:  # tpa: multi-line class header ends with 'endclass'
+                names = []
+                i += 1
+                while lines[i] != "endclass":
+                    names.append(lines[i])
+                    i += 1
+                methods_index = names.index("methods")
+                program.classes.append(AsmClass(parts[1], parts[2], names[1:methods_index],
+                                                names[methods_index + 1:]))
+        else:
+            inst = split_inst(line)
+            if len(inst) > 0:
+                if inst[0] == "fn":
+                    if not inst[2].startswith("$"):
+                        raise errs.TpaError("Incorrect number format. ", tl.LineFile(file_name, i + 1))
+                    cur_body = []
+                    program.functions.append(AsmFunction(inst[1], inst[2], cur_body,
+                                                         "inline" in inst[3:], "abstract" in inst[3:]))
+                elif inst[0] == "entry":
+                    cur_body = program.entry
+                elif cur_body is None:
+                    raise errs.TpaError("Instruction outside function. ", tl.LineFile(file_name, i + 1))
+                else:
+                    cur_body.append(inst)
+        i += 1
+    return program
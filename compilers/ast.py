@@ -1,5 +1,6 @@
 from abc import ABC
 import os
+import functools
 import compilers.tokens_lib as tl
 import compilers.environment as en
 import compilers.tpa_producer as tp
@@ -65,7 +66,31 @@ SPACES = SpaceCounter()
 LAMBDA_COUNTER = Counter()
 
 
+def cached_type(evaluated_type):
+    """
+    Decorator of 'evaluated_type' of expressions, which remembers the type evaluated in the latest environment.
+
+    A name cannot be redefined in an environment or its inner environments, so the type of an expression only
+    changes with the environment, for example in the body of an inline function. Errors are not remembered.
+    """
+    @functools.wraps(evaluated_type)
+    def wrapper(self, env, manager):
+        if self.type_env is env:
+            return self.type_cache
+        t = evaluated_type(self, env, manager)
+        self.type_env = env
+        self.type_cache = t
+        return t
+
+    return wrapper
+
+
 class Node:
+    __slots__ = ("lfp",)
+
+    # names of the attributes that hold the children of this node, each of them is a node, a list of nodes, or None
+    _fields = ()
+
     def __init__(self, lfp):
         self.lfp: tl.LineFilePos = lfp
 
@@ -121,6 +146,8 @@ class Node:
 # Expression returns a thing while Statement returns nothing
 
 class Statement(Node, ABC):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -129,9 +156,14 @@ class Statement(Node, ABC):
 
 
 class Expression(Node, ABC):
+    __slots__ = ("type_env", "type_cache")
+
     def __init__(self, lf):
         super().__init__(lf)
 
+        self.type_env = None  # environment of the cached evaluated type, see 'cached_type'
+        self.type_cache = None
+
     def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
         et = self.evaluated_type(env, tpa.manager)
         res = self.compile(env, tpa)
@@ -147,6 +179,8 @@ class Expression(Node, ABC):
 
 
 class FakeNode(Node):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -158,6 +192,8 @@ class FakeNode(Node):
 
 
 class FakeLiteral(FakeNode):
+    __slots__ = ("value",)
+
     def __init__(self, value, lf):
         super().__init__(lf)
 
@@ -168,31 +204,44 @@ class FakeLiteral(FakeNode):
 
 
 class FakeIntLit(FakeLiteral):
+    __slots__ = ()
+
     def __init__(self, value, lf):
         super().__init__(value, lf)
 
 
 class FakeFloatLit(FakeLiteral):
+    __slots__ = ()
+
     def __init__(self, value, lf):
         super().__init__(value, lf)
 
 
 class FakeCharLit(FakeLiteral):
+    __slots__ = ()
+
     def __init__(self, value, lf):
         super().__init__(value, lf)
 
 
 class FakeByteLit(FakeLiteral):
+    __slots__ = ()
+
     def __init__(self, value, lf):
         super().__init__(value, lf)
 
 
 class FakeStrLit(FakeLiteral):
+    __slots__ = ()
+
     def __init__(self, value, lf):
         super().__init__(value, lf)
 
 
 class Line(Expression):
+    __slots__ = ("parts",)
+    _fields = ("parts",)
+
     def __init__(self, lf, *nodes):
         super().__init__(lf)
 
@@ -227,6 +276,9 @@ class Line(Expression):
 
 
 class BlockStmt(Statement):
+    __slots__ = ("lines",)
+    _fields = ("lines",)
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -234,7 +286,9 @@ class BlockStmt(Statement):
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
         for line in self.lines:
+            tpa.manager.begin_temps()
             line.compile(env, tpa)
+            tpa.manager.end_temps()
 
     def return_check(self):
         return any([line.return_check() for line in self.lines])
@@ -279,6 +333,8 @@ class BlockStmt(Statement):
 
 
 class NameNode(Expression):
+    __slots__ = ("name",)
+
     def __init__(self, name: str, lf):
         super().__init__(lf)
 
@@ -299,15 +355,16 @@ class NameNode(Expression):
                     return env.get_type(prob_name, self.lfp)
         raise errs.TplCompileError(f"Name '{self.name}' is not a type. ", self.lfp)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager):
-        if env.has_name(self.name):
-            return env.get_type(self.name, self.lfp)
-        else:
-            wc = env.get_working_class()
-            if wc is not None:
-                prob_name = typ.Generic.generic_name(wc.full_name(), self.name)
-                if env.is_type(prob_name, self.lfp):
-                    return env.get_type(prob_name, self.lfp)
+        t = env.find_type(self.name)
+        if t is not None:
+            return t
+        wc = env.get_working_class()
+        if wc is not None:
+            prob_name = typ.Generic.generic_name(wc.full_name(), self.name)
+            if env.is_type(prob_name, self.lfp):
+                return env.get_type(prob_name, self.lfp)
         raise errs.TplCompileError(f"Name '{self.name}' is not defined. ", self.lfp)
 
     def __str__(self):
@@ -321,6 +378,8 @@ class NameNode(Expression):
 
 
 class LiteralNode(Expression, ABC):
+    __slots__ = ("lit_pos",)
+
     def __init__(self, lit_pos: int, lf):
         super().__init__(lf)
 
@@ -328,6 +387,8 @@ class LiteralNode(Expression, ABC):
 
 
 class IntLiteral(LiteralNode):
+    __slots__ = ()
+
     def __init__(self, lit_pos, lf):
         super().__init__(lit_pos, lf)
 
@@ -339,6 +400,9 @@ class IntLiteral(LiteralNode):
     def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
         tpa.load_literal(dst_addr, self.lit_pos)
 
+    def int_value(self, manager: tp.Manager) -> int:
+        return util.bytes_to_int(manager.literal[self.lit_pos: self.lit_pos + util.INT_LEN])
+
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return typ.TYPE_INT
 
@@ -347,6 +411,8 @@ class IntLiteral(LiteralNode):
 
 
 class FloatLiteral(LiteralNode):
+    __slots__ = ()
+
     def __init__(self, lit_pos, lf):
         super().__init__(lit_pos, lf)
 
@@ -366,6 +432,8 @@ class FloatLiteral(LiteralNode):
 
 
 class CharLiteral(LiteralNode):
+    __slots__ = ()
+
     def __init__(self, lit_pos, lf):
         super().__init__(lit_pos, lf)
 
@@ -377,6 +445,9 @@ class CharLiteral(LiteralNode):
     def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
         tpa.load_char_literal(dst_addr, self.lit_pos)
 
+    def int_value(self, manager: tp.Manager) -> int:
+        return ord(util.bytes_to_char(manager.literal[self.lit_pos: self.lit_pos + util.CHAR_LEN]))
+
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return typ.TYPE_CHAR
 
@@ -385,6 +456,8 @@ class CharLiteral(LiteralNode):
 
 
 class ByteLiteral(LiteralNode):
+    __slots__ = ()
+
     def __init__(self, lit_pos, lf):
         super().__init__(lit_pos, lf)
 
@@ -404,6 +477,8 @@ class ByteLiteral(LiteralNode):
 
 
 class StringLiteral(LiteralNode):
+    __slots__ = ()
+
     def __init__(self, lit_pos, lf):
         super().__init__(lit_pos, lf)
 
@@ -416,13 +491,15 @@ class StringLiteral(LiteralNode):
         tpa.load_literal_ptr(dst_addr, self.lit_pos)
 
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
-        return typ.PointerType(env.get_type("String", self.lfp))
+        return typ.pointer_type(env.get_type("String", self.lfp))
 
     def __str__(self):
         return "CharArray@" + str(self.lit_pos)
 
 
 class AnnotationNode(Statement):
+    __slots__ = ("text",)
+
     def __init__(self, text: str, lfp):
         super().__init__(lfp)
 
@@ -436,6 +513,10 @@ class AnnotationNode(Statement):
 
 
 class Buildable:
+    # slots of buildable nodes are declared in UnaryExpr, UnaryStmt, BinaryExpr and BinaryStmt,
+    # since a class cannot have two bases that both declare slots
+    __slots__ = ()
+
     def __init__(self, op: str):
         self.op = op
 
@@ -444,6 +525,8 @@ class Buildable:
 
 
 class UnaryBuildable(Buildable):
+    __slots__ = ()
+
     def __init__(self, op, operator_at_left):
         super().__init__(op)
 
@@ -465,6 +548,8 @@ class UnaryBuildable(Buildable):
 
 
 class BinaryBuildable(Buildable):
+    __slots__ = ()
+
     def __init__(self, op):
         super().__init__(op)
 
@@ -476,6 +561,9 @@ class BinaryBuildable(Buildable):
 
 
 class UnaryExpr(UnaryBuildable, Expression, ABC):
+    __slots__ = ("op", "value", "operator_at_left")
+    _fields = ("value",)
+
     def __init__(self, op: str, lf, operator_at_left=True):
         Expression.__init__(self, lf)
         UnaryBuildable.__init__(self, op, operator_at_left)
@@ -485,12 +573,18 @@ class UnaryExpr(UnaryBuildable, Expression, ABC):
 
 
 class UnaryStmt(UnaryBuildable, Statement, ABC):
+    __slots__ = ("op", "value", "operator_at_left")
+    _fields = ("value",)
+
     def __init__(self, op: str, lf, operator_at_left=True):
         Statement.__init__(self, lf)
         UnaryBuildable.__init__(self, op, operator_at_left)
 
 
 class BinaryExpr(Expression, BinaryBuildable, ABC):
+    __slots__ = ("op", "left", "right")
+    _fields = ("left", "right")
+
     def __init__(self, op: str, lf):
         Expression.__init__(self, lf)
         BinaryBuildable.__init__(self, op)
@@ -500,6 +594,9 @@ class BinaryExpr(Expression, BinaryBuildable, ABC):
 
 
 class BinaryStmt(Statement, BinaryBuildable, ABC):
+    __slots__ = ("op", "left", "right")
+    _fields = ("left", "right")
+
     def __init__(self, op: str, lf):
         Statement.__init__(self, lf)
         BinaryBuildable.__init__(self, op)
@@ -509,42 +606,48 @@ class BinaryStmt(Statement, BinaryBuildable, ABC):
 
 
 class UnaryOperator(UnaryExpr):
+    __slots__ = ("op_type",)
+
     def __init__(self, op: str, op_type: int, lf):
         super().__init__(op, lf)
 
         self.op_type = op_type
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
+        res_t = self.evaluated_type(env, tpa.manager)
+        res_addr = tpa.manager.allocate_stack(res_t.memory_length())
+        self.compile_to(env, tpa, res_addr, res_t.memory_length())
+        return res_addr
+
+    def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
         vt: typ.Type = self.value.evaluated_type(env, tpa.manager)
         value = self.value.compile(env, tpa)
         if self.op_type == UNA_ARITH:
             if isinstance(vt, typ.PrimitiveType):
                 if vt == typ.TYPE_INT:
-                    res_addr = tpa.manager.allocate_stack(util.INT_LEN)
                     if self.op == "neg":
-                        tpa.unary_arith("negi", value, res_addr)
+                        tpa.unary_arith("negi", value, dst_addr)
                     else:
                         raise errs.TplCompileError("Unexpected unary operator '{}'. ".format(self.op), self.lfp)
-                    return res_addr
+                    return
                 elif vt == typ.TYPE_FLOAT:
-                    res_addr = tpa.manager.allocate_stack(util.FLOAT_LEN)
                     if self.op == "neg":
-                        tpa.unary_arith("negf", value, res_addr)
+                        tpa.unary_arith("negf", value, dst_addr)
                     else:
                         raise errs.TplCompileError("Unexpected unary operator '{}'. ".format(self.op), self.lfp)
-                    return res_addr
+                    return
         elif self.op_type == UNA_LOGICAL:
             if isinstance(vt, typ.PrimitiveType):
-                res_addr = tpa.manager.allocate_stack(vt.length)
                 if self.op == "not":
                     if vt.t_name != "int":
                         raise errs.TplCompileError("Operator 'not' must take an int as value. ", self.lfp)
-                    tpa.unary_arith("not", value, res_addr)
+                    tpa.unary_arith("not", value, dst_addr)
                 else:
                     raise errs.TplCompileError("Unexpected unary operator '{}'. ".format(self.op), self.lfp)
-                return res_addr
+                return
         raise errs.TplCompileError(f"Unsupported unary operator '{self.op}'")
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         if self.op_type == UNA_ARITH:
             vt = self.value.evaluated_type(env, manager)
@@ -556,6 +659,8 @@ class UnaryOperator(UnaryExpr):
 
 
 class BinaryOperator(BinaryExpr):
+    __slots__ = ("op_type",)
+
     def __init__(self, op: str, op_type: int, lf):
         super().__init__(op, lf)
 
@@ -587,6 +692,13 @@ class BinaryOperator(BinaryExpr):
             tpa.convert_int_to_float(res_addr, src_addr)
             return res_addr
 
+        imm = self.immediate_operation(env, tpa.manager)
+        if imm is not None:
+            op_inst, value_node, value = imm
+            value_addr = convert_addr_to_int(value_node.evaluated_type(env, tpa.manager), value_node.compile(env, tpa))
+            tpa.i_binary_arith(op_inst, value_addr, value, dst_addr)
+            return
+
         if self.op_type == BIN_ARITH or self.op_type == BIN_LOGICAL:
             lt = self.left.evaluated_type(env, tpa.manager)
             rt = self.right.evaluated_type(env, tpa.manager)
@@ -625,25 +737,65 @@ class BinaryOperator(BinaryExpr):
                 int_int_to_int(self.op, left_addr, right_addr, dst_addr, tpa)
                 return
         elif self.op_type == BIN_LAZY:
-            # x and y: if x then y else 0
-            # x or y: if x then 1 else y
-            if self.op == "and":
-                ife = IfExpr(self.left, self.right, IntLiteral(util.ZERO_POS, self.lfp), self.lfp)
-            elif self.op == "or":
-                ife = IfExpr(self.left, IntLiteral(util.ONE_POS, self.lfp), self.right, self.lfp)
-            else:
-                raise errs.TplCompileError("Unexpected lazy operator. ", self.lfp)
-
-            if not ife.evaluated_type(env, tpa.manager).convertible_to(typ.TYPE_INT, self.lfp):
-                raise errs.TplCompileError("Cannot convert {} to {}. ".format(ife, typ.TYPE_INT), self.lfp)
-
-            ife.compile_to(env, tpa, dst_addr, dst_len)
+            self.lazy_if_expr(env, tpa.manager).compile_to(env, tpa, dst_addr, dst_len)
             return
 
         raise errs.TplCompileError(f"Unsupported binary operation {self.op} between "
                                    f"{self.left.evaluated_type(env, tpa.manager)} and "
                                    f"{self.right.evaluated_type(env, tpa.manager)}. ", self.lfp)
 
+    def lazy_if_expr(self, env: en.Environment, manager: tp.Manager):
+        """
+        :return: the if-expression equivalent to this lazy operation
+        """
+        # x and y: if x then y else 0
+        # x or y: if x then 1 else y
+        if self.op == "and":
+            ife = IfExpr(self.left, self.right, IntLiteral(util.ZERO_POS, self.lfp), self.lfp)
+        elif self.op == "or":
+            ife = IfExpr(self.left, IntLiteral(util.ONE_POS, self.lfp), self.right, self.lfp)
+        else:
+            raise errs.TplCompileError("Unexpected lazy operator. ", self.lfp)
+
+        if not ife.evaluated_type(env, manager).convertible_to(typ.TYPE_INT, self.lfp):
+            raise errs.TplCompileError("Cannot convert {} to {}. ".format(ife, typ.TYPE_INT), self.lfp)
+        return ife
+
+    def immediate_operation(self, env: en.Environment, manager: tp.Manager):
+        """
+        Finds the int operation with an int literal operand, which is compiled to an instruction with immediate value.
+
+        :return: (instruction, the other operand, value of the literal), or None if this is not such an operation
+        """
+        if self.op_type == BIN_ARITH:
+            table = INT_ARITH_TABLE
+        elif self.op_type == BIN_LOGICAL:
+            table = INT_LOGIC_TABLE
+        elif self.op_type == BIN_BITWISE:
+            table = INT_BIT_TABLE
+        else:
+            return None
+        if self.op not in table:
+            return None
+        op_inst = table[self.op]
+        if isinstance(self.right, IntLiteral):
+            if self.immediate_operand_type(self.left.evaluated_type(env, manager)):
+                return op_inst, self.left, self.right.int_value(manager)
+        elif isinstance(self.left, IntLiteral) and op_inst in INT_SWAPPED_TABLE:
+            if self.immediate_operand_type(self.right.evaluated_type(env, manager)):
+                return INT_SWAPPED_TABLE[op_inst], self.right, self.left.int_value(manager)
+        return None
+
+    def immediate_operand_type(self, t: typ.Type) -> bool:
+        """
+        Returns True iff the other operand of the int literal has a type accepted by the int operation,
+        the same as in 'compile_to'.
+        """
+        if self.op_type == BIN_BITWISE:
+            return t == typ.TYPE_INT
+        return isinstance(t, typ.PrimitiveType) and t.int_like()
+
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         if self.op_type == BIN_ARITH:
             lt = self.left.evaluated_type(env, manager)
@@ -678,6 +830,8 @@ class BinaryOperator(BinaryExpr):
 
 
 class BinaryOperatorAssignment(BinaryExpr, FakeNode):
+    __slots__ = ("op_type",)
+
     def __init__(self, op: str, op_type: int, lf):
         BinaryExpr.__init__(self, op, lf)
         FakeNode.__init__(self, lf)
@@ -686,6 +840,8 @@ class BinaryOperatorAssignment(BinaryExpr, FakeNode):
 
 
 class InstanceOfExpr(BinaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("instanceof", lf)
 
@@ -711,6 +867,8 @@ class InstanceOfExpr(BinaryExpr):
 
 
 class ReturnStmt(UnaryStmt):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("return", lf)
 
@@ -740,16 +898,23 @@ class ReturnStmt(UnaryStmt):
 
 
 class StarExpr(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("star", lf)
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
-        val = self.value.compile(env, tpa)
         self_t = self.evaluated_type(env, tpa.manager)
         res_addr = tpa.manager.allocate_stack(self_t.memory_length())
-        tpa.value_in_addr_op(val, self_t.memory_length(), res_addr, self_t.memory_length())
+        self.compile_to(env, tpa, res_addr, self_t.memory_length())
         return res_addr
 
+    def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
+        val = self.value.compile(env, tpa)
+        self_t = self.evaluated_type(env, tpa.manager)
+        tpa.value_in_addr_op(val, self_t.memory_length(), dst_addr, self_t.memory_length())
+
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         vt = self.value.evaluated_type(env, manager)
         if isinstance(vt, typ.PointerType):
@@ -759,25 +924,34 @@ class StarExpr(UnaryExpr):
 
     def definition_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         vt = self.value.definition_type(env, manager)
-        return typ.PointerType(vt)
+        return typ.pointer_type(vt)
 
 
 class AddrExpr(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("addr", lf)
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
-        val = self.value.compile(env, tpa)
         res_addr = tpa.manager.allocate_stack(util.PTR_LEN)
-        tpa.take_addr(val, res_addr)
+        self.compile_to(env, tpa, res_addr, util.PTR_LEN)
         return res_addr
 
+    def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
+        val = self.value.compile(env, tpa)
+        tpa.manager.keep(val)
+        tpa.take_addr(val, dst_addr)
+
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         vt = self.value.evaluated_type(env, manager)
-        return typ.PointerType(vt)
+        return typ.pointer_type(vt)
 
 
 class NewExpr(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("new", lf)
 
@@ -845,12 +1019,13 @@ class NewExpr(UnaryExpr):
                      Line(self.lfp, *args),
                      self.lfp).compile_to(env, tpa, dst_addr, dst_len)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         if isinstance(self.value, IndexingExpr):
             return self.value.definition_type(env, manager)
         if isinstance(self.value, FunctionCall):
-            return typ.PointerType(self.value.call_obj.definition_type(env, manager))
-        return typ.PointerType(self.value.definition_type(env, manager))
+            return typ.pointer_type(self.value.call_obj.definition_type(env, manager))
+        return typ.pointer_type(self.value.definition_type(env, manager))
 
     def _malloc_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         if isinstance(self.value, IndexingExpr):
@@ -861,6 +1036,8 @@ class NewExpr(UnaryExpr):
 
 
 class DelStmt(UnaryStmt):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("del", lf)
 
@@ -896,6 +1073,8 @@ class DelStmt(UnaryStmt):
 
 
 class YieldStmt(UnaryStmt):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("yield", lf)
 
@@ -904,6 +1083,8 @@ class YieldStmt(UnaryStmt):
 
 
 class AsExpr(BinaryExpr):
+    __slots__ = ()
+
     """
     Note that this expression may be used in multiple ways: cast / name changing
 
@@ -968,11 +1149,14 @@ class AsExpr(BinaryExpr):
         self.compile_to(env, tpa, dst_addr, dst_t.memory_length())
         return dst_addr
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return self.right.definition_type(env, manager)
 
 
 class InStmt(BinaryStmt):
+    __slots__ = ()
+
     def __init__(self, lfp):
         super().__init__("in", lfp)
 
@@ -981,6 +1165,8 @@ class InStmt(BinaryStmt):
 
 
 class DollarExpr(BinaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("$", lf)
 
@@ -1007,6 +1193,8 @@ class DollarExpr(BinaryExpr):
 
 
 class DotExpr(BinaryExpr):
+    __slots__ = ()
+
     """
     This operator is logically equivalent to (Unpack and get attribute).
 
@@ -1020,8 +1208,11 @@ class DotExpr(BinaryExpr):
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
         return DotExpr.compile_dot(self.left, self.right, env, tpa, self.lfp)
 
+    def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
+        DotExpr.compile_dot(self.left, self.right, env, tpa, self.lfp, res_ptr=dst_addr)
+
     @staticmethod
-    def compile_super(right_node, env: en.Environment, tpa: tp.TpaOutput, lf):
+    def compile_super(right_node, env: en.Environment, tpa: tp.TpaOutput, lf, res_ptr=None):
         method_env = env
         while not isinstance(method_env, en.MethodEnvironment):
             if method_env is None:
@@ -1038,38 +1229,39 @@ class DotExpr(BinaryExpr):
             pass
         elif isinstance(right_node, FunctionCall):
             return DotExpr.compile_fixed_method_call(
-                right_node, typ.PointerType(cur_method_cls_t.mro[1]), this_ptr, env, tpa, lf)
+                right_node, typ.pointer_type(cur_method_cls_t.mro[1]), this_ptr, env, tpa, lf, res_ptr=res_ptr)
 
         raise errs.TplCompileError("Super must follow a name or a call. ", lf)
 
     @staticmethod
     def compile_method_call(right_node, class_ptr_t, ins_ptr_addr, env: en.Environment, tpa: tp.TpaOutput,
-                            lf, class_offset=0):
+                            lf, class_offset=0, res_ptr=None):
         """
         Compiles a method call, with mro resolved at runtime.
+
+        :param res_ptr: address to write the returning value, a new one is allocated if None
+        :return: address of the returning value
         """
 
-        def inner_call(ct: typ.ClassType, right, generics):
+        def inner_call(ct: typ.ClassType, right, generic_t):
             right: FunctionCall
             name = right.get_name()
             arg_types = right_node.arg_types(env, tpa.manager)
             arg_types.insert(0, None)  # insert a positional arg of 'this'
             method_id, method_p, t = ct.find_method(name, arg_types, lf)
             DotExpr.check_permission(t.defined_class, t.permission, env, lf)
-            t: typ.MethodType = t.copy()
-            for i in range(len(t.param_types)):
-                pt = t.param_types[i]
-                if typ.is_generic(pt):
-                    t.param_types[i] = typ.replace_generic_with_real(pt, generics, lf)
-                # todo
-            res_ptr = tpa.manager.allocate_stack(t.rtype.memory_length())
+            if generic_t is None:
+                t: typ.MethodType = typ.instantiate_method(t, None, lf)
+            else:
+                t: typ.MethodType = generic_t.instantiate_method(t, lf)
+            rtn_addr = tpa.manager.allocate_stack(t.rtype.memory_length()) if res_ptr is None else res_ptr
             ea = right.evaluate_args(t, env, tpa, is_method=True)
             ea.insert(0, (ins_ptr_addr, util.PTR_LEN))
             if t.const or t.permission == PRIVATE:  # cannot be overridden, so call it directly
-                FunctionCall.call_ptr(method_p, ea, tpa, res_ptr, lf, t)
+                FunctionCall.call_ptr(method_p, ea, tpa, rtn_addr, lf, t)
             else:
-                tpa.call_method(ins_ptr_addr, method_id, ea, res_ptr, t.rtype.memory_length(), class_offset)
-            return res_ptr
+                tpa.call_method(ins_ptr_addr, method_id, ea, rtn_addr, t.rtype.memory_length(), class_offset)
+            return rtn_addr
 
         # print(class_offset)
         if isinstance(class_ptr_t, typ.PointerType):
@@ -1080,17 +1272,20 @@ class DotExpr(BinaryExpr):
             if isinstance(class_t, typ.ClassType):
                 return inner_call(class_t, right_node, None)
             elif isinstance(class_t, typ.GenericClassType):
-                return inner_call(class_t.base, right_node, class_t.generics)
+                return inner_call(class_t.base, right_node, class_t)
         raise errs.TplCompileError("Cannot make method call. ", lf)
 
     @staticmethod
     def compile_fixed_method_call(right_node, class_ptr_t, ins_ptr_addr, env: en.Environment,
-                                  tpa: tp.TpaOutput, lf):
+                                  tpa: tp.TpaOutput, lf, res_ptr=None):
         """
         Compiles a method call, with mro resolved at compile time.
 
         Note that if ins_ptr_addr == -1, it is a static method call.
         For example, Object.hash(obj)
+
+        :param res_ptr: address to write the returning value, a new one is allocated if None
+        :return: address of the returning value
         """
         is_method = ins_ptr_addr >= 0
         if isinstance(class_ptr_t, typ.PointerType):
@@ -1107,7 +1302,8 @@ class DotExpr(BinaryExpr):
                 full_name = util.name_with_path(
                     typ.function_poly_name(name, arg_types, method=True),  # do not modify 'method=True'
                     t.defined_class.file_path, t.defined_class)
-                res_ptr = tpa.manager.allocate_stack(t.rtype.memory_length())
+                if res_ptr is None:
+                    res_ptr = tpa.manager.allocate_stack(t.rtype.memory_length())
                 ea = right_node.evaluate_args(t, env, tpa, is_method=is_method)
                 if is_method:
                     ea.insert(0, (ins_ptr_addr, util.PTR_LEN))
@@ -1115,12 +1311,14 @@ class DotExpr(BinaryExpr):
                 return res_ptr
         raise errs.TplCompileError("Cannot make method call. ", lf)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return DotExpr.dot_right_t(self.left, self.right, env, manager, self.lfp)
 
     @staticmethod
-    def array_attributes(left_node, env: en.Environment, tpa: tp.TpaOutput, name: str, lf):
-        res_addr = tpa.manager.allocate_stack(util.INT_LEN)
+    def array_attributes(left_node, env: en.Environment, tpa: tp.TpaOutput, name: str, lf, res_addr=None):
+        if res_addr is None:
+            res_addr = tpa.manager.allocate_stack(util.INT_LEN)
         arr_ptr = left_node.compile(env, tpa)
         if name == "length":
             tpa.value_in_addr_op(arr_ptr, util.INT_LEN, res_addr, util.INT_LEN)
@@ -1130,37 +1328,45 @@ class DotExpr(BinaryExpr):
         raise errs.TplCompileError(f"Array type does not have attribute '{name}'. ", lf)
 
     @staticmethod
-    def class_attributes(left_node, env: en.Environment, tpa: tp.TpaOutput, name: str, lfp):
-        res_addr = tpa.manager.allocate_stack(util.INT_LEN)
+    def class_attributes(left_node, env: en.Environment, tpa: tp.TpaOutput, name: str, lfp, res_addr=None):
+        if res_addr is None:
+            res_addr = tpa.manager.allocate_stack(util.INT_LEN)
         class_ptr = left_node.compile(env, tpa)
         if name == "class":
-            tpa.assign_i(res_addr, class_ptr)
+            tpa.assign_addr(res_addr, class_ptr)
             return res_addr
 
         raise errs.TplCompileError(f"Class type does not have attribute '{name}'. ", lfp)
 
     # helper functions for dot
     @staticmethod
-    def compile_dot(left_node: Expression, right_node: Node, env: en.Environment, tpa: tp.TpaOutput, lf):
+    def compile_dot(left_node: Expression, right_node: Node, env: en.Environment, tpa: tp.TpaOutput, lf,
+                    res_ptr=None):
+        """
+        :param res_ptr: address to write the result, a new one is allocated if None
+        :return: address of the result
+        """
         if isinstance(left_node, SuperExpr):
-            return DotExpr.compile_super(right_node, env, tpa, lf)
+            return DotExpr.compile_super(right_node, env, tpa, lf, res_ptr=res_ptr)
         left_t = left_node.evaluated_type(env, tpa.manager)
         if isinstance(left_t, typ.PointerType):
             if isinstance(right_node, FunctionCall):
-                return DotExpr.compile_method_call(right_node, left_t, left_node.compile(env, tpa), env, tpa, lf)
+                return DotExpr.compile_method_call(right_node, left_t, left_node.compile(env, tpa), env, tpa, lf,
+                                                   res_ptr=res_ptr)
             attr_ptr, attr_t, const = DotExpr.get_dot_attr_and_type(left_node, right_node, env, tpa, lf)
 
-            res_ptr = tpa.manager.allocate_stack(attr_t.memory_length())
+            if res_ptr is None:
+                res_ptr = tpa.manager.allocate_stack(attr_t.memory_length())
             tpa.value_in_addr_op(attr_ptr, attr_t.memory_length(), res_ptr, attr_t.memory_length())
             return res_ptr
         elif isinstance(left_t, typ.ArrayType) and isinstance(right_node, NameNode):
-            return DotExpr.array_attributes(left_node, env, tpa, right_node.name, lf)
+            return DotExpr.array_attributes(left_node, env, tpa, right_node.name, lf, res_addr=res_ptr)
         elif isinstance(left_t, typ.ClassType):
             if isinstance(right_node, FunctionCall):  # call via Class.method(obj, ...)
                 return DotExpr.compile_fixed_method_call(right_node,
-                                                         typ.PointerType(left_t), -1, env, tpa, lf)
+                                                         typ.pointer_type(left_t), -1, env, tpa, lf, res_ptr=res_ptr)
             elif isinstance(right_node, NameNode):
-                return DotExpr.class_attributes(left_node, env, tpa, right_node.name, lf)
+                return DotExpr.class_attributes(left_node, env, tpa, right_node.name, lf, res_addr=res_ptr)
 
         raise errs.TplCompileError("Left side of dot must be a pointer to struct or an array. ", lf)
 
@@ -1194,9 +1400,7 @@ class DotExpr(BinaryExpr):
                     DotExpr.check_permission(class_t, perm, env, lf)
 
                     real_attr_ptr = tpa.manager.allocate_stack(util.INT_LEN)
-
-                    tpa.assign(real_attr_ptr, struct_addr)
-                    tpa.i_binary_arith("addi", real_attr_ptr, pos, real_attr_ptr)
+                    tpa.i_binary_arith("addi", struct_addr, pos, real_attr_ptr)
 
                     return real_attr_ptr, t, const
                 elif isinstance(struct_t, typ.GenericClassType):
@@ -1207,9 +1411,7 @@ class DotExpr(BinaryExpr):
                     DotExpr.check_permission(class_t, perm, env, lf)
 
                     real_attr_ptr = tpa.manager.allocate_stack(util.INT_LEN)
-
-                    tpa.assign(real_attr_ptr, struct_addr)
-                    tpa.i_binary_arith("addi", real_attr_ptr, pos, real_attr_ptr)
+                    tpa.i_binary_arith("addi", struct_addr, pos, real_attr_ptr)
 
                     return real_attr_ptr, t, const
 
@@ -1233,10 +1435,8 @@ class DotExpr(BinaryExpr):
                     return attr_t
                 elif isinstance(struct_t, typ.GenericClassType):
                     pos, attr_t, class_t, const, perm = struct_t.base.find_field(right_node.name, lf)
-                    if typ.is_generic(attr_t):
-                        return typ.replace_generic_with_real(attr_t, struct_t.generics, lf)
                     # todo: possibly problem
-                    return attr_t
+                    return struct_t.replace_generic_fields(attr_t, lf)
             elif isinstance(right_node, FunctionCall):
                 arg_types = right_node.arg_types(env, manager)
                 arg_types.insert(0, None)
@@ -1248,7 +1448,7 @@ class DotExpr(BinaryExpr):
                     name = right_node.get_name()
                     pos, ptr, t = struct_t.base.find_method(name, arg_types, lf)
                     t: typ.MethodType
-                    return typ.replace_generics_if(t.rtype, struct_t, lf)
+                    return struct_t.replace_generics(t.rtype, lf)
                     # if typ.is_generic(t.rtype):  # rtype such as *T;
                     #     return typ.replace_generic_with_real(t.rtype, struct_t.generics, lf)
                     # if typ.is_generic_type(t.rtype):
@@ -1269,6 +1469,8 @@ class DotExpr(BinaryExpr):
 
 
 class Assignment(BinaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("=", lf)
 
@@ -1303,6 +1505,7 @@ class Assignment(BinaryExpr):
         self.right.compile_to(env, tpa, left_addr, left_t.memory_length())
         return left_addr
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return self.right.evaluated_type(env, manager)
 
@@ -1346,6 +1549,8 @@ class Assignment(BinaryExpr):
 
 
 class Declaration(BinaryStmt):
+    __slots__ = ("level", "permission")
+
     def __init__(self, level, permission, lf):
         super().__init__(":", lf)
 
@@ -1364,7 +1569,7 @@ class Declaration(BinaryStmt):
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
         right_t = self.right.definition_type(env, tpa.manager)
         if isinstance(self.left, NameNode):
-            rel_addr = tpa.manager.allocate_stack(right_t.memory_length())
+            rel_addr = tpa.manager.allocate_var(right_t.memory_length())
             # print(right_t)
             if self.level == VAR_CONST:
                 env.define_const_set(self.left.name, right_t, rel_addr, self.lfp)
@@ -1394,6 +1599,8 @@ class Declaration(BinaryStmt):
 
 
 class QuickAssignment(BinaryStmt):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(":=", lf)
 
@@ -1404,13 +1611,15 @@ class QuickAssignment(BinaryStmt):
         if t == typ.TYPE_VOID_PTR:
             util.print_warning("Implicit quick assignment type.", self.lfp)
 
-        res_addr = tpa.manager.allocate_stack(t.memory_length())
+        res_addr = tpa.manager.allocate_var(t.memory_length())
         env.define_var_set(self.left.name, t, res_addr, self.lfp)
 
         self.right.compile_to(env, tpa, res_addr, t.memory_length())
 
 
 class RightArrowExpr(BinaryExpr):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__("->", lf)
 
@@ -1431,6 +1640,9 @@ class RightArrowExpr(BinaryExpr):
 
 
 class LambdaExpr(Expression):
+    __slots__ = ("params", "body", "lambda_id")
+    _fields = ("body", "params")
+
     def __init__(self, params: Line, body: Expression, lfp):
         super().__init__(lfp)
 
@@ -1458,6 +1670,7 @@ class LambdaExpr(Expression):
 
         return fn_ptr
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.LambdaType:
         fn_env = en.FunctionEnvironment(env, f"lambda {self.lfp}", None)
         param_types = []
@@ -1473,6 +1686,9 @@ class LambdaExpr(Expression):
 
 
 class FunctionDef(Expression):
+    __slots__ = ("name", "params", "rtype", "body", "parent_class", "abstract", "const", "permission", "inline", "annotations")
+    _fields = ("annotations", "body", "name", "params", "rtype")
+
     def __init__(self, name: Expression, params: Line, rtype: Expression, abstract: bool, const: bool,
                  permission: int, body: BlockStmt, lf):
         super().__init__(lf)
@@ -1562,6 +1778,9 @@ class FunctionDef(Expression):
 
 
 class ClassStmt(Statement):
+    __slots__ = ("name", "extensions", "template_nodes", "body", "abstract")
+    _fields = ("body", "extensions", "template_nodes")
+
     def __init__(self, name: str, extensions: Line, templates: Line, abstract: bool, body: BlockStmt, lfp):
         super().__init__(lfp)
 
@@ -1584,7 +1803,7 @@ class ClassStmt(Statement):
         :param tpa:
         :return:
         """
-        class_ptr = tpa.manager.allocate_stack(util.PTR_LEN)
+        class_ptr = tpa.manager.allocate_var(util.PTR_LEN)
         class_name_path = util.class_name_with_path(self.name, self.lfp.get_file())
 
         if class_name_path.endswith(f"lib{os.sep}lang.tp$String"):
@@ -1741,6 +1960,8 @@ class ClassStmt(Statement):
 
 
 class SuperExpr(Statement):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -1752,6 +1973,9 @@ class SuperExpr(Statement):
 
 
 class FunctionTypeExpr(Expression):
+    __slots__ = ("param_line",)
+    _fields = ("param_line",)
+
     def __init__(self, param_line: Line, lf):
         super().__init__(lf)
 
@@ -1768,6 +1992,9 @@ class FunctionTypeExpr(Expression):
 
 
 class GenericNode(Expression):
+    __slots__ = ("obj", "generics")
+    _fields = ("generics", "obj")
+
     def __init__(self, obj: Node, generics: Line, lf):
         super().__init__(lf)
 
@@ -1783,6 +2010,7 @@ class GenericNode(Expression):
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
         return self.obj.compile(env, tpa)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return self.definition_type(env, manager)
 
@@ -1834,6 +2062,9 @@ class GenericNode(Expression):
 
 
 class FunctionCall(Expression):
+    __slots__ = ("call_obj", "args")
+    _fields = ("args", "call_obj")
+
     def __init__(self, call_obj: Node, args: Line, lf):
         super().__init__(lf)
 
@@ -1909,6 +2140,7 @@ class FunctionCall(Expression):
         evaluated_args = self.evaluate_args(func_type, env, tpa)
         FunctionCall.call(self.call_obj, evaluated_args, env, tpa, dst_addr, self.lfp, func_type, func_ptr)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         placer = self.call_obj.evaluated_type(env, manager)
         if isinstance(placer, typ.SpecialCtfType):
@@ -2007,6 +2239,8 @@ class FunctionCall(Expression):
 
 
 class Nothing(Expression):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -2021,6 +2255,9 @@ class Nothing(Expression):
 
 
 class RequireStmt(Statement):
+    __slots__ = ("body",)
+    _fields = ("body",)
+
     def __init__(self, body, lf):
         super().__init__(lf)
 
@@ -2048,7 +2285,7 @@ class RequireStmt(Statement):
                             f"Cannot require name '{name}': name already defined in this scope. ", node.lfp)
                 else:
                     func_id, func_type = typ.NATIVE_FUNCTIONS[name]
-                    fn_ptr = tpa.manager.allocate_stack(util.PTR_LEN)
+                    fn_ptr = tpa.manager.allocate_var(util.PTR_LEN)
                     tpa.require_name(name, fn_ptr)
                     env.define_function(name, func_type, fn_ptr, node.lfp)
             else:
@@ -2059,6 +2296,9 @@ class RequireStmt(Statement):
 
 
 class IfStmt(Statement):
+    __slots__ = ("condition", "if_branch", "else_branch")
+    _fields = ("condition", "else_branch", "if_branch")
+
     def __init__(self, condition: Expression, if_branch: BlockStmt, else_branch, lf):
         super().__init__(lf)
 
@@ -2067,15 +2307,13 @@ class IfStmt(Statement):
         self.else_branch = else_branch
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
-        cond_addr = self.condition.compile(env, tpa)
-
         else_label = tpa.manager.label_manager.else_label()
         endif_label = tpa.manager.label_manager.endif_label()
 
         if self.else_branch:
-            tpa.if_zero_goto(cond_addr, else_label)
+            compile_condition_jump(self.condition, False, else_label, env, tpa)
         else:
-            tpa.if_zero_goto(cond_addr, endif_label)
+            compile_condition_jump(self.condition, False, endif_label, env, tpa)
 
         if_env = en.BlockEnvironment(env)
         self.if_branch.compile(if_env, tpa)
@@ -2102,6 +2340,9 @@ class IfStmt(Statement):
 
 
 class IfExpr(Expression):
+    __slots__ = ("condition", "then_expr", "else_expr")
+    _fields = ("condition", "else_expr", "then_expr")
+
     def __init__(self,
                  condition: Expression,
                  then_expr: Expression,
@@ -2122,26 +2363,23 @@ class IfExpr(Expression):
         return res_addr
 
     def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
-        cond_addr = self.condition.compile(env, tpa)
-
         else_label = tpa.manager.label_manager.else_label()
         endif_label = tpa.manager.label_manager.endif_label()
 
-        tpa.if_zero_goto(cond_addr, else_label)
+        compile_condition_jump(self.condition, False, else_label, env, tpa)
 
         if_env = en.BlockEnvironment(env)
-        then_addr = self.then_expr.compile(if_env, tpa)
-        tpa.assign(dst_addr, then_addr)
+        self.then_expr.compile_to(if_env, tpa, dst_addr, dst_len)
 
         tpa.write_format("goto", endif_label)
         tpa.write_format("label", else_label)
 
         else_env = en.BlockEnvironment(env)
-        else_addr = self.else_expr.compile(else_env, tpa)
-        tpa.assign(dst_addr, else_addr)
+        self.else_expr.compile_to(else_env, tpa, dst_addr, dst_len)
 
         tpa.write_format("label", endif_label)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         then_t = self.then_expr.evaluated_type(env, manager)
         else_t = self.else_expr.evaluated_type(env, manager)
@@ -2157,6 +2395,9 @@ class IfExpr(Expression):
 
 
 class WhileStmt(Statement):
+    __slots__ = ("condition", "body")
+    _fields = ("body", "condition")
+
     def __init__(self, condition: Expression, body: BlockStmt, lf):
         super().__init__(lf)
 
@@ -2170,8 +2411,7 @@ class WhileStmt(Statement):
         loop_env = en.LoopEnvironment(loop_title_label, end_label, env)
 
         tpa.write_format("label", loop_title_label)
-        cond_addr = self.condition.compile(env, tpa)
-        tpa.if_zero_goto(cond_addr, end_label)
+        compile_condition_jump(self.condition, False, end_label, env, tpa)
 
         self.body.compile(loop_env, tpa)
 
@@ -2186,6 +2426,9 @@ class WhileStmt(Statement):
 
 
 class ForEachStmt(Statement):
+    __slots__ = ("title", "body")
+    _fields = ("body", "title")
+
     def __init__(self, title: InStmt, body: BlockStmt, lfp):
         super().__init__(lfp)
 
@@ -2270,6 +2513,9 @@ class ForEachStmt(Statement):
 
 
 class ForStmt(Statement):
+    __slots__ = ("body", "init", "cond", "step")
+    _fields = ("body", "cond", "init", "step")
+
     def __init__(self, init, cond, step, body: BlockStmt, lfp):
         super().__init__(lfp)
 
@@ -2286,8 +2532,7 @@ class ForStmt(Statement):
         loop_env = en.LoopEnvironment(continue_label, end_label, env)
         self.init.compile(loop_env, tpa)
         tpa.write_format("label", loop_title_label)
-        cond = self.cond.compile(loop_env, tpa)
-        tpa.if_zero_goto(cond, end_label)
+        compile_condition_jump(self.cond, False, end_label, loop_env, tpa)
 
         self.body.compile(loop_env, tpa)
 
@@ -2304,6 +2549,8 @@ class ForStmt(Statement):
 
 
 class BreakStmt(Statement):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -2316,6 +2563,8 @@ class BreakStmt(Statement):
 
 
 class ContinueStmt(Statement):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -2328,6 +2577,8 @@ class ContinueStmt(Statement):
 
 
 class FallthroughStmt(Statement):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -2340,6 +2591,9 @@ class FallthroughStmt(Statement):
 
 
 class ExportStmt(Statement):
+    __slots__ = ("block",)
+    _fields = ("block",)
+
     def __init__(self, block: BlockStmt, lf):
         super().__init__(lf)
 
@@ -2369,6 +2623,9 @@ class ExportStmt(Statement):
 
 
 class ImportStmt(Statement):
+    __slots__ = ("file", "tree")
+    _fields = ("tree",)
+
     def __init__(self, file: str, tree: BlockStmt, lf):
         super().__init__(lf)
 
@@ -2376,16 +2633,27 @@ class ImportStmt(Statement):
         self.tree = tree
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
+        manager = tpa.manager
         module_env = en.ModuleEnvironment(env)
+        if manager.linker is not None:
+            manager.linker.enter_module(self.file, module_env, env)
+        importer_file = manager.module_file
+        manager.module_file = self.file
         self.tree.compile(module_env, tpa)
+        manager.module_file = importer_file
         if module_env.exports is not None:
             env.import_vars(module_env.exports, self.lfp)
+            if manager.linker is not None:
+                manager.linker.imported(env, module_env.exports)
 
     def __str__(self):
         return "import {}: {}".format(self.file, self.tree)
 
 
 class IndexingExpr(Expression):
+    __slots__ = ("indexing_obj", "args")
+    _fields = ("args", "indexing_obj")
+
     def __init__(self, indexing_obj: Node, args: Line, lf):
         super().__init__(lf)
 
@@ -2398,6 +2666,15 @@ class IndexingExpr(Expression):
         else:
             return self.indexing(env, tpa)
 
+    def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
+        if self.is_array_initialization(env):
+            super().compile_to(env, tpa, dst_addr, dst_len)
+        elif isinstance(self.indexing_obj.evaluated_type(env, tpa.manager), typ.ArrayType):
+            self.array_indexing(env, tpa, dst_addr)
+        else:
+            self.magic_get().compile_to(env, tpa, dst_addr, dst_len)
+
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         if self.is_array_initialization(env):
             return self.definition_type(env, manager)
@@ -2418,8 +2695,8 @@ class IndexingExpr(Expression):
     def definition_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         base = self.indexing_obj.definition_type(env, manager)
         if isinstance(base, typ.ClassType) or isinstance(base, typ.Generic) or isinstance(base, typ.GenericClassType):
-            base = typ.PointerType(base)
-        return typ.ArrayType(base)
+            base = typ.pointer_type(base)
+        return typ.array_type(base)
 
     def is_array_initialization(self, env: en.Environment):
         if isinstance(self.indexing_obj, IndexingExpr):
@@ -2436,9 +2713,10 @@ class IndexingExpr(Expression):
         else:
             return self.magic_get().compile(env, tpa)
 
-    def array_indexing(self, env, tpa):
+    def array_indexing(self, env, tpa, res_addr=None):
         mem_len = self.evaluated_type(env, tpa.manager).memory_length()
-        res_addr = tpa.manager.allocate_stack(mem_len)
+        if res_addr is None:
+            res_addr = tpa.manager.allocate_stack(mem_len)
         indexed_addr = self.get_indexed_addr(env, tpa)
 
         tpa.value_in_addr_op(indexed_addr, mem_len, res_addr, mem_len)
@@ -2456,8 +2734,7 @@ class IndexingExpr(Expression):
         index_addr = self._get_index_node(env, tpa.manager).compile(env, tpa)
 
         arith_addr = tpa.manager.allocate_stack(util.INT_LEN)
-        tpa.assign(arith_addr, index_addr)
-        tpa.i_binary_arith("muli", arith_addr, ele_t.memory_length(), arith_addr)
+        tpa.i_binary_arith("muli", index_addr, ele_t.memory_length(), arith_addr)
         tpa.i_binary_arith("addi", arith_addr, util.INT_LEN, arith_addr)  # this step skips the space storing array size
 
         tpa.binary_arith("addi", array_ptr_addr, arith_addr, util.INT_LEN, util.INT_LEN, arith_addr, util.INT_LEN)
@@ -2501,13 +2778,15 @@ class IndexingExpr(Expression):
         node = self._get_index_node(env, manager)
         if not isinstance(node, IntLiteral):
             raise errs.TplCompileError("Stack array type declaration must be an int literal. ", self.lfp)
-        return util.bytes_to_int(manager.literal[node.lit_pos: node.lit_pos + util.INT_LEN])
+        return node.int_value(manager)
 
     def __str__(self):
         return f"{self.indexing_obj}[{self.args}]"
 
 
 class PreIncDecOperator(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, op, lf):
         super().__init__(op, lf, True)
 
@@ -2542,6 +2821,7 @@ class PreIncDecOperator(UnaryExpr):
 
         return self.value.compile(env, tpa)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return self.value.evaluated_type(env, manager)
 
@@ -2550,6 +2830,8 @@ class PreIncDecOperator(UnaryExpr):
 
 
 class PostIncDecOperator(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, op, lf):
         super().__init__(op, lf, False)
 
@@ -2588,6 +2870,7 @@ class PostIncDecOperator(UnaryExpr):
 
         return v
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         return self.value.evaluated_type(env, manager)
 
@@ -2596,6 +2879,8 @@ class PostIncDecOperator(UnaryExpr):
 
 
 class DoWhileStmt(Statement):
+    __slots__ = ()
+
     def __init__(self, lf):
         super().__init__(lf)
 
@@ -2604,6 +2889,9 @@ class DoWhileStmt(Statement):
 
 
 class CaseStmt(FakeNode):
+    __slots__ = ("cond", "body")
+    _fields = ("body", "cond")
+
     def __init__(self, body: BlockStmt, lf, cond: Node = None):
         super().__init__(lf)
 
@@ -2621,6 +2909,9 @@ class CaseStmt(FakeNode):
 
 
 class CaseExpr(FakeNode):
+    __slots__ = ("cond", "body")
+    _fields = ("body", "cond")
+
     def __init__(self, body: Expression, lf, cond: Node = None):
         super().__init__(lf)
 
@@ -2638,6 +2929,9 @@ class CaseExpr(FakeNode):
 
 
 class SwitchStmt(Statement):
+    __slots__ = ("cond", "cases", "default_case")
+    _fields = ("cases", "cond", "default_case")
+
     def __init__(self, cond: Expression, cases: list, default_case: CaseStmt, lf):
         super().__init__(lf)
 
@@ -2646,6 +2940,24 @@ class SwitchStmt(Statement):
         self.default_case = default_case
 
     def compile(self, env: en.Environment, tpa: tp.TpaOutput):
+        values = switch_case_values(self, env, tpa.manager)
+        if values is not None:
+            end_case = tpa.manager.label_manager.end_case_label()
+            if self.default_case is None:
+                default_label = end_case
+            else:
+                default_label = tpa.manager.label_manager.case_body_label()
+            body_labels = compile_switch_dispatch(self, values, default_label, env, tpa)
+            for case, body_label in zip(self.cases, body_labels):
+                tpa.write_format("label", body_label)
+                case.body.compile(en.CaseEnvironment(env), tpa)
+                tpa.write_format("goto", end_case)
+            if self.default_case is not None:
+                tpa.write_format("label", default_label)
+                self.default_case.body.compile(en.CaseEnvironment(env), tpa)
+            tpa.write_format("label", end_case)
+            return
+
         # cond_t = self.cond.evaluated_type(env, tpa.manager)
         eq_inst = "eqi"  # todo
 
@@ -2688,6 +3000,9 @@ class SwitchStmt(Statement):
 
 
 class SwitchExpr(Expression):
+    __slots__ = ("cond", "cases", "default_case")
+    _fields = ("cases", "cond", "default_case")
+
     def __init__(self, cond: Expression, cases: list, default_case: CaseExpr, lf):
         super().__init__(lf)
 
@@ -2702,6 +3017,20 @@ class SwitchExpr(Expression):
         return res_addr
 
     def compile_to(self, env: en.Environment, tpa: tp.TpaOutput, dst_addr: int, dst_len: int):
+        values = switch_case_values(self, env, tpa.manager)
+        if values is not None:
+            end_case = tpa.manager.label_manager.end_case_label()
+            default_label = tpa.manager.label_manager.case_body_label()
+            body_labels = compile_switch_dispatch(self, values, default_label, env, tpa)
+            for case, body_label in zip(self.cases, body_labels):
+                tpa.write_format("label", body_label)
+                case.body.compile_to(en.CaseEnvironment(env), tpa, dst_addr, dst_len)
+                tpa.write_format("goto", end_case)
+            tpa.write_format("label", default_label)
+            self.default_case.body.compile_to(en.CaseEnvironment(env), tpa, dst_addr, dst_len)
+            tpa.write_format("label", end_case)
+            return
+
         eq_inst = "eqi"  # todo
 
         cond_addr = self.cond.compile(env, tpa)
@@ -2732,6 +3061,7 @@ class SwitchExpr(Expression):
 
         tpa.write_format("label", end_case)
 
+    @cached_type
     def evaluated_type(self, env: en.Environment, manager: tp.Manager) -> typ.Type:
         t = self.default_case.body.evaluated_type(env, manager)
         for case in self.cases:
@@ -2831,12 +3161,10 @@ class ClassObject:
             pos = util.INT_LEN
         else:
             pos = mro[1].memory_length()
-            for m_name in mro[1].methods:
-                self.class_type.methods[m_name] = mro[1].methods[m_name].copy()
-            self.class_type.method_rank.extend(mro[1].method_rank)
+        self.class_type.inherit()
 
         # the class pointer
-        self.class_type.fields["class"] = 0, typ.TYPE_INT, self.class_type, True, PUBLIC
+        self.class_type.add_field("class", (0, typ.TYPE_INT, self.class_type, True, PUBLIC))
 
         def eval_declaration(dec: Declaration, cur_field_pos):
             dec_name = dec.get_name()
@@ -2844,7 +3172,8 @@ class ClassObject:
                 raise errs.TplCompileError(
                     f"Name '{dec_name}' already defined in class '{self.class_type.name}'. ", self.lfp)
             t = dec.right.definition_type(self.class_env, self.tpa.manager)
-            self.class_type.fields[dec_name] = cur_field_pos, t, self.class_type, dec.level == VAR_CONST, dec.permission
+            self.class_type.add_field(dec_name,
+                                      (cur_field_pos, t, self.class_type, dec.level == VAR_CONST, dec.permission))
             if dec_name == "chars" and self.class_type.full_name().endswith(f"lib{os.sep}lang.tp$String"):
                 self.tpa.manager.chars_pos_in_str = cur_field_pos
             return t.memory_length()
@@ -2950,17 +3279,17 @@ class ClassObject:
                         raise errs.TplCompileError(
                             f"Method '{name}' is const, which cannot be overridden. ", method_def.lfp
                         )
-                    self.class_type.methods[name][method_t] = m_pos, method_ptr, method_t
+                    self.class_type.local_methods(name)[method_t] = m_pos, method_ptr, method_t
                 else:  # polymorphism, same name but not override
-                    poly: util.NaiveDict = self.class_type.methods[name]
+                    poly: typ.OverloadIndex = self.class_type.local_methods(name)
                     self.class_type.method_rank.append((name, method_t))
                     poly[method_t] = method_id, method_ptr, method_t
                     method_id += 1
             else:
                 self.class_type.method_rank.append((name, method_t))
-                poly = util.NaiveDict(typ.params_eq_methods)
+                poly = typ.OverloadIndex(True)
                 poly[method_t] = method_id, method_ptr, method_t
-                self.class_type.methods[name] = poly
+                self.class_type.add_methods(name, poly)
                 method_id += 1
 
             ClassObject.check_annotations(method_def, is_overriding=overriding)
@@ -3082,6 +3411,35 @@ INT_BIT_TABLE = {
     "^": "xor"
 }
 
+# instruction: the instruction giving the negated result
+INT_NEGATED_TABLE = {
+    "eqi": "nei",
+    "nei": "eqi",
+    "gti": "lei",
+    "lti": "gei",
+    "gei": "lti",
+    "lei": "gti"
+}
+
+SWITCH_TABLE_MIN_CASES = 4  # fewer cases are dispatched by comparisons
+SWITCH_TABLE_MAX_SPARSITY = 3  # a jump table has at most this times entries as the count of case values
+SWITCH_LINEAR_CASES = 3  # a binary search compares values one by one when no more than this values left
+
+# instruction: the instruction giving the same result with swapped operands
+INT_SWAPPED_TABLE = {
+    "addi": "addi",
+    "muli": "muli",
+    "eqi": "eqi",
+    "nei": "nei",
+    "gti": "lti",
+    "lti": "gti",
+    "gei": "lei",
+    "lei": "gei",
+    "and": "and",
+    "or": "or",
+    "xor": "xor"
+}
+
 FLOAT_ARITH_TABLE = {
     "+": "addf",
     "-": "subf",
@@ -3134,6 +3492,139 @@ def float_float_to_float(op: str, left_addr: int, right_addr: int, res_addr: int
     tpa.binary_arith(op_inst, left_addr, right_addr, util.FLOAT_LEN, util.FLOAT_LEN, res_addr, util.FLOAT_LEN)
 
 
+def compile_condition_jump(cond: Expression, jump_if: bool, label: str, env: en.Environment, tpa: tp.TpaOutput):
+    """
+    Compiles a condition that jumps to the label if its truth value is 'jump_if', and goes on otherwise.
+
+    Int and float comparisons jump directly by compare-and-goto instructions, and lazy operators jump as soon as
+    one side decides the result, so these conditions never store their truth values.
+    """
+    while isinstance(cond, Line) and len(cond) == 1:
+        cond = cond[0]
+    if isinstance(cond, BinaryOperator):
+        if cond.op_type == BIN_LAZY:
+            cond.lazy_if_expr(env, tpa.manager)
+            if (cond.op == "and") != jump_if:  # either side decides
+                compile_condition_jump(cond.left, jump_if, label, env, tpa)
+                compile_condition_jump(cond.right, jump_if, label, env, tpa)
+            else:
+                skip_label = tpa.manager.label_manager.general_label()
+                compile_condition_jump(cond.left, not jump_if, skip_label, env, tpa)
+                compile_condition_jump(cond.right, jump_if, label, env, tpa)
+                tpa.write_format("label", skip_label)
+            return
+        if cond.op_type == BIN_LOGICAL and cond.op in INT_LOGIC_TABLE:
+            lt = cond.left.evaluated_type(env, tpa.manager)
+            rt = cond.right.evaluated_type(env, tpa.manager)
+            if lt == typ.TYPE_INT and rt == typ.TYPE_INT:
+                op_inst = INT_LOGIC_TABLE[cond.op] if jump_if else INT_NEGATED_TABLE[INT_LOGIC_TABLE[cond.op]]
+                left_addr = cond.left.compile(env, tpa)
+                if isinstance(cond.right, IntLiteral):
+                    tpa.i_compare_goto(op_inst, left_addr, cond.right.int_value(tpa.manager), label)
+                else:
+                    tpa.compare_goto(op_inst, left_addr, cond.right.compile(env, tpa), label)
+                return
+            if lt == typ.TYPE_FLOAT and rt == typ.TYPE_FLOAT:
+                op_inst = FLOAT_LOGIC_TABLE[cond.op]
+                left_addr = cond.left.compile(env, tpa)
+                right_addr = cond.right.compile(env, tpa)
+                if jump_if:
+                    tpa.compare_goto(op_inst, left_addr, right_addr, label)
+                elif op_inst == "eqf" or op_inst == "nef":
+                    tpa.compare_goto("nef" if op_inst == "eqf" else "eqf", left_addr, right_addr, label)
+                else:  # not negated, since comparisons with nan are always false
+                    skip_label = tpa.manager.label_manager.general_label()
+                    tpa.compare_goto(op_inst, left_addr, right_addr, skip_label)
+                    tpa.write_format("goto", label)
+                    tpa.write_format("label", skip_label)
+                return
+    elif isinstance(cond, UnaryOperator) and cond.op_type == UNA_LOGICAL and cond.op == "not" and \
+            cond.value.evaluated_type(env, tpa.manager) == typ.TYPE_INT:
+        compile_condition_jump(cond.value, not jump_if, label, env, tpa)
+        return
+
+    cond_addr = cond.compile(env, tpa)
+    if jump_if:
+        tpa.i_compare_goto("nei", cond_addr, 0, label)
+    else:
+        tpa.if_zero_goto(cond_addr, label)
+
+
+def switch_case_values(switch, env: en.Environment, manager: tp.Manager):
+    """
+    :param switch: a SwitchStmt or a SwitchExpr
+    :return: values of all cases if the switch is on an int or a char, and every case is a literal of that type,
+    otherwise None
+    """
+    cond_t = switch.cond.evaluated_type(env, manager)
+    if cond_t == typ.TYPE_INT:
+        lit_class = IntLiteral
+    elif cond_t == typ.TYPE_CHAR:
+        lit_class = CharLiteral
+    else:
+        return None
+    values = []
+    for case in switch.cases:
+        if type(case.cond) is lit_class:
+            values.append(case.cond.int_value(manager))
+        elif lit_class is IntLiteral and isinstance(case.cond, UnaryOperator) and case.cond.op == "neg" and \
+                type(case.cond.value) is IntLiteral:
+            values.append(-case.cond.value.int_value(manager))
+        else:
+            return None
+    return values
+
+
+def compile_switch_dispatch(switch, values: list, default_label: str, env: en.Environment, tpa: tp.TpaOutput) -> list:
+    """
+    Compiles the jumps from the condition of a switch to its case bodies.
+
+    Dense case values are dispatched through a jump table, others through a binary search of the values.
+
+    :param switch: a SwitchStmt or a SwitchExpr
+    :param values: values of the cases, see 'switch_case_values'
+    :param default_label: label to jump if no case matches
+    :return: labels of the case bodies, in the order of cases
+    """
+    cond_addr = switch.cond.compile(env, tpa)
+    if switch.cond.evaluated_type(env, tpa.manager) == typ.TYPE_CHAR:
+        int_addr = tpa.manager.allocate_stack(util.INT_LEN)
+        tpa.convert_char_to_int(int_addr, cond_addr)
+        cond_addr = int_addr
+
+    body_labels = [tpa.manager.label_manager.case_body_label() for _ in switch.cases]
+    targets = {}  # value: body label of the first case of this value
+    for value, body_label in zip(values, body_labels):
+        if value not in targets:
+            targets[value] = body_label
+    keys = sorted(targets)
+
+    if len(keys) >= SWITCH_TABLE_MIN_CASES and keys[-1] - keys[0] < len(keys) * SWITCH_TABLE_MAX_SPARSITY:
+        labels = [targets.get(value, default_label) for value in range(keys[0], keys[-1] + 1)]
+        tpa.table_goto(cond_addr, keys[0], labels, default_label)
+    else:
+        arith_addr = tpa.manager.allocate_stack(util.INT_LEN)
+        compile_case_search(keys, targets, cond_addr, arith_addr, default_label, tpa)
+    return body_labels
+
+
+def compile_case_search(keys: list, targets: dict, cond_addr: int, arith_addr: int, default_label: str,
+                        tpa: tp.TpaOutput):
+    if len(keys) <= SWITCH_LINEAR_CASES:
+        for value in keys:
+            tpa.i_binary_arith("nei", cond_addr, value, arith_addr)
+            tpa.if_zero_goto(arith_addr, targets[value])
+        tpa.write_format("goto", default_label)
+    else:
+        mid = len(keys) // 2
+        right_label = tpa.manager.label_manager.case_label()
+        tpa.i_binary_arith("lti", cond_addr, keys[mid], arith_addr)
+        tpa.if_zero_goto(arith_addr, right_label)
+        compile_case_search(keys[:mid], targets, cond_addr, arith_addr, default_label, tpa)
+        tpa.write_format("label", right_label)
+        compile_case_search(keys[mid:], targets, cond_addr, arith_addr, default_label, tpa)
+
+
 def array_creation(node, env: en.Environment, tpa: tp.TpaOutput) -> int:
     res_addr = tpa.manager.allocate_stack(util.PTR_LEN)
 
@@ -3162,7 +3653,7 @@ def create_array_rec(this_ptr_addr, atom_t: typ.Type, dimensions: list, index_in
         ele_len = atom_t.memory_length()
     else:
         ele_len = util.PTR_LEN
-    arr_addr = tpa.manager.allocate_stack(ele_len * arr_size + util.INT_LEN)
+    arr_addr = tpa.manager.allocate_var(ele_len * arr_size + util.INT_LEN)
     tpa.assign_i(arr_addr, arr_size)
     tpa.take_addr(arr_addr, this_ptr_addr)
 
@@ -1,3 +1,4 @@
+import heapq
 import compilers.tokens_lib as tl
 import compilers.errors as errs
 import compilers.ast as ast
@@ -54,42 +55,62 @@ class AstBuilder:
         return self.active
 
     def build_expr(self):
-        while True:
-            max_pre = -1
-            index = 0
-            for i in range(len(self.stack)):
-                node = self.stack[i]
-                if isinstance(node, ast.Buildable) and not node.fulfilled():
-                    pre = PRECEDENCES[node.op]
-                    if isinstance(node, ast.UnaryBuildable):
-                        # eval right side unary operator first
-                        # for example, "- -3" is -(-3)
-                        if pre >= max_pre:
-                            max_pre = pre
-                            index = i
-                    else:
-                        # eval left side binary operator first
-                        # for example, "2 * 8 / 4" is (2 * 8) / 4
-                        if pre > max_pre:
-                            max_pre = pre
-                            index = i
-
-            if max_pre == -1:
-                break
-
-            expr = self.stack[index]
+        """
+        Builds all unfulfilled operators in the stack, from the highest precedence to the lowest.
+
+        Among operators of the same precedence, unary operators are built first, from right to left, for example
+        "- -3" is -(-3). Then binary operators from left to right, for example "2 * 8 / 4" is (2 * 8) / 4.
+        """
+        stack = self.stack
+        length = len(stack)
+        prev_index = list(range(-1, length - 1))
+        next_index = list(range(1, length + 1))
+        next_index[-1] = -1
+        removed = [False] * length
+
+        heap = []
+        for i, node in enumerate(stack):
+            if isinstance(node, ast.Buildable) and not node.fulfilled():
+                if isinstance(node, ast.UnaryBuildable):
+                    heap.append((-PRECEDENCES[node.op], 0, -i, i))
+                else:
+                    heap.append((-PRECEDENCES[node.op], 1, i, i))
+        heapq.heapify(heap)
+
+        def pop_at(index):
+            removed[index] = True
+            before = prev_index[index]
+            after = next_index[index]
+            if before != -1:
+                next_index[before] = after
+            if after != -1:
+                prev_index[after] = before
+            return stack[index]
+
+        while heap:
+            index = heapq.heappop(heap)[3]
+            if removed[index]:  # already taken as the operand of another operator
+                continue
+            expr = stack[index]
             if isinstance(expr, ast.UnaryBuildable):
                 if expr.operator_at_left:
-                    if expr.nullable() and len(self.stack) <= index + 1:
-                        value = ast.Nothing(expr.lfp)
+                    if next_index[index] != -1:
+                        expr.value = pop_at(next_index[index])
+                    elif expr.nullable():
+                        expr.value = ast.Nothing(expr.lfp)
                     else:
-                        value = self.stack.pop(index + 1)
+                        raise errs.TplParseError(f"Operator '{expr.op}' has no operand. ", expr.lfp)
                 else:
-                    value = self.stack.pop(index - 1)
-                expr.value = value
-            elif isinstance(expr, ast.BinaryBuildable):
-                expr.right = self.stack.pop(index + 1)
-                expr.left = self.stack.pop(index - 1)
+                    if prev_index[index] == -1:
+                        raise errs.TplParseError(f"Operator '{expr.op}' has no operand. ", expr.lfp)
+                    expr.value = pop_at(prev_index[index])
+            else:
+                if prev_index[index] == -1 or next_index[index] == -1:
+                    raise errs.TplParseError(f"Operator '{expr.op}' requires 2 operands. ", expr.lfp)
+                expr.right = pop_at(next_index[index])
+                expr.left = pop_at(prev_index[index])
+
+        stack[:] = [node for i, node in enumerate(stack) if not removed[i]]
 
 
 def parse_switch(cond: ast.Expression, body: ast.BlockStmt, lf):
@@ -1,10 +1,15 @@
 import compilers.ast as ast
+import compilers.ast_visitor as av
 import compilers.util as util
 
 
-class AstPreprocessor:
-    def __init__(self, root: ast.BlockStmt):
+class AstPreprocessor(av.AstTransformer):
+    def __init__(self, root: ast.BlockStmt, module_objects=None):
+        super().__init__()
+
         self.root = root
+        self.module_objects = module_objects  # compilers.module_object.ModuleObjects
+        self.relocations = []  # relocation records of the module objects being made, innermost at last
 
         self.literal_bytes = util.initial_literal()
 
@@ -14,82 +19,128 @@ class AstPreprocessor:
         self.byte_literals = {}
         self.str_literals = {}
 
+        self.visitors[ast.FakeLiteral] = self.process_fake_literal
+        self.visitors[ast.BinaryOperatorAssignment] = self.process_binary_operator_assignment
+        self.visitors[ast.DotExpr] = self.process_dot
+        self.visitors[ast.LambdaExpr] = self.process_lambda
+        if self.module_objects is not None:
+            self.visitors[ast.ImportStmt] = self.process_import
+
     def preprocess(self) -> (ast.Node, bytearray, dict):
-        return self.process_node(self.root), self.literal_bytes, self.str_literals
+        return self.visit(self.root), self.literal_bytes, self.str_literals
 
-    def process_node(self, node: ast.Node) -> ast.Node:
-        if isinstance(node, ast.FakeIntLit):
-            if node.value in self.int_literals:
-                pos = self.int_literals[node.value]
-            else:
-                pos = len(self.literal_bytes)
-                self.literal_bytes.extend(util.int_to_bytes(node.value))
-                self.int_literals[node.value] = pos
-            return ast.IntLiteral(pos, node.lfp)
-        elif isinstance(node, ast.FakeFloatLit):
-            if node.value in self.float_literals:
-                pos = self.float_literals[node.value]
-            else:
-                pos = len(self.literal_bytes)
-                self.literal_bytes.extend(util.float_to_bytes(node.value))
-                self.float_literals[node.value] = pos
-            return ast.FloatLiteral(pos, node.lfp)
-        elif isinstance(node, ast.FakeCharLit):
-            if node.value in self.char_literals:
-                pos = self.char_literals[node.value]
-            else:
-                pos = len(self.literal_bytes)
-                self.literal_bytes.extend(util.char_to_bytes(node.value))
-                self.char_literals[node.value] = pos
-            return ast.CharLiteral(pos, node.lfp)
-        elif isinstance(node, ast.FakeByteLit):
-            if node.value in self.byte_literals:
-                pos = self.byte_literals[node.value]
-            else:
-                pos = len(self.literal_bytes)
-                self.literal_bytes.append(node.value & 0xff)
-                self.byte_literals[node.value] = pos
-            return ast.ByteLiteral(pos, node.lfp)
-        elif isinstance(node, ast.FakeStrLit):
-            if node.value in self.str_literals:
-                pos = self.str_literals[node.value]
+    def literal_position(self, fake_lit_type, value) -> int:
+        if fake_lit_type is ast.FakeIntLit:
+            if value in self.int_literals:
+                return self.int_literals[value]
+            pos = len(self.literal_bytes)
+            self.literal_bytes.extend(util.int_to_bytes(value))
+            self.int_literals[value] = pos
+        elif fake_lit_type is ast.FakeFloatLit:
+            if value in self.float_literals:
+                return self.float_literals[value]
+            pos = len(self.literal_bytes)
+            self.literal_bytes.extend(util.float_to_bytes(value))
+            self.float_literals[value] = pos
+        elif fake_lit_type is ast.FakeCharLit:
+            if value in self.char_literals:
+                return self.char_literals[value]
+            pos = len(self.literal_bytes)
+            self.literal_bytes.extend(util.char_to_bytes(value))
+            self.char_literals[value] = pos
+        elif fake_lit_type is ast.FakeByteLit:
+            if value in self.byte_literals:
+                return self.byte_literals[value]
+            pos = len(self.literal_bytes)
+            self.literal_bytes.append(value & 0xff)
+            self.byte_literals[value] = pos
+        else:
+            if value in self.str_literals:
+                return self.str_literals[value]
+            pos = len(self.literal_bytes)
+            str_bytes = util.empty_bytes(util.STRING_HEADER_LEN) + util.string_to_bytes(value)
+            self.literal_bytes.extend(str_bytes)
+            self.str_literals[value] = pos
+        return pos
+
+    def literal_symbols(self) -> dict:
+        """
+        :return: position: (fake literal class, value), of all literals, the inverse of 'literal_position'
+        """
+        symbols = {}
+        for kind, literals in ((ast.FakeIntLit, self.int_literals), (ast.FakeFloatLit, self.float_literals),
+                               (ast.FakeCharLit, self.char_literals), (ast.FakeByteLit, self.byte_literals),
+                               (ast.FakeStrLit, self.str_literals)):
+            for value, pos in literals.items():
+                symbols[pos] = kind, value
+        return symbols
+
+    def record(self, node: ast.Node, kind, value):
+        for relocations in self.relocations:
+            relocations.append((node, kind, value))
+
+    def link_module(self, file: str) -> ast.BlockStmt:
+        """
+        Loads the object of an imported module, and assigns the final literal positions and lambda ids to it.
+        """
+        tree, relocations = self.module_objects.load(file)
+        for node, kind, value in relocations:
+            if kind is ast.LambdaExpr:
+                node.lambda_id = ast.LAMBDA_COUNTER.increment()
             else:
-                pos = len(self.literal_bytes)
-                str_bytes = util.empty_bytes(util.STRING_HEADER_LEN) + util.string_to_bytes(node.value)
-                self.literal_bytes.extend(str_bytes)
-                self.str_literals[node.value] = pos
-            return ast.StringLiteral(pos, node.lfp)
-        elif isinstance(node, ast.BinaryOperatorAssignment):
-            left = self.process_node(node.left)
-            right = self.process_node(node.right)
-            bo = ast.BinaryOperator(node.op[:-1], node.op_type, node.lfp)
-            bo.left = left
-            bo.right = right
-            ass = ast.Assignment(node.lfp)
-            ass.left = left
-            ass.right = bo
-            return ass
-        elif isinstance(node, ast.DotExpr):
-            left = self.process_node(node.left)
-            right = self.process_node(node.right)
-            if isinstance(right, ast.IndexingExpr):
-                new_dot = ast.DotExpr(node.lfp)
-                new_dot.left = left
-                new_dot.right = right.indexing_obj
-                return ast.IndexingExpr(new_dot, right.args, node.lfp)
-
-            node.left = left
-            node.right = right
-            return node
-
-        attrs = dir(node)
-
-        for attr_name in attrs:
-            attr = getattr(node, attr_name)
-            if isinstance(attr, ast.Node):
-                setattr(node, attr_name, self.process_node(attr))
-            elif isinstance(attr, list):
-                for i in range(len(attr)):
-                    attr[i] = self.process_node(attr[i])
+                node.lit_pos = self.literal_position(kind, value)
+            self.record(node, kind, value)
+        return tree
 
+    def process_fake_literal(self, node: ast.FakeLiteral):
+        lit = LITERAL_NODES[type(node)](self.literal_position(type(node), node.value), node.lfp)
+        self.record(lit, type(node), node.value)
+        return lit
+
+    def process_import(self, node: ast.ImportStmt):
+        if node.tree is None:
+            node.tree = self.link_module(node.file)
+        elif self.module_objects.can_store(node.file):
+            self.relocations.append([])
+            node.tree = self.visit(node.tree)
+            self.module_objects.store(node.file, node.tree, self.relocations.pop())
+        else:
+            node.tree = self.visit(node.tree)
+        return node
+
+    def process_binary_operator_assignment(self, node: ast.BinaryOperatorAssignment):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        bo = ast.BinaryOperator(node.op[:-1], node.op_type, node.lfp)
+        bo.left = left
+        bo.right = right
+        ass = ast.Assignment(node.lfp)
+        ass.left = left
+        ass.right = bo
+        return ass
+
+    def process_dot(self, node: ast.DotExpr):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        if isinstance(right, ast.IndexingExpr):
+            new_dot = ast.DotExpr(node.lfp)
+            new_dot.left = left
+            new_dot.right = right.indexing_obj
+            return ast.IndexingExpr(new_dot, right.args, node.lfp)
+
+        node.left = left
+        node.right = right
         return node
+
+    def process_lambda(self, node: ast.LambdaExpr):
+        self.record(node, ast.LambdaExpr, node.lambda_id)
+        return self.generic_visit(node)
+
+
+LITERAL_NODES = {
+    ast.FakeIntLit: ast.IntLiteral,
+    ast.FakeFloatLit: ast.FloatLiteral,
+    ast.FakeCharLit: ast.CharLiteral,
+    ast.FakeByteLit: ast.ByteLiteral,
+    ast.FakeStrLit: ast.StringLiteral
+}
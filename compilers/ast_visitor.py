@@ -0,0 +1,51 @@
+import compilers.ast as ast
+
+
+class AstTransformer:
+    """
+    Base class of the passes that walk through the whole syntax tree.
+
+    A subclass registers its functions in 'visitors', each of them takes a node and returns the node that replaces it.
+    A function registered for a class also applies to its subclasses. Nodes without a function are not replaced,
+    only their children are visited, see 'generic_visit'.
+    """
+    def __init__(self):
+        self.visitors = {}  # node class: function(node) -> node
+        self._dispatch = {}  # node class: function, resolved from 'visitors'
+
+    def visit(self, node):
+        node_type = type(node)
+        if node_type in self._dispatch:
+            return self._dispatch[node_type](node)
+        return self._resolve(node_type)(node)
+
+    def generic_visit(self, node: ast.Node) -> ast.Node:
+        """
+        Visits all children of the node, in the order of its '_fields'.
+
+        :return: the node itself
+        """
+        for field in node._fields:
+            child = getattr(node, field)
+            if isinstance(child, ast.Node):
+                setattr(node, field, self.visit(child))
+            elif isinstance(child, list):
+                for i in range(len(child)):
+                    child[i] = self.visit(child[i])
+        return node
+
+    def _resolve(self, node_type):
+        if issubclass(node_type, ast.Node):
+            fn = self.generic_visit
+            for cls in node_type.__mro__:
+                if cls in self.visitors:
+                    fn = self.visitors[cls]
+                    break
+        else:
+            fn = _keep
+        self._dispatch[node_type] = fn
+        return fn
+
+
+def _keep(obj):
+    return obj
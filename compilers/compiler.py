@@ -5,6 +5,7 @@ import compilers.types as typ
 import compilers.errors as errs
 import compilers.tokens_lib as tl
 import compilers.util as util
+import compilers.assembly as asm
 
 MAIN_FN_ERR_MSG = "Main function should be one of\n" + \
                   "main() int, main(void) int, main(args: char[][]) int, " + \
@@ -13,20 +14,27 @@ MAIN_FN_ERR_MSG = "Main function should be one of\n" + \
 
 class Compiler:
     def __init__(self, root: ast.BlockStmt, literals: bytes, str_lit_pos: dict,
-                 main_file_path: str, optimize_level: int):
+                 main_file_path: str, optimize_level: int, linker=None):
+        """
+        :param linker: compilers.linker.Linker, links the functions of unchanged modules from their code objects
+        """
         self.root = root
         self.literals = literals
         self.str_lit_pos = str_lit_pos
         self.main_path = main_file_path
         self.optimize_level = optimize_level
+        self.linker = linker
 
         ast.set_optimize_level(optimize_level)
 
-    def compile(self) -> str:
+    def compile(self) -> asm.AsmProgram:
         manager = prod.Manager(self.literals, self.str_lit_pos, self.optimize_level)
         out = prod.TpaOutput(manager, is_global=True)
         ge = en.GlobalEnvironment()
         _init_compile_time_functions(ge, out)
+        manager.module_file = self.main_path
+        if self.linker is not None:
+            self.linker.begin(manager)
 
         env = en.MainEnvironment(ge)
 
@@ -53,8 +61,7 @@ class Compiler:
         if main_fn.rtype != typ.TYPE_INT and main_fn.rtype != typ.TYPE_VOID:
             raise errs.TplCompileError(MAIN_FN_ERR_MSG)
 
-        res = out.result()
-        return "\n".join(res)
+        return out.result()
 
 
 def _init_compile_time_functions(env: en.GlobalEnvironment, tpa):
@@ -0,0 +1,321 @@
+"""
+Links the code of unchanged imported modules into the program.
+
+After a compile, the tpa of the functions of each imported module is stored as the code object of the module, along
+with their assembled bytes at -o0. When the module and the files included before it are unchanged, the next compile
+still compiles the declarations and classes of the module, so that the program is laid out as usual, but the functions
+of the module are not compiled again: their code is loaded from the object and relocated.
+
+Every operand that depends on the rest of the program is kept as a relocation:
+
+- globals, such as function pointers, class pointers and global variables, as the module owning the global, the index
+  of the global in that module and the offset, see 'Manager.global_symbol'
+- literals as their kind and value, whose positions are assigned by the AstPreprocessor
+- names of called functions that contain lambda ids, which are assigned again in each compile
+
+and the assembled bytes keep the position of every address operand, which is patched with the address in the tpc.
+
+An object is linked only if the names that the module resolved from outside itself still resolve to the files included
+before it, or to the imports made before it, the names it did not find are still undefined, and no function it can see
+is overloaded outside of these files. Otherwise the module is compiled and its object is replaced.
+"""
+
+import re
+import compilers.ast as ast
+import compilers.util as util
+import compilers.assembly as asm
+import compilers.environment as en
+import compilers.tpc_compiler as tpc
+
+LAMBDA_ID = re.compile(r"lambda#(\d+)")
+
+
+class StaleObjectError(Exception):
+    """
+    Raised when a linked object turns out not to match the program, the program is then compiled without linking.
+    """
+
+
+class LinkedFunction:
+    """
+    Stands in 'Manager.functions_map' for a function nested in a linked function, its code is in the object.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class ModuleCode:
+    """
+    The code of an imported module in one compile.
+    """
+
+    def __init__(self, file: str, env: en.ModuleEnvironment, importer: en.Environment, visible: dict):
+        self.file = file
+        self.env = env
+        self.importer = importer  # the environment importing this module
+        self.visible = visible  # name: entry, of the names imported into the main environment before this module
+        self.linked = None  # whether the functions are linked, decided when the first function is compiled
+        self.names = None  # names resolved from outside, as stored in the linked object
+        self.code = None  # functions in the linked object, in the order of compiling
+        self.next = 0  # index of the next function to link in 'code'
+        self.lambdas = {}  # lambda id in the object: lambda id in this compile
+        self.compiled = []  # (name, AsmFunction, lengths of allocated globals, nested function names)
+        self.storable = True
+
+
+class Linker:
+    def __init__(self, module_objects, preprocessor, optimize_level: int):
+        """
+        :param module_objects: compilers.module_object.ModuleObjects, where the code objects are stored
+        :param preprocessor: the AstPreprocessor of this program, which assigns the literal positions
+        :param optimize_level: optimization level, the assembled bytes are only kept at level 0
+        """
+        self.objects = module_objects
+        self.preprocessor = preprocessor
+        self.optimize_level = optimize_level
+        self.manager = None
+        self.modules = {}  # file: ModuleCode
+        self.imports = {}  # main environment: {name: entry} of the names imported into it
+        self.object_code = {}  # function name: assembled code in object, or None to be assembled and kept
+        self.pending = []  # (file, code object) to store once the program is assembled
+
+    def begin(self, manager):
+        self.manager = manager
+        manager.linker = self
+
+    def enter_module(self, file: str, module_env: en.ModuleEnvironment, importer: en.Environment):
+        if not self.objects.can_store(file):
+            return
+        visible = {}
+        env = importer
+        while env is not None:
+            if isinstance(env, en.MainEnvironment):
+                visible.update(self.imports.get(env, {}))
+            env = env.outer
+        self.modules[file] = ModuleCode(file, module_env, importer, visible)
+
+    def imported(self, env: en.Environment, exports: dict):
+        if isinstance(env, en.MainEnvironment):
+            imports = self.imports.setdefault(env, {})
+            for name in exports:
+                if env.vars.get(name) is exports[name]:
+                    imports[name] = exports[name]
+
+    def compile_function(self, name: str, function_object) -> asm.AsmFunction:
+        """
+        Compiles a function of 'Manager.functions_map', or links it if its module is linked.
+        """
+        module = self.modules.get(self.manager.module_file)
+        if module is None:
+            return function_object.compile()
+        if module.linked is None:
+            module.linked = self.load(module)
+        if module.linked:
+            return self.link(module, name, function_object)
+
+        manager = self.manager
+        globals_before = len(manager.module_globals.get(module.file, ()))
+        order_before = len(manager.class_func_order)
+        classes_before = len(manager.class_headers)
+        fn = function_object.compile()
+        if len(manager.class_headers) != classes_before:
+            module.storable = False
+        lengths = [length for _, length in manager.module_globals.get(module.file, ())[globals_before:]]
+        nested = [nested_name for nested_name, _ in manager.class_func_order[order_before:]]
+        module.compiled.append((name, fn, lengths, nested))
+        return fn
+
+    def load(self, module: ModuleCode) -> bool:
+        """
+        :return: whether the module has an object that can be linked in this program
+        """
+        if not self.objects.link_code:
+            return False
+        obj = self.objects.load_code(module.file)
+        if obj is None:
+            return False
+        names, missing, functions = obj
+        allowed = self.allowed_owners(module)
+        if not self.resolves(module, names) or not self.undefined(module, missing) or \
+                not self.overloads_in(module, names, allowed):
+            return False
+        module.names = names
+        module.code = functions
+        return True
+
+    def link(self, module: ModuleCode, name: str, function_object) -> asm.AsmFunction:
+        if module.next >= len(module.code):
+            raise StaleObjectError(f"Function '{name}' is not in the object of '{module.file}'.")
+        stored_name, ptr, body, inline, abstract, lengths, nested, global_relocs, literal_relocs, name_relocs, code = \
+            module.code[module.next]
+        module.next += 1
+        if LAMBDA_ID.sub("lambda#", stored_name) != LAMBDA_ID.sub("lambda#", name):
+            raise StaleObjectError(f"Function '{name}' does not match '{stored_name}' in the object.")
+        for old_id, new_id in zip(LAMBDA_ID.findall(stored_name), LAMBDA_ID.findall(name)):
+            module.lambdas[old_id] = new_id
+
+        manager = self.manager
+        for length in lengths:
+            manager.allocate_global(length)
+        for nested_name in nested:
+            linked_name = self.rename(module, nested_name)
+            manager.functions_map[linked_name] = LinkedFunction(linked_name)
+            manager.class_func_order.append((linked_name, 0))
+            manager.owners[linked_name] = module.file
+
+        try:
+            owner, index, offset = ptr
+            fn_ptr = manager.module_globals[owner][index][0] + offset
+            for i, j, owner, index, offset in global_relocs:
+                body[i][j] = "$" + str(manager.module_globals[owner][index][0] + offset)
+        except (KeyError, IndexError):
+            raise StaleObjectError(f"Function '{name}' refers to a global that is not in this program.")
+        if isinstance(function_object, ast.FunctionObject) and function_object.fn_ptr != fn_ptr:
+            raise StaleObjectError(f"Function '{name}' is not at its pointer in the object.")
+        for i, j, kind, value in literal_relocs:
+            body[i][j] = "$" + str(self.preprocessor.literal_position(kind, value))
+        for i, j in name_relocs:
+            body[i][j] = self.rename(module, body[i][j])
+
+        if code is not None:
+            self.object_code[name] = code
+        return asm.AsmFunction(name, "$" + str(fn_ptr), body, inline, abstract)
+
+    def rename(self, module: ModuleCode, name: str) -> str:
+        """
+        Replaces the lambda ids in the object by the ids in this compile.
+        """
+        def new_id(match):
+            old_id = match.group(1)
+            if old_id not in module.lambdas:
+                module.lambdas[old_id] = str(ast.LAMBDA_COUNTER.increment())
+            return "lambda#" + module.lambdas[old_id]
+
+        return LAMBDA_ID.sub(new_id, name)
+
+    def finish(self):
+        """
+        Checks the linked modules and makes the objects of the compiled modules, after all functions are compiled.
+        """
+        literals = None
+        for module in self.modules.values():
+            if module.linked:
+                if module.next != len(module.code) or \
+                        not self.overloads_in(module, module.names, self.allowed_owners(module)):
+                    raise StaleObjectError(f"Object of '{module.file}' does not match the program.")
+            elif module.linked is not None and module.storable:
+                if literals is None:
+                    literals = self.preprocessor.literal_symbols()
+                obj = self.make_object(module, literals)
+                if obj is not None:
+                    self.pending.append((module.file, obj))
+
+    def make_object(self, module: ModuleCode, literals: dict):
+        """
+        :return: the code object of a compiled module, or None if its code depends on files included after it
+        """
+        allowed = self.allowed_owners(module)
+        names = sorted(module.env.resolved)
+        missing = sorted(module.env.missing - module.env.vars.keys())
+        if not self.resolves(module, names) or not self.undefined(module, missing) or \
+                not self.overloads_in(module, names, allowed):
+            return None
+        manager = self.manager
+        functions = []
+        for name, fn, lengths, nested in module.compiled:
+            ptr = manager.global_symbol(int(fn.ptr[1:]))
+            if ptr[0] not in allowed:
+                return None
+            body = [list(inst) for inst in fn.body]
+            global_relocs = []
+            literal_relocs = []
+            name_relocs = []
+            for i, inst in enumerate(body):
+                mne = inst[0]
+                if mne in tpc.PSEUDO_INSTRUCTIONS:
+                    symbol = literals.get(int(inst[2][1:]))
+                    if symbol is None:
+                        return None
+                    literal_relocs.append((i, 2, symbol[0], symbol[1]))
+                elif mne == "call_fn":
+                    if LAMBDA_ID.search(inst[1]):
+                        name_relocs.append((i, 1))
+                else:
+                    for j in range(1, len(inst)):
+                        operand = inst[j]
+                        if operand.startswith("$") and int(operand[1:]) >= util.STACK_SIZE:
+                            symbol = manager.global_symbol(int(operand[1:]))
+                            if symbol[0] not in allowed:
+                                return None
+                            global_relocs.append((i, j) + symbol)
+            functions.append([name, ptr, body, fn.inline, fn.abstract, lengths, nested,
+                              global_relocs, literal_relocs, name_relocs])
+            if self.optimize_level == 0:
+                self.object_code[name] = None
+        return names, missing, functions
+
+    def store(self):
+        """
+        Stores the objects made by 'finish', with the assembled bytes collected in 'object_code'.
+        """
+        for file, (names, missing, functions) in self.pending:
+            for function in functions:
+                function.append(self.object_code.get(function[0]))
+            self.objects.store_code(file, (names, missing, functions))
+        self.pending.clear()
+
+    def allowed_owners(self, module: ModuleCode) -> set:
+        """
+        :return: owners of the globals the module may refer to: itself, the files included before it and natives
+        """
+        allowed = set(self.objects.preceding(module.file))
+        allowed.add(module.file)
+        allowed.add(None)
+        return allowed
+
+    @staticmethod
+    def outer_env(module: ModuleCode, name: str) -> en.Environment:
+        """
+        :return: the environment outside the module that defines this name, or None
+        """
+        env = module.importer
+        while env is not None and name not in env.vars:
+            env = env.outer
+        return env
+
+    def resolves(self, module: ModuleCode, names) -> bool:
+        """
+        :return: whether all names resolve to an earlier module, natives, or an import made before this module
+        """
+        for name in names:
+            env = self.outer_env(module, name)
+            if isinstance(env, en.MainEnvironment):
+                if env.vars[name] is not module.visible.get(name):
+                    return False
+            elif not isinstance(env, en.ModuleEnvironment) and not isinstance(env, en.GlobalEnvironment):
+                return False
+        return True
+
+    def undefined(self, module: ModuleCode, names) -> bool:
+        for name in names:
+            if self.outer_env(module, name) is not None:
+                return False
+        return True
+
+    def overloads_in(self, module: ModuleCode, names, allowed: set) -> bool:
+        """
+        :return: whether all overloads of the functions visible to the module are owned by the allowed owners
+        """
+        manager = self.manager
+        entries = list(module.env.vars.values())
+        for name in names:
+            env = self.outer_env(module, name)
+            if env is not None:
+                entries.append(env.vars[name])
+        for entry in entries:
+            if isinstance(entry, en.FunctionEntry):
+                for fn_ptr in entry.placer.poly.values:
+                    if manager.global_symbol(fn_ptr)[0] not in allowed:
+                        return False
+        return True
@@ -0,0 +1,112 @@
+"""
+Module objects are the preprocessed syntax trees of imported modules, stored along with the module in the module cache.
+
+An object is relocatable: its literal positions and lambda ids are only valid inside the module. The object keeps a
+relocation record of every literal and lambda node, and the linker (AstPreprocessor) assigns their final values, so
+that an unchanged module is neither parsed nor preprocessed again.
+
+The code of the functions of a module is stored as the code object of the module, which is valid as long as the files
+included before the module are unchanged, see compilers.linker.
+"""
+
+import pickle
+import hashlib
+import compilers.ast as ast
+import compilers.util as util
+import compilers.tokens_lib as tl
+import compilers.ast_builder as ab
+import compilers.tp_parser as psr
+import compilers.ast_optimizer as ast_o
+import compilers.ast_visitor as av
+import compilers.ast_preprocessor as prep
+import compilers.text_preprocessor as txt_prep
+import compilers.types as typ
+import compilers.environment as en
+import compilers.tpa_producer as prod
+import compilers.compiler as cmp
+import compilers.assembly as asm
+import compilers.tpc_compiler as tpc
+import compilers.linker as lnk
+
+# hash of all sources that produce the preprocessed syntax tree
+OBJECT_VERSION = txt_prep.sources_digest(ast.__file__, util.__file__, tl.__file__, ab.__file__, psr.__file__,
+                                         ast_o.__file__, av.__file__, prep.__file__, __file__)
+
+# hash of all sources that produce the code of functions
+CODE_VERSION = txt_prep.sources_digest(ast.__file__, util.__file__, typ.__file__, en.__file__, prod.__file__,
+                                       cmp.__file__, asm.__file__, tpc.__file__, lnk.__file__, __file__)
+
+
+class ModuleObjects:
+    def __init__(self, module_cache: txt_prep.ModuleCache, module_keys: dict, opt_level: int):
+        """
+        :param module_cache: the module cache used to preprocess the tokens
+        :param module_keys: file: key of the module in module cache, see 'FileTextPreprocessor.module_keys'
+        :param opt_level: optimization level, objects made at different levels of ast optimization are not shared
+        """
+        self.module_cache = module_cache
+        self.module_keys = module_keys
+        self.version = f"{OBJECT_VERSION}-{int(opt_level >= 1)}"
+        self.code_version = f"code-{CODE_VERSION}-{opt_level}"
+        self.link_code = True  # whether code objects are linked, see compilers.linker
+
+    def can_store(self, file: str) -> bool:
+        return file in self.module_keys
+
+    def has(self, file: str) -> bool:
+        return self.can_store(file) and \
+            self.module_cache.get_object(self.module_keys[file], self.version) is not None
+
+    def load(self, file: str) -> (ast.BlockStmt, list):
+        """
+        :return: the syntax tree of this module, and the relocation records, as stored in 'store'
+        """
+        return pickle.loads(self.module_cache.get_object(self.module_keys[file], self.version))
+
+    def store(self, file: str, tree: ast.BlockStmt, relocations: list):
+        """
+        Stores the object of a module, must be called before the tree is compiled.
+
+        :param file: path of the module
+        :param tree: the preprocessed syntax tree
+        :param relocations: list of (node, kind, value), kind is the fake literal class for literal nodes,
+        or ast.LambdaExpr for lambdas
+        """
+        self.module_cache.put_object(self.module_keys[file], self.version,
+                                     pickle.dumps((tree, relocations), pickle.HIGHEST_PROTOCOL))
+
+    def preceding(self, file: str) -> list:
+        """
+        :return: the files that were already included when importing this module
+        """
+        module = self.module_cache.modules.get(self.module_keys[file])
+        return [] if module is None else module.preceding
+
+    def context(self, file: str) -> str:
+        """
+        :return: hash of the files included before this module, its code object is only valid in the same context
+        """
+        files = [(f, txt_prep.file_digest(f)) for f in self.preceding(file)]
+        return hashlib.sha256(repr(files).encode("utf-8")).hexdigest()
+
+    def load_code(self, file: str):
+        """
+        :return: the code object of this module as stored in 'store_code', or None if there is no valid one
+        """
+        if not self.can_store(file):
+            return None
+        obj = self.module_cache.get_object(self.module_keys[file], self.code_version)
+        if obj is None:
+            return None
+        context, code = pickle.loads(obj)
+        if context != self.context(file):
+            return None
+        return pickle.loads(code)
+
+    def store_code(self, file: str, code):
+        """
+        Stores the code object of a module, replacing the one made in another context.
+        """
+        code = pickle.dumps(code, pickle.HIGHEST_PROTOCOL)
+        self.module_cache.put_object(self.module_keys[file], self.code_version,
+                                     pickle.dumps((self.context(file), code), pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+import contextlib
+
+
+class StageProfiler:
+    """
+    Records the wall time and cpu time of each compile stage.
+
+    If 'trace_memory' is set, also records the peak memory allocated during each stage, with tracemalloc, and the
+    peak memory of the whole compile, relative to the memory traced when the profiler starts.
+    If 'cprofile_dir' is set, dumps cProfile stats of each stage to '<cprofile_dir>/<stage>.prof'.
+    """
+    def __init__(self, trace_memory=False, cprofile_dir=None):
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+        self.stages = []  # list of (name, record dict)
+        self.peak_memory = 0  # the highest peak of all stages, since each stage resets the peak of tracemalloc
+        self.mem_start = 0
+
+        self.t_begin = time.perf_counter()
+        self.cpu_begin = time.process_time()
+
+        self.started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            self.mem_start = tracemalloc.get_traced_memory()[0]
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            mem_begin = tracemalloc.get_traced_memory()[0]
+        else:
+            mem_begin = 0
+        profile = cProfile.Profile() if self.cprofile_dir is not None else None
+
+        t_begin = time.perf_counter()
+        cpu_begin = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            record = {"wall": time.perf_counter() - t_begin,
+                      "cpu": time.process_time() - cpu_begin}
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["peak_memory"] = peak - mem_begin
+                self.peak_memory = max(self.peak_memory, peak - self.mem_start)
+                record["memory_after"] = current
+            if profile is not None:
+                if not os.path.exists(self.cprofile_dir):
+                    os.makedirs(self.cprofile_dir)
+                prof_name = os.path.join(self.cprofile_dir, name.replace(" ", "_") + ".prof")
+                profile.dump_stats(prof_name)
+                record["cprofile"] = prof_name
+            self.stages.append((name, record))
+
+    def wall_of(self, *names) -> float:
+        """
+        Returns the total wall time of all stages with the given names.
+        """
+        return sum([record["wall"] for name, record in self.stages if name in names])
+
+    def total_wall(self) -> float:
+        return time.perf_counter() - self.t_begin
+
+    def total_cpu(self) -> float:
+        return time.process_time() - self.cpu_begin
+
+    def to_dict(self) -> dict:
+        res = {"stages": [dict(record, name=name) for name, record in self.stages],
+               "total_wall": self.total_wall(),
+               "total_cpu": self.total_cpu()}
+        if self.trace_memory:
+            res["peak_memory"] = self.peak_memory
+            res["memory_start"] = self.mem_start
+        return res
+
+    def write_json(self, file_name: str, extra: dict = None):
+        content = self.to_dict()
+        if extra is not None:
+            content.update(extra)
+        with open(file_name, "w") as wf:
+            json.dump(content, wf, indent=2)
+
+    def stop(self):
+        """
+        Stops tracing memory if this profiler started it. Must be called after the compile, even a failed one.
+        """
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
@@ -1,4 +1,6 @@
 import os
+import pickle
+import hashlib
 import compilers.tokens_lib as tl
 import compilers.errors as errs
 import compilers.tokenizer as tkn
@@ -23,6 +25,22 @@ class CallMacro(Macro):
         super().__init__(body, lf)
 
         self.params = params
+        self.template = make_template(params, body)
+
+    def substitute(self, args: list, lf) -> tl.CollectiveElement:
+        """
+        Returns the body with all parameters replaced by the arguments.
+
+        :param args: list of CollectiveElement, tokens of each argument
+        :param lf: position of this macro call
+        """
+        body_with_arg = tl.CollectiveElement(tl.CE_BRACE, lf, None)
+        for part in self.template:
+            if isinstance(part, int):
+                body_with_arg.extend(args[part])
+            else:
+                body_with_arg.append(part)
+        return body_with_arg
 
     def __str__(self):
         return f"{self.params} {self.body}"
@@ -32,11 +50,13 @@ class MacroEnv:
     def __init__(self):
         self.macros = {}
         self.export_names = set()
+        self.version = 0  # increases when a macro is added
 
     def add_macro(self, name: str, macro: Macro, lf):
         if name in self.macros:
             raise errs.TplMacroError(f"Macro '{name}' already defined in this scope. ", lf)
         self.macros[name] = macro
+        self.version += 1
 
     def is_macro(self, name):
         return name in self.macros
@@ -48,6 +68,137 @@ class MacroEnv:
         self.export_names.add(name)
 
 
+class CachedModule:
+    def __init__(self, tokens: tl.CollectiveElement, included: list, digests: dict, main_dir,
+                 preceding: list, keys: dict):
+        self.tokens = tokens
+        self.included = included  # list of (file, MacroEnv), in the order of including
+        self.digests = digests  # file: content hash, of all included files
+        self.main_dir = main_dir  # None if no user import is resolved against main_dir
+        self.preceding = preceding  # sorted files that were already included when importing this module
+        self.keys = keys  # file: key in module cache, of the included modules
+        self.objects = {}  # version: pickled module object, see compilers.module_object
+
+    def is_valid(self, main_dir: str) -> bool:
+        if self.main_dir is not None and self.main_dir != main_dir:
+            return False
+        for file in self.digests:
+            if file_digest(file) != self.digests[file]:
+                return False
+        return True
+
+
+class ModuleCache:
+    """
+    Preprocessed imported modules, kept in memory and optionally in a cache directory.
+
+    A module is keyed by its path, content hash, the compiler version, the preferences and the set of files that were
+    already included when importing it. It is reused only if none of the files it includes has been modified.
+    """
+    def __init__(self, cache_dir: str = None):
+        self.modules = {}
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str, main_dir: str):
+        module = self.modules.get(key)
+        if module is not None and module.is_valid(main_dir):
+            self.hits += 1
+            return module
+        module = self.read_disk(key)
+        if module is not None and module.is_valid(main_dir):
+            self.modules[key] = module
+            self.disk_hits += 1
+            return module
+        self.misses += 1
+        return None
+
+    def put(self, key: str, module: CachedModule):
+        self.modules[key] = module
+        self.write_disk(key, module)
+
+    def get_object(self, key: str, version: str):
+        module = self.modules.get(key)
+        if module is None:
+            return None
+        return module.objects.get(version)
+
+    def put_object(self, key: str, version: str, obj: bytes):
+        module = self.modules.get(key)
+        if module is not None:
+            module.objects[version] = obj
+            self.write_disk(key, module)
+
+    def read_disk(self, key: str):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, key + ".pkl"), "rb") as rf:
+                return pickle.load(rf)
+        except (OSError, pickle.PickleError, EOFError, AttributeError):
+            return None
+
+    def write_disk(self, key: str, module: CachedModule):
+        if self.cache_dir is None:
+            return
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_name = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.tmp")
+            with open(tmp_name, "wb") as wf:
+                pickle.dump(module, wf, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, os.path.join(self.cache_dir, key + ".pkl"))
+        except OSError:
+            pass
+
+    def clear(self):
+        self.modules.clear()
+
+    def stats(self) -> str:
+        total = self.hits + self.disk_hits + self.misses
+        rate = 0 if total == 0 else (self.hits + self.disk_hits) / total
+        return f"module cache: {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses, " \
+               f"hit rate {round(rate * 100, 1)}%."
+
+
+_digests = {}
+
+
+def file_digest(file: str) -> str:
+    """
+    Returns the content hash of a file. The result is reused until the modify time or size of the file changes.
+    """
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    stamp = st.st_mtime_ns, st.st_size
+    known = _digests.get(file)
+    if known is not None and known[0] == stamp:
+        return known[1]
+    with open(file, "rb") as rf:
+        digest = hashlib.sha256(rf.read()).hexdigest()
+    _digests[file] = stamp, digest
+    return digest
+
+
+def sources_digest(*sources) -> str:
+    """
+    Returns the hash of the given source files, so that cached results are discarded once any of them changes.
+    """
+    h = hashlib.sha256()
+    for src in sources:
+        with open(src, "rb") as rf:
+            h.update(rf.read())
+    return h.hexdigest()
+
+
+# hash of all sources that produce the preprocessed tokens
+COMPILER_VERSION = sources_digest(tl.__file__, tkn.__file__, __file__)
+
+
 def get_name_list(lst: tl.CollectiveElement) -> list:
     res = []
     for part in lst:
@@ -62,12 +213,18 @@ def get_name_list(lst: tl.CollectiveElement) -> list:
 
 class FileTextPreprocessor:
     def __init__(self, tokens: tl.CollectiveElement, pref: dict,
-                 included_files: {} = None, macros: MacroEnv = None):
+                 included_files: {} = None, macros: MacroEnv = None, module_cache: ModuleCache = None,
+                 module_keys: dict = None):
         self.root = tokens
 
         self.pref = pref  # should contain "tpc_path", "main_dir", "import_lang"
         self.included_files = included_files if included_files is not None else {}
         self.macros = macros if macros is not None else MacroEnv()
+        self.module_cache = module_cache
+        self.module_keys = module_keys if module_keys is not None else {}  # file: key in module cache
+        self.main_dir_used = False
+        self.import_count = 0
+        self.expansions = {}  # SimpleMacro: (version of self.macros, expanded elements)
 
     def preprocess(self) -> tl.CollectiveElement:
         return self.process_block(self.root, None)
@@ -141,20 +298,10 @@ class FileTextPreprocessor:
                         if len(arg_list) != len(macro.params):
                             raise errs.TplSyntaxError("Macro syntax arity mismatch. ", args.lfp)
 
-                        body_with_arg = tl.CollectiveElement(tl.CE_BRACE, lf, None)
-                        for body_ele in macro.body:
-                            if isinstance(body_ele, tl.AtomicElement) and \
-                                    isinstance(body_ele.atom, tl.IdToken) and \
-                                    body_ele.atom.identifier in macro.params:
-                                arg_index = macro.params.index(body_ele.atom.identifier)
-                                body_with_arg.extend(arg_list[arg_index])
-                            else:
-                                body_with_arg.append(body_ele)
-                        macro_res = self.process_block(body_with_arg, None)
+                        macro_res = self.process_block(macro.substitute(arg_list, lf), None)
+                        result_parent.extend(macro_res)
                     else:
-                        macro_res = self.process_block(macro.body, None)
-
-                    result_parent.extend(macro_res)
+                        result_parent.extend(self.expand_simple_macro(macro))
                     return index + 1
 
             result_parent.append(ele)
@@ -166,7 +313,25 @@ class FileTextPreprocessor:
 
         return index + 1
 
+    def expand_simple_macro(self, macro: SimpleMacro) -> list:
+        """
+        Returns the processed body of a simple macro.
+
+        Macros in the body are looked up when expanding, so the result is reused only until another macro is defined
+        in this scope. Expansions that define macros or import modules are not reused.
+        """
+        cached = self.expansions.get(macro)
+        if cached is not None and cached[0] == self.macros.version:
+            return cached[1]
+        version = self.macros.version
+        import_count = self.import_count
+        res = self.process_block(macro.body, None).children
+        if version == self.macros.version and import_count == self.import_count:
+            self.expansions[macro] = version, res
+        return res
+
     def import_one(self, include: tl.Token, result_parent, lf):
+        self.import_count += 1
         if isinstance(include, tl.IdToken):
             # library import
             file = "{}{}lib{}{}.tp".format(self.pref["tpc_dir"],
@@ -174,6 +339,7 @@ class FileTextPreprocessor:
         elif isinstance(include, tl.StrToken):
             # user import
             file = os.path.join(self.pref["main_dir"], include.value)
+            self.main_dir_used = True
         else:
             raise errs.TplCompileError("Invalid include. ", lf)
 
@@ -181,16 +347,10 @@ class FileTextPreprocessor:
             raise errs.TplTokenizeError(f"File '{file}' does not exist. ", lf)
 
         if file not in self.included_files:
-            lexer = tkn.FileTokenizer(file, self.pref["import_lang"])
-            tokens = lexer.tokenize()
-
-            self.included_files[file] = None  # make 'file' in 'self.included_files'
-
-            module_macros = MacroEnv()
-            txt_p = FileTextPreprocessor(tokens, self.pref, self.included_files, module_macros)
-            processed_tks = txt_p.preprocess()
-
-            self.included_files[file] = module_macros
+            if self.module_cache is None:
+                processed_tks = self.import_module(file)
+            else:
+                processed_tks = self.import_module_cached(file)
 
             result_parent.append(tl.AtomicElement(tl.IdToken("import", lf), result_parent))
             result_parent.append(tl.AtomicElement(tl.StrToken(file, lf), result_parent))
@@ -201,14 +361,93 @@ class FileTextPreprocessor:
         for en in module_macros.export_names:
             self.macros.add_macro(en, module_macros.get_macro(en), lf)
 
+    def import_module(self, file: str) -> tl.CollectiveElement:
+        lexer = tkn.FileTokenizer(file, self.pref["import_lang"])
+        tokens = lexer.tokenize()
+
+        self.included_files[file] = None  # make 'file' in 'self.included_files'
+
+        module_macros = MacroEnv()
+        txt_p = FileTextPreprocessor(tokens, self.pref, self.included_files, module_macros, self.module_cache,
+                                     self.module_keys)
+        processed_tks = txt_p.preprocess()
+        if txt_p.main_dir_used:
+            self.main_dir_used = True
+
+        self.included_files[file] = module_macros
+        return processed_tks
+
+    def import_module_cached(self, file: str) -> tl.CollectiveElement:
+        preceding = sorted(self.included_files)
+        key_src = repr((COMPILER_VERSION,
+                        file,
+                        file_digest(file),
+                        self.pref["tpc_dir"],
+                        self.pref["import_lang"],
+                        preceding))
+        key = hashlib.sha256(key_src.encode("utf-8")).hexdigest()
+        self.module_keys[file] = key
+        cached = self.module_cache.get(key, self.pref["main_dir"])
+        if cached is not None:
+            for inc_file, inc_macros in cached.included:
+                self.included_files[inc_file] = inc_macros
+            self.module_keys.update(cached.keys)
+            if cached.main_dir is not None:
+                self.main_dir_used = True
+            return cached.tokens
+
+        already_included = set(self.included_files)
+        main_dir_used = self.main_dir_used
+        self.main_dir_used = False
+        processed_tks = self.import_module(file)
+
+        included = [(f, self.included_files[f]) for f in self.included_files if f not in already_included]
+        digests = {f: file_digest(f) for f, _ in included}
+        main_dir = self.pref["main_dir"] if self.main_dir_used else None
+        keys = {f: self.module_keys[f] for f, _ in included if f in self.module_keys}
+        self.module_cache.put(key, CachedModule(processed_tks, included, digests, main_dir, preceding, keys))
+
+        self.main_dir_used = self.main_dir_used or main_dir_used
+        return processed_tks
+
     def process_block(self, block: tl.CollectiveElement, result_parent: tl.CollectiveElement) -> tl.CollectiveElement:
         result = tl.CollectiveElement(block.ce_type, block.lfp, result_parent)
+        children = block.children
+        macros = self.macros.macros
         i = 0
-        while i < len(block):
-            i = self.process_one(block, i, result)
+        while i < len(children):
+            ele = children[i]
+            if isinstance(ele, tl.AtomicElement) and not (isinstance(ele.atom, tl.IdToken) and (
+                    ele.atom.identifier in DIRECTIVES or ele.atom.identifier in macros)):
+                # plain token, kept as it is
+                result.children.append(ele)
+                i += 1
+            else:
+                i = self.process_one(block, i, result)
         return result
 
 
+DIRECTIVES = {"macro", "exportmacro", "import"}
+
+
+def make_template(params: list, body: tl.CollectiveElement) -> list:
+    """
+    Returns the body of a call macro, with every parameter replaced by its index in 'params'.
+    """
+    param_indices = {}
+    for i, param in enumerate(params):
+        param_indices.setdefault(param, i)
+    template = []
+    for body_ele in body:
+        if isinstance(body_ele, tl.AtomicElement) and \
+                isinstance(body_ele.atom, tl.IdToken) and \
+                body_ele.atom.identifier in param_indices:
+            template.append(param_indices[body_ele.atom.identifier])
+        else:
+            template.append(body_ele)
+    return template
+
+
 def list_ify_macro_arg(args: tl.CollectiveElement) -> list:
     res = []
     cur = tl.CollectiveElement(tl.CE_BRACE, args.lfp, None)
@@ -1,4 +1,6 @@
 import os
+import re
+import sys
 import compilers.errors as errs
 import compilers.tokens_lib as tl
 
@@ -15,7 +17,7 @@ ESCAPES = {
 
 class FileTokenizer:
     def __init__(self, file_name: str, import_lang: bool):
-        self.file_name = file_name
+        self.file_name = sys.intern(file_name)
         self.import_lang = import_lang
         self.tokens = []
         self.in_doc = False
@@ -43,11 +45,12 @@ class FileTokenizer:
     def make_root_tree(self):
         root = tl.CollectiveElement(tl.CE_BRACE, tl.LF_TOKENIZER, None)
         cur_active = root
+        arrows = closing_arrows(self.tokens)
         for i in range(len(self.tokens)):
-            cur_active = self.make_tree(cur_active, i)
+            cur_active = self.make_tree(cur_active, i, arrows)
         return root
 
-    def make_tree(self, cur_active: tl.CollectiveElement, index: int) -> tl.CollectiveElement:
+    def make_tree(self, cur_active: tl.CollectiveElement, index: int, arrows: list) -> tl.CollectiveElement:
         tk = self.tokens[index]
         if isinstance(tk, tl.IdToken):
             symbol = tk.identifier
@@ -76,7 +79,7 @@ class FileTokenizer:
                 else:
                     raise errs.TplSyntaxError("Parenthesis does not close. ", tk.lfp)
             if symbol == "<":
-                if has_closing_arrow(self.tokens, index):
+                if arrows[index]:
                     return tl.CollectiveElement(tl.CE_ARROW_BRACKET, tk.lfp, cur_active)
             if symbol == ">":
                 if tl.is_arrow_bracket(cur_active):
@@ -87,81 +90,88 @@ class FileTokenizer:
         return cur_active
 
     def proceed_line(self, content: str, lf: tl.LineFile):
-        in_str = False
         length = len(content)
-        literal = ""
         non_literal = ""
         i = 0
         part_start_pos = 0
         while i < length:
-            ch = content[i]
             if self.in_doc:
-                if i < length - 1 and ch == '*' and content[i + 1] == '/':
-                    # exit doc
-                    self.in_doc = False
-                    i += 2
+                doc_end = content.find("*/", i)
+                if doc_end == -1:
+                    break
+                # exit doc, the character right after the doc is skipped
+                self.in_doc = False
+                i = doc_end + 3
+                continue
+
+            match = SPECIAL_CHAR.search(content, i)
+            if match is None:
+                non_literal += content[i:]
+                break
+            j = match.start()
+            non_literal += content[i:j]
+            ch = content[j]
+            if ch == '/':
+                if j < length - 1 and content[j + 1] == '*':
+                    # enter doc
+                    self.in_doc = True
+                    i = j + 2
+                elif j < length - 1 and content[j + 1] == '/':
+                    # enter comment, end of this line
+                    if len(non_literal) > 2:
+                        self.line_tokenize(non_literal[0:len(non_literal) - 2], lf, part_start_pos)
+                        non_literal = ""
+                    break
+                else:
+                    non_literal += ch
+                    i = j + 1
+            elif ch == '"':
+                # string literal
+                self.line_tokenize(non_literal, lf, part_start_pos)
+                non_literal = ""
+                part_start_pos = j
+                str_end = content.find('"', j + 1)
+                if str_end == -1:
+                    # string literal does not close in this line
+                    break
+                self.tokens.append(tl.StrToken(content[j + 1:str_end], tl.LineFilePos(lf, part_start_pos)))
+                part_start_pos = str_end
+                i = str_end + 1
             else:
-                if in_str:
-                    if ch == '"':
-                        in_str = False
-                        self.tokens.append(tl.StrToken(literal, tl.LineFilePos(lf, part_start_pos)))
-                        literal = ""
-                        part_start_pos = i
+                # char literal
+                if j < length - 2 and content[j + 2] == '\'':
+                    # normal char
+                    self.line_tokenize(non_literal, lf, part_start_pos)
+                    non_literal = ""
+                    part_start_pos = j
+                    self.tokens.append(tl.CharToken(content[j + 1], tl.LineFilePos(lf, part_start_pos)))
+                    i = j + 3
+                elif j < length - 3 and content[j + 3] == '\'' and content[j + 1] == '\\':
+                    # escape char
+                    self.line_tokenize(non_literal, lf, part_start_pos)
+                    non_literal = ""
+                    part_start_pos = j
+                    escaped = content[j + 2]
+                    if escaped == '\\':
+                        self.tokens.append(tl.CharToken('\\', tl.LineFilePos(lf, part_start_pos)))
+                    elif escaped in ESCAPES:
+                        self.tokens.append(tl.CharToken(ESCAPES[escaped], tl.LineFilePos(lf, part_start_pos)))
                     else:
-                        literal += ch
+                        raise errs.TplSyntaxError("Invalid escape '\\" + escaped + "'. ",
+                                                  tl.LineFilePos(lf, part_start_pos))
+                    i = j + 4
                 else:
-                    if i < length - 1 and ch == '/' and content[i + 1] == '*':
-                        # enter doc
-                        self.in_doc = True
-                        i += 1
-                    elif i < length - 1 and ch == '/' and content[i + 1] == '/':
-                        # enter comment, end of this line
-                        if len(non_literal) > 2:
-                            self.line_tokenize(non_literal[0:len(non_literal) - 2], lf, part_start_pos)
-                            non_literal = ""
-                            part_start_pos = i
-                        break
-                    elif ch == '"':
-                        # enter string literal
-                        in_str = True
-                        self.line_tokenize(non_literal, lf, part_start_pos)
-                        non_literal = ""
-                        part_start_pos = i
-                    elif ch == '\'':
-                        # enter char literal
-                        if i < length - 2 and content[i + 2] == '\'':
-                            # normal char
-                            self.line_tokenize(non_literal, lf, part_start_pos)
-                            non_literal = ""
-                            part_start_pos = i
-                            self.tokens.append(tl.CharToken(content[i + 1], tl.LineFilePos(lf, part_start_pos)))
-                            i += 2
-                        elif i < length - 3 and content[i + 3] == '\'' and content[i + 1] == '\\':
-                            # escape char
-                            self.line_tokenize(non_literal, lf, part_start_pos)
-                            non_literal = ""
-                            part_start_pos = i
-                            escaped = content[i + 2]
-                            if escaped == '\\':
-                                self.tokens.append(tl.CharToken('\\', tl.LineFilePos(lf, part_start_pos)))
-                            elif escaped in ESCAPES:
-                                self.tokens.append(tl.CharToken(ESCAPES[escaped], tl.LineFilePos(lf, part_start_pos)))
-                            else:
-                                raise errs.TplSyntaxError("Invalid escape '\\" + escaped + "'. ",
-                                                          tl.LineFilePos(lf, part_start_pos))
-                            i += 3
-                        else:
-                            raise errs.TplSyntaxError("Char literal must contain exactly one symbol. ",
-                                                      tl.LineFilePos(lf, part_start_pos))
-                    else:
-                        non_literal += ch
-            i += 1
+                    raise errs.TplSyntaxError("Char literal must contain exactly one symbol. ",
+                                              tl.LineFilePos(lf, part_start_pos))
 
         if len(non_literal) > 0:
             self.line_tokenize(non_literal, lf, part_start_pos)
 
     def line_tokenize(self, content: str, lf: tl.LineFile, part_start_pos: int):
-        lst = normalize_line(content)
+        if content.isascii():
+            lst = SEGMENT.findall(content)
+        else:
+            lst = normalize_line(content)
         length = len(lst)
         i = 0
         pos = part_start_pos
@@ -179,18 +189,33 @@ class FileTokenizer:
                     i += 1
                 else:
                     self.tokens.append(tl.IntToken(s, tl.LineFilePos(lf, pos)))
-            # elif s == "\n":
-            #     self.tokens.append(tl.IdToken(s, lf))
-            elif s.isidentifier():
-                self.tokens.append(tl.IdToken(s, tl.LineFilePos(lf, pos)))
-            elif s in tl.ALL:
-                self.tokens.append(tl.IdToken(s, tl.LineFilePos(lf, pos)))
-            elif len(s.strip()) > 0:
+            elif s.isidentifier() or s in tl.ALL:
+                self.tokens.append(tl.IdToken(sys.intern(s), tl.LineFilePos(lf, pos)))
+            elif not s.isspace():
                 raise errs.TplSyntaxError(f"Unexpected token '{s.strip()}'. ", tl.LineFilePos(lf, pos))
             i += 1
             pos += len(s)
 
 
+# characters that start a literal or a comment
+SPECIAL_CHAR = re.compile(r"[\"'/]")
+
+# splits an ascii line into the same parts as 'normalize_line' does, except that white spaces are grouped
+SEGMENT = re.compile(r"""
+    (?=[A-Za-z0-9_])(?:[A-Za-z_]|[0-9](?![A-Za-z]))*[0-9]?(?:(?<=[A-Za-z0-9])\?)?  # names and numbers
+    | <+(?:-+(?:>+)?)?=*
+    | -+(?:>+)?=*
+    | >+=*
+    | \++=*
+    | :+=*
+    | [!*/%]=*
+    | =+
+    | \\\[?
+    | [\ \t\n\r\x0b\x0c\x1c-\x1f]+  # white spaces, which do not make tokens
+    | .
+""", re.VERBOSE | re.DOTALL)
+
+
 NOT_INT = 0
 INT = 1
 BYTE = 2
@@ -198,6 +223,8 @@ FLOAT = 3
 
 
 def is_int(s: str) -> bool:
+    if not s[0].isdigit():
+        return False
     try:
         int(s)
         return True
@@ -206,18 +233,20 @@ def is_int(s: str) -> bool:
 
 
 def normalize_line(line: str):
+    """
+    Splits a line into parts. Two adjacent characters are in the same part if their char types are concatenate able.
+    """
     lst = []
     if len(line) > 0:
-        last = line[0]
-        res = last
+        start = 0
+        last = char_type(line[0])
         for i in range(1, len(line)):
-            cur = line[i]
-            if not concatenate_able(last, cur):
-                lst.append(res)
-                res = ""
-            res += cur
+            cur = char_type(line[i])
+            if (last, cur) not in CONCATENATE_ABLE:
+                lst.append(line[start:i])
+                start = i
             last = cur
-        lst.append(res)
+        lst.append(line[start:])
     return lst
 
 
@@ -275,6 +304,8 @@ CROSS_CONCATENATE = {
     (DIGIT, QUESTION)
 }
 
+CONCATENATE_ABLE = set.union({(t, t) for t in SELF_CONCATENATE}, CROSS_CONCATENATE)
+
 CHAR_TYPE_TABLE = {
     '{': L_BRACE,
     '}': R_BRACE,
@@ -314,27 +345,26 @@ def char_type(ch: str):
         return UNDEFINED
 
 
-def concatenate_able(ch1: str, ch2: str) -> bool:
-    lt = char_type(ch1)
-    rt = char_type(ch2)
-    return (lt == rt and lt in SELF_CONCATENATE) or \
-           (lt, rt) in CROSS_CONCATENATE
-
+def closing_arrows(tokens: list) -> list:
+    """
+    Returns a list that, for each index i, tells whether a '<' at index i has a closing '>'.
 
-def has_closing_arrow(tokens: list, left_arr_index: int) -> bool:
-    for i in range(left_arr_index + 1, len(tokens)):
+    A '<' has a closing '>' if a '>' comes before any ';', reserved word or literal. The list is made in one backward
+    scan, so that bracket matching takes linear time.
+    """
+    res = [False] * len(tokens)
+    closing = False  # whether a '<' right before the current token has a closing '>'
+    for i in range(len(tokens) - 1, -1, -1):
+        res[i] = closing
         tk = tokens[i]
         if isinstance(tk, tl.IdToken):
             if tk.identifier == ">":
-                return True
-            elif tk.identifier == ";":
-                return False
-            elif tk.identifier in tl.RESERVED:
-                return False
-        elif (isinstance(tk, tl.StrToken) or
-              isinstance(tk, tl.IntToken) or
-              isinstance(tk, tl.ByteToken) or
-              isinstance(tk, tl.CharToken) or
-              isinstance(tk, tl.FloatToken)):
-            return False
-    return False
+                closing = True
+            elif tk.identifier == ";" or tk.identifier in tl.RESERVED:
+                closing = False
+        elif isinstance(tk, LITERAL_TOKENS):
+            closing = False
+    return res
+
+
+LITERAL_TOKENS = (tl.StrToken, tl.IntToken, tl.ByteToken, tl.CharToken, tl.FloatToken)
@@ -42,6 +42,8 @@ ALL = set.union(
 
 
 class LineFile:
+    __slots__ = ("file_name", "line")
+
     def __init__(self, file_name: str, line: int):
         self.file_name = file_name
         self.line = line
@@ -50,20 +52,36 @@ class LineFile:
         return "In file '" + self.file_name + "', at line " + str(self.line) + "."
 
 
+POS_BITS = 32
+POS_MASK = (1 << POS_BITS) - 1
+
+
 class LineFilePos:
+    """
+    Position of a token, or a message describing where it is made if it is not from any file.
+
+    The line and the position in line are packed into one integer.
+    """
+    __slots__ = ("file_name", "msg", "line_pos")
+
     def __init__(self, lf_msg, pos: int = 0):
-        self.line_file: LineFile = lf_msg if isinstance(lf_msg, LineFile) else None
-        self.msg: str = lf_msg if isinstance(lf_msg, str) else None
-        self.pos = pos
+        if isinstance(lf_msg, LineFile):
+            self.file_name = lf_msg.file_name
+            self.msg = None
+            self.line_pos = (lf_msg.line << POS_BITS) | pos
+        else:
+            self.file_name = None
+            self.msg = lf_msg
+            self.line_pos = pos
 
     def get_file(self):
-        return self.line_file.file_name
+        return self.file_name
 
     def get_line(self):
-        return self.line_file.line
+        return self.line_pos >> POS_BITS
 
     def get_pos(self):
-        return self.pos
+        return self.line_pos & POS_MASK
 
     def is_real(self):
         return self.msg is None
@@ -84,6 +102,8 @@ LF_COMPILER = LineFilePos("Compiler")
 
 
 class Token:
+    __slots__ = ("lfp",)
+
     def __init__(self, lfp):
         self.lfp: LineFilePos = lfp
 
@@ -92,11 +112,15 @@ class Token:
 
 
 class LitToken(Token):
+    __slots__ = ()
+
     def __init__(self, lfp):
         super().__init__(lfp)
 
 
 class CharToken(LitToken):
+    __slots__ = ("char",)
+
     def __init__(self, char: str, lfp):
         super().__init__(lfp)
 
@@ -107,6 +131,8 @@ class CharToken(LitToken):
 
 
 class IntToken(LitToken):
+    __slots__ = ("value",)
+
     def __init__(self, v: str, lfp):
         super().__init__(lfp)
 
@@ -117,6 +143,8 @@ class IntToken(LitToken):
 
 
 class ByteToken(LitToken):
+    __slots__ = ("value",)
+
     def __init__(self, v: str, lfp):
         super().__init__(lfp)
 
@@ -127,6 +155,8 @@ class ByteToken(LitToken):
 
 
 class FloatToken(LitToken):
+    __slots__ = ("value",)
+
     def __init__(self, v: str, lfp):
         super().__init__(lfp)
 
@@ -137,6 +167,8 @@ class FloatToken(LitToken):
 
 
 class IdToken(Token):
+    __slots__ = ("identifier",)
+
     def __init__(self, v: str, lfp):
         super().__init__(lfp)
 
@@ -147,6 +179,8 @@ class IdToken(Token):
 
 
 class StrToken(LitToken):
+    __slots__ = ("value",)
+
     def __init__(self, v: str, lfp):
         super().__init__(lfp)
 
@@ -163,6 +197,8 @@ CE_ARROW_BRACKET = 4
 
 
 class Element:
+    __slots__ = ("parent",)
+
     def __init__(self, parent):
         self.parent: CollectiveElement = parent
 
@@ -171,6 +207,8 @@ class Element:
 
 
 class AtomicElement(Element):
+    __slots__ = ("atom",)
+
     def __init__(self, atom: Token, parent):
         super().__init__(parent)
 
@@ -181,6 +219,8 @@ class AtomicElement(Element):
 
 
 class CollectiveElement(Element):
+    __slots__ = ("ce_type", "lfp", "children")
+
     def __init__(self, ce_type: int, lfp: LineFilePos, parent):
         super().__init__(parent)
 
@@ -201,8 +241,10 @@ class CollectiveElement(Element):
         self.children.append(value)
 
     def extend(self, other):
-        for e in other:
-            self.append(e)
+        if isinstance(other, CollectiveElement):
+            self.children.extend(other.children)
+        else:
+            self.children.extend(other)
 
     def name(self):
         if self.ce_type == CE_BRACE:
@@ -9,8 +9,9 @@ def process_empty(p, i, b, lfp):
 
 
 class Parser:
-    def __init__(self, tokens: tl.CollectiveElement):
+    def __init__(self, tokens: tl.CollectiveElement, module_objects=None):
         self.tokens = tokens
+        self.module_objects = module_objects  # modules with objects are linked later instead of parsed
         self.var_level = ast.VAR_VAR
         self.permission = ast.PUBLIC
         self.abstract = False
@@ -317,7 +318,10 @@ class Parser:
         file_atom: tl.AtomicElement = parent[index + 1]
         file_tk: tl.StrToken = file_atom.atom
         includes: tl.CollectiveElement = parent[index + 2]
-        included_block = self.parse_as_block(includes)
+        if self.module_objects is not None and self.module_objects.has(file_tk.value):
+            included_block = None
+        else:
+            included_block = self.parse_as_block(includes)
         builder.add_node(ast.ImportStmt(file_tk.value, included_block, lfp))
 
         return index + 2
@@ -1,6 +1,8 @@
+import bisect
 import compilers.errors as errs
 import compilers.util as util
 import compilers.types as typ
+import compilers.assembly as asm
 
 
 def register(num) -> str:
@@ -118,6 +120,9 @@ class Manager:
         self.string_class_ptr = 0
         self.chars_pos_in_str = util.PTR_LEN  # position of 'chars' in class String
         self.blocks = []
+        self.frames = []  # saved (free_slots, temps) of the outer frames
+        self.free_slots = {}  # length: list of released temporary addresses, reused by 'allocate_stack'
+        self.temps = []  # list of temporaries (addr, length) of each statement being compiled
         self.available_regs = [7, 6, 5, 4, 3, 2, 1, 0]
         self.gp = util.STACK_SIZE
         self.sp = util.INT_LEN + 1
@@ -127,25 +132,100 @@ class Manager:
         self.label_manager = LabelManager()
         self.optimizer = Optimizer(optimize_level)
 
+        self.module_file = None  # file of the module being compiled, None for natives
+        self.owners = {}  # full name of function or class: file of the module defining it
+        self.global_addrs = []  # addresses of all globals, in the order of allocating
+        self.global_owners = []  # (owner file, index in owner) of each global in 'global_addrs'
+        self.module_globals = {}  # owner file: list of (addr, length) of the globals allocated by this module
+        self.linker = None  # compilers.linker.Linker, if functions of unchanged modules are linked from objects
+
     def allocate_global(self, length):
         addr = self.gp
         self.gp += length
+        self.own_global(addr, length)
         return addr
 
+    def own_global(self, addr, length):
+        """
+        Records that the module being compiled owns this global, so the global can be relocated, see
+        compilers.linker.
+        """
+        owned = self.module_globals.get(self.module_file)
+        if owned is None:
+            owned = self.module_globals[self.module_file] = []
+        self.global_addrs.append(addr)
+        self.global_owners.append((self.module_file, len(owned)))
+        owned.append((addr, length))
+
+    def global_symbol(self, addr: int) -> (str, int, int):
+        """
+        :return: (owner file, index in owner, offset) of the global containing this address
+        """
+        i = bisect.bisect_right(self.global_addrs, addr) - 1
+        owner, index = self.global_owners[i]
+        return owner, index, addr - self.global_addrs[i]
+
     def allocate_stack(self, length):
+        """
+        Allocates a temporary, which is released when the statement allocating it ends, see 'begin_temps'.
+
+        Use 'allocate_var' for memory that lives longer than the statement.
+        """
+        if len(self.blocks) == 0 or length == 0:
+            return self.allocate_var(length)
+        if length in self.free_slots and len(self.free_slots[length]) > 0:
+            addr = self.free_slots[length].pop()
+        else:
+            addr = self.allocate_var(length)
+        if len(self.temps) > 0:
+            self.temps[-1].append((addr, length))
+        return addr
+
+    def allocate_var(self, length):
+        """
+        Allocates memory that lives until the function returns, such as variables.
+        """
         if len(self.blocks) == 0:
             addr = self.gp
             self.gp += length
+            self.own_global(addr, length)
         else:
             addr = self.sp - self.blocks[-1]
             self.sp += length
         return addr
 
+    def keep(self, addr):
+        """
+        Makes a temporary live until the function returns, for example if its address is taken.
+        """
+        for temps in reversed(self.temps):
+            for i in range(len(temps)):
+                if temps[i][0] == addr:
+                    temps.pop(i)
+                    return
+
+    def begin_temps(self):
+        self.temps.append([])
+
+    def end_temps(self):
+        """
+        Releases the temporaries allocated since the last 'begin_temps', their values are not used anymore.
+        """
+        for addr, length in self.temps.pop():
+            if length in self.free_slots:
+                self.free_slots[length].append(addr)
+            else:
+                self.free_slots[length] = [addr]
+
     def push_stack(self):
         self.blocks.append(self.sp)
+        self.frames.append((self.free_slots, self.temps))
+        self.free_slots = {}
+        self.temps = []
 
     def restore_stack(self):
         self.sp = self.blocks.pop()
+        self.free_slots, self.temps = self.frames.pop()
 
     def require_regs(self, count):
         if len(self.available_regs) < count:
@@ -165,12 +245,14 @@ class Manager:
         full_name = util.name_with_path(poly_name, file_path, function_object.parent_class)
         self.functions_map[full_name] = function_object
         self.class_func_order.append((full_name, 0))
+        self.owners[full_name] = self.module_file
 
     def add_class(self, class_object):
         ct = class_object.class_type
         full_name = util.class_name_with_path(ct.name, ct.file_path)
         self.class_headers.append(class_object)
         self.class_func_order.append((full_name, 1))
+        self.owners[full_name] = self.module_file
 
     def global_length(self):
         return self.gp - util.STACK_SIZE
@@ -180,31 +262,26 @@ class TpaOutput:
     def __init__(self, manager: Manager, is_global=False):
         self.manager: Manager = manager
         self.is_global = is_global
-        self.output = ["entry"] if is_global else []
+        self.output = []  # list of instructions, see compilers.assembly
+        self.function = None  # the function, if this is the output of a function
+        self.program = None  # the whole program, if this is the global output
 
     def add_function(self, name, file_path, fn_ptr, clazz, abstract=False, inline=False):
-        title = "fn " + util.name_with_path(name, file_path, clazz) + " " + address(fn_ptr)
-        if inline:
-            title += " inline"
-            # note that 'inline' cannot combine with 'abstract'
-        if abstract:
-            self.output.append(title + " abstract")
-            self.output.append("")
-        else:
-            self.output.append(title)
+        # note that 'inline' cannot combine with 'abstract'
+        self.function = asm.AsmFunction(util.name_with_path(name, file_path, clazz), address(fn_ptr), self.output,
+                                        inline, abstract)
+        if not abstract:
             self.write_format("push_fp")
 
     def add_indefinite_push(self) -> int:
-        self.output.append("push")
+        self.output.append(["push"])
         return len(self.output) - 1
 
     def modify_indefinite_push(self, index, length):
-        push = self._format("push", length)
-        self.output[index] = push
+        self.output[index] = ["push", number(length)]
 
     def end_func(self):
         self.write_format("stop")
-        self.output.append("")
 
     def return_func(self):
         self.write_format("pull_fp")
@@ -240,7 +317,19 @@ class TpaOutput:
     def assign_i(self, dst_addr, value):
         reg1, reg2 = self.manager.require_regs(2)
 
-        self.write_format("iload", register(reg1), address(value))
+        self.write_format("iload", register(reg1), number(value))
+        self.write_format("iload", register(reg2), address(dst_addr))
+        self.write_format("store", register(reg2), register(reg1))
+
+        self.manager.append_regs(reg2, reg1)
+
+    def assign_addr(self, dst_addr, addr):
+        """
+        Assigns a global address, such as a class pointer, as value.
+        """
+        reg1, reg2 = self.manager.require_regs(2)
+
+        self.write_format("iload", register(reg1), address(addr))
         self.write_format("iload", register(reg2), address(dst_addr))
         self.write_format("store", register(reg2), register(reg1))
 
@@ -378,9 +467,8 @@ class TpaOutput:
         reg1, reg2 = self.manager.require_regs(2)
 
         self.write_format("load", register(reg1), address(left))
-        self.write_format("iload", register(reg2), number(right_value))
-        self.write_format(op_inst, register(reg1), register(reg2))
-        self.write_format("iload", register(reg2), number(res))
+        self.write_format(op_inst + "_imm", register(reg1), number(right_value))
+        self.write_format("iload", register(reg2), address(res))
         self.write_format("store", register(reg2), register(reg1))
 
         self.manager.append_regs(reg2, reg1)
@@ -390,7 +478,7 @@ class TpaOutput:
 
         self.write_format("load", register(reg1), address(value))
         self.write_format(op_inst, register(reg1))
-        self.write_format("iload", register(reg2), number(res))
+        self.write_format("iload", register(reg2), address(res))
         self.write_format("store", register(reg2), register(reg1))
 
         self.manager.append_regs(reg2, reg1)
@@ -399,7 +487,7 @@ class TpaOutput:
         reg1, reg2 = self.manager.require_regs(2)
 
         self.write_format("load", register(reg1), address(value_addr))
-        self.write_format("iload", register(reg2), number(res_addr))
+        self.write_format("iload", register(reg2), address(res_addr))
         self.write_format("astore", register(reg2), register(reg1))
 
         self.manager.append_regs(reg2, reg1)
@@ -415,7 +503,7 @@ class TpaOutput:
         reg1, reg2 = self.manager.require_regs(2)
 
         self.write_format("aload", register(reg1), address(value_addr))
-        self.write_format("iload", register(reg2), number(res_addr))
+        self.write_format("iload", register(reg2), address(res_addr))
         self.write_format("store", register(reg2), register(reg1))
 
         self.manager.append_regs(reg2, reg1)
@@ -430,7 +518,7 @@ class TpaOutput:
             self.write_format("rloadc_abs", register(reg2), register(reg1))
         else:
             self.write_format("rloadb_abs", register(reg2), register(reg1))
-        self.write_format("iload", register(reg1), number(res_addr))
+        self.write_format("iload", register(reg1), address(res_addr))
         self.write_format(store_of_len(res_len), register(reg1), register(reg2))
 
         self.manager.append_regs(reg2, reg1)
@@ -446,12 +534,12 @@ class TpaOutput:
 
     def i_ptr_assign(self, value: int, value_len: int, ptr_addr: int):
         """
-        Assigns a real value to an address that is stored in a ptr
+        Assigns a global address, such as a class pointer, to an address that is stored in a ptr
         """
         reg1, reg2 = self.manager.require_regs(2)
 
         self.write_format("load", register(reg1), address(ptr_addr))
-        self.write_format("iload", register(reg2), value)
+        self.write_format("iload", register(reg2), address(value))
         self.write_format(store_abs_of_len(value_len), register(reg1), register(reg2))
 
         self.manager.append_regs(reg2, reg1)
@@ -461,10 +549,9 @@ class TpaOutput:
 
         # print(struct_addr, res_addr)
 
-        self.write_format("aload", register(reg1), number(struct_addr))
-        self.write_format("iload", register(reg2), number(attr_pos))
-        self.write_format("addi", register(reg1), register(reg2))
-        self.write_format("iload", register(reg2), number(res_addr))
+        self.write_format("aload", register(reg1), address(struct_addr))
+        self.write_format("addi_imm", register(reg1), number(attr_pos))
+        self.write_format("iload", register(reg2), address(res_addr))
         self.write_format("store", register(reg2), register(reg1))
 
         self.manager.append_regs(reg2, reg1)
@@ -555,13 +642,47 @@ class TpaOutput:
 
         self.manager.append_regs(reg1)
 
+    def compare_goto(self, op_inst: str, left: int, right: int, label: str):
+        """
+        Jumps to the label if the int or float comparison 'op_inst' of left and right is true.
+
+        :param op_inst: the compare instruction, for example 'lti' or 'gef'
+        """
+        reg1, reg2 = self.manager.require_regs(2)
+
+        self.write_format("load", register(reg1), address(left))
+        self.write_format("load", register(reg2), address(right))
+        self.write_format("if_" + op_inst + "_goto", register(reg1), register(reg2), label)
+
+        self.manager.append_regs(reg2, reg1)
+
+    def i_compare_goto(self, op_inst: str, left: int, right_value: int, label: str):
+        reg1, reg2 = self.manager.require_regs(2)
+
+        self.write_format("load", register(reg1), address(left))
+        self.write_format("iload", register(reg2), number(right_value))
+        self.write_format("if_" + op_inst + "_goto", register(reg1), register(reg2), label)
+
+        self.manager.append_regs(reg2, reg1)
+
+    def table_goto(self, value_addr: int, low: int, labels: list, default_label: str):
+        """
+        Jumps to labels[value - low], or to the default label if the value is out of range.
+        """
+        reg1 = self.manager.require_reg()
+
+        self.write_format("load", register(reg1), address(value_addr))
+        self.write_format("table_goto", register(reg1), number(low), default_label, *labels)
+
+        self.manager.append_regs(reg1)
+
     def subclass_of(self, parent, child_ptr_addr, dst_addr):
         reg1, reg2, reg3, reg4 = self.manager.require_regs(4)
 
-        self.write_format("iload", register(reg1), number(parent))
+        self.write_format("iload", register(reg1), address(parent))
         self.write_format("load", register(reg2), address(child_ptr_addr))
         self.write_format("subclass", register(reg1), register(reg2), register(reg3), register(reg4))
-        self.write_format("iload", register(reg2), number(dst_addr))
+        self.write_format("iload", register(reg2), address(dst_addr))
         self.write_format("store", register(reg2), register(reg1))
 
         self.manager.append_regs(reg4, reg3, reg2, reg1)
@@ -575,18 +696,7 @@ class TpaOutput:
         self.manager.append_regs(reg1)
 
     def write_format(self, *inst):
-        self.output.append(self._format(*inst))
-
-    @staticmethod
-    def _format(*inst):
-        mne = inst[0]
-        s = "    " + mne
-        s += " " * max(14 - len(mne), 1)
-        for i in range(1, len(inst)):
-            x = str(inst[i])
-            s += x
-            s += " " * max(8 - len(x), 1)
-        return s.rstrip()
+        self.output.append([str(x) for x in inst])
 
     def generate(self, main_file_path, main_has_arg=False):
         if self.is_global:
@@ -597,14 +707,14 @@ class TpaOutput:
     def _global_generate(self, main_file_path, main_has_arg):
         # print(self.manager.class_func_order)
         for co in self.manager.class_headers:
+            ct: typ.ClassType = co.class_type
+            self.manager.module_file = self.manager.owners[util.class_name_with_path(ct.name, ct.file_path)]
             co.compile()
 
-        merged = ["version", str(util.BYTECODE_VERSION),
-                  "bits", str(util.VM_BITS),
-                  "stack_size", str(util.STACK_SIZE),
-                  "global_length", "",
-                  "literal", "",
-                  "classes"]
+        program = asm.AsmProgram()
+        program.version = util.BYTECODE_VERSION
+        program.bits = util.VM_BITS
+        program.stack_size = util.STACK_SIZE
 
         class_methods_map = {}
 
@@ -614,30 +724,28 @@ class TpaOutput:
 
             class_methods_map[full_name] = co.local_method_full_names
 
-            line = f"class {full_name} ${ct.mro[0].class_ptr}\nmro\n"
-            for mro_t in ct.mro[1:]:
-                line += "    " + mro_t.full_name() + "\n"
-            line += "methods\n"
+            mro = [mro_t.full_name() for mro_t in ct.mro[1:]]
+            methods = []
             # print(ct.method_rank)
-            for method_name, base_t in ct.method_rank:
-                method_t = ct.methods[method_name][base_t][2]
+            for (method_name, _), method_t in zip(ct.method_rank, ct.vtable()):
                 poly_name = typ.function_poly_name(
                     util.name_with_path(method_name, method_t.defined_class.file_path, method_t.defined_class),
                     method_t.param_types,
                     True)
-                line += \
-                    f"    {poly_name}\n"
-
-            line += "endclass\n"
-            merged.append(line)
-        merged.append("")
+                methods.append(poly_name)
+            program.classes.append(asm.AsmClass(full_name, address(ct.mro[0].class_ptr), mro, methods))
 
         compiled_fn_names = set()
 
+        linker = self.manager.linker
+
         def compile_function(fn_name):
             fo = self.manager.functions_map[fn_name]
-            content = fo.compile()
-            merged.extend(content)
+            self.manager.module_file = self.manager.owners[fn_name]
+            if linker is None:
+                program.functions.append(fo.compile())
+            else:
+                program.functions.append(linker.compile_function(fn_name, fo))
             compiled_fn_names.add(fn_name)
 
         for name, t in self.manager.class_func_order:
@@ -649,6 +757,9 @@ class TpaOutput:
                 for method_name in class_methods:
                     if method_name not in compiled_fn_names:
                         compile_function(method_name)
+        self.manager.module_file = main_file_path
+        if linker is not None:
+            linker.finish()
 
         # process string literals
         # mechanism:
@@ -667,11 +778,8 @@ class TpaOutput:
             self.manager.literal[char_arr_ptr_pos: char_arr_ptr_pos + util.PTR_LEN] = \
                 util.int_to_bytes(str_addr + self.manager.chars_pos_in_str + util.PTR_LEN)
 
-        merged[merged.index("global_length") + 1] = str(self.manager.global_length())
-        literal_str = " ".join([str(int(b)) for b in self.manager.literal])
-        merged[merged.index("literal") + 1] = literal_str
-
-        self.output = merged + self.output
+        program.global_length = self.manager.global_length()
+        program.literal = list(self.manager.literal)
 
         if main_has_arg:
             param_types = [typ.TYPE_STRING_ARR]
@@ -684,8 +792,14 @@ class TpaOutput:
                           util.name_with_path(typ.function_poly_name("main", param_types, False), main_file_path, None))
         self.write_format("exit")
 
+        program.entry = self.output
+        self.program = program
+
     def local_generate(self):
         pass
 
     def result(self):
-        return self.output
+        """
+        :return: the AsmProgram if this is the global output, otherwise the AsmFunction
+        """
+        return self.program if self.is_global else self.function
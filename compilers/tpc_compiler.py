@@ -1,5 +1,6 @@
 import sys
 import compilers.util as util
+import compilers.assembly as asm
 import compilers.tokens_lib as tl
 import compilers.errors as errs
 import compilers.types as typ
@@ -27,7 +28,7 @@ INSTRUCTIONS = {
     "astore_sp": (8,),
     "store_abs": (9, 1, 1),  # store_abs   %reg1   %reg2    | store value in %reg2 to abs_addr in %reg1
     "jump": (10, util.INT_LEN),
-    "move": (11,),
+    "move": (11, 1, 1),  # move   %reg1   %reg2    | copy value in %reg2 to %reg1
     "push": (12, util.INT_LEN),
     "ret": (13,),
     "push_fp": (14,),
@@ -92,6 +93,37 @@ INSTRUCTIONS = {
     #                               # | store true to %reg1
     #                               # if parent_class is super of child_class
     "exitv": (85, 1),  # exitv   %reg1 value    | exit with value stored in %reg1
+    "addi_imm": (86, 1, util.INT_LEN),  # addi_imm   %reg   value    | add value to %reg, also for other '_imm'
+    "subi_imm": (87, 1, util.INT_LEN),
+    "muli_imm": (88, 1, util.INT_LEN),
+    "divi_imm": (89, 1, util.INT_LEN),
+    "modi_imm": (90, 1, util.INT_LEN),
+    "eqi_imm": (91, 1, util.INT_LEN),
+    "nei_imm": (92, 1, util.INT_LEN),
+    "gti_imm": (93, 1, util.INT_LEN),
+    "lti_imm": (94, 1, util.INT_LEN),
+    "gei_imm": (95, 1, util.INT_LEN),
+    "lei_imm": (96, 1, util.INT_LEN),
+    "lshift_imm": (97, 1, util.INT_LEN),
+    "rshift_imm": (98, 1, util.INT_LEN),
+    "rshiftl_imm": (99, 1, util.INT_LEN),
+    "and_imm": (100, 1, util.INT_LEN),
+    "or_imm": (101, 1, util.INT_LEN),
+    "xor_imm": (102, 1, util.INT_LEN),
+    "table_jump": (103, 1, util.INT_LEN, util.INT_LEN),  # table_jump   %reg   low   count   default   offsets...
+    #                                                    # | jump by the offset of %reg - low, or default if out of range
+    "if_eqi_jump": (104, 1, 1, util.INT_LEN),  # if_eqi_jump   %reg1   %reg2   offset    | jump if %reg1 == %reg2
+    "if_nei_jump": (105, 1, 1, util.INT_LEN),
+    "if_lti_jump": (106, 1, 1, util.INT_LEN),
+    "if_lei_jump": (107, 1, 1, util.INT_LEN),
+    "if_gti_jump": (108, 1, 1, util.INT_LEN),
+    "if_gei_jump": (109, 1, 1, util.INT_LEN),
+    "if_eqf_jump": (110, 1, 1, util.INT_LEN),
+    "if_nef_jump": (111, 1, 1, util.INT_LEN),
+    "if_ltf_jump": (112, 1, 1, util.INT_LEN),
+    "if_lef_jump": (113, 1, 1, util.INT_LEN),
+    "if_gtf_jump": (114, 1, 1, util.INT_LEN),
+    "if_gef_jump": (115, 1, 1, util.INT_LEN),
 }
 
 MNEMONIC = {
@@ -107,7 +139,36 @@ PSEUDO_INSTRUCTIONS = {
 
 STR_PSEUDO_INSTRUCTIONS = {
     "if_zero_goto": 257,
-    "goto": 258
+    "goto": 258,
+    "table_goto": 259,  # table_goto   %reg   low   default_label   labels...
+    "if_eqi_goto": 260,  # if_eqi_goto   %reg1   %reg2   label
+    "if_nei_goto": 261,
+    "if_lti_goto": 262,
+    "if_lei_goto": 263,
+    "if_gti_goto": 264,
+    "if_gei_goto": 265,
+    "if_eqf_goto": 266,
+    "if_nef_goto": 267,
+    "if_ltf_goto": 268,
+    "if_lef_goto": 269,
+    "if_gtf_goto": 270,
+    "if_gef_goto": 271
+}
+
+# compare-and-goto pseudo instruction: the real instruction
+COMPARE_GOTOS = {
+    "if_eqi_goto": "if_eqi_jump",
+    "if_nei_goto": "if_nei_jump",
+    "if_lti_goto": "if_lti_jump",
+    "if_lei_goto": "if_lei_jump",
+    "if_gti_goto": "if_gti_jump",
+    "if_gei_goto": "if_gei_jump",
+    "if_eqf_goto": "if_eqf_jump",
+    "if_nef_goto": "if_nef_jump",
+    "if_ltf_goto": "if_ltf_jump",
+    "if_lef_goto": "if_lef_jump",
+    "if_gtf_goto": "if_gtf_jump",
+    "if_gef_goto": "if_gef_jump"
 }
 
 LENGTHS = {
@@ -118,180 +179,83 @@ LENGTHS = {
 
 class TpcCompiler:
     """
-    This class takes a tpa file and compile it to a tpc file.
+    This class takes a tpa program and compile it to a tpc program.
 
-    Which compiles all pseudo instructions to real instructions, and produces function list
+    Which compiles all pseudo instructions to real instructions, and resolves class headers and function calls
     """
 
-    def __init__(self, tpa_file: str):
-        self.tpa_file = tpa_file
-
-        self.stack_size = 0
-        self.global_length = 0
-        self.version = 0
-
-    def compile(self, out_name=None):
-        if out_name is None:
-            out_name = util.replace_extension(self.tpa_file, "tpc")
-
-        out_list = self.compile_to_list()
-
-        out_str = "\n".join(out_list)
+    def __init__(self, tpa_program: asm.AsmProgram):
+        self.tpa_program = tpa_program
 
-        with open(out_name, "w") as wf:
-            wf.write(out_str)
+        self.stack_size = tpa_program.stack_size
+        self.global_length = tpa_program.global_length
+        self.version = tpa_program.version
 
-    def compile_to_list(self):
-        literal = []
-        header_out = []
-        body_out = []
-        entry_out = []
-        cur_out = header_out
+    def compile(self) -> asm.AsmProgram:
+        program = self.tpa_program.copy_header(True)
 
         function_pointers = {}  # full poly name: $addr_text
         class_pointers = {}  # full poly name: $addr_text
 
-        with open(self.tpa_file, "r") as rf:
-            lines = [line.strip("\n") for line in rf.readlines()]
-        for line in lines:
-            if line.startswith("fn "):
-                first_line = [part.strip() for part in line.split(" ")]
-                name = first_line[1]
-                addr = first_line[2]
-                function_pointers[name] = addr
-            elif line.startswith("class "):
-                first_line = [part.strip() for part in line.split(" ")]
-                name = first_line[1]
-                addr = first_line[2]
-                class_pointers[name] = addr
-
-        i = 0
-        length = len(lines)
-        while i < length:
-            orig_line = lines[i]
-            line = orig_line.strip()
-            lf = tl.LineFile(self.tpa_file, i + 1)
-
-            if line == "version":
-                cur_out.append(lines[i])
-                cur_out.append(lines[i + 1])
-                self.version = int(lines[i + 1])
-                i += 1
-            elif line == "stack_size":
-                cur_out.append(lines[i])
-                cur_out.append(lines[i + 1])
-                self.stack_size = int(lines[i + 1])
-                i += 1
-            elif line == "global_length":
-                cur_out.append(lines[i])
-                cur_out.append(lines[i + 1])
-                self.global_length = int(lines[i + 1])
-                i += 1
-            elif line == "literal":
-                cur_out.append(lines[i])
-                cur_out.append(lines[i + 1])
-                literal_str = lines[i + 1].split(" ")
-                for lit in literal_str:
-                    literal.append(int(lit))
-                i += 1
-            elif line.strip().startswith("class "):
-                class_parts = [part.strip() for part in line.split(" ")]
-                out_parts = ["class", class_parts[1], "mro", class_parts[2]]
-                i += 1
-                new_line = lines[i].strip()
-                while not new_line.endswith("endclass"):
-                    class_parts.extend([part.strip() for part in new_line.split(" ")])
-                    i += 1
-                    new_line = lines[i].strip()
-                i += 1  # skips 'endclass'
-                mro_index = class_parts.index("mro")
-                methods_index = class_parts.index("methods")
-                for mro_class in class_parts[mro_index + 1: methods_index]:
-                    mro_ptr = class_pointers[mro_class]
-                    out_parts.append(mro_ptr)
-                out_parts.append("methods")
-                for method_name in class_parts[methods_index + 1:]:
-                    out_parts.append(function_pointers[method_name])
-                cur_out.append(" ".join(out_parts))
+        for fn in self.tpa_program.functions:
+            function_pointers[fn.name] = fn.ptr
+        for clazz in self.tpa_program.classes:
+            class_pointers[clazz.name] = clazz.ptr
+
+        for clazz in self.tpa_program.classes:
+            mro = [clazz.ptr] + [class_pointers[mro_class] for mro_class in clazz.mro]
+            methods = [function_pointers[method_name] for method_name in clazz.methods]
+            program.classes.append(asm.AsmClass(clazz.name, clazz.ptr, mro, methods))
+
+        for fn in self.tpa_program.functions:
+            if not fn.abstract:
+                body = self.compile_body(fn.body, function_pointers, fn.name)
+                program.functions.append(asm.AsmFunction(fn.name, fn.ptr, body, fn.inline))
+
+        program.entry = self.compile_body(self.tpa_program.entry, function_pointers, "entry")
+        return program
+
+    def compile_body(self, body: list, function_pointers: dict, name: str) -> list:
+        out = []
+        for i in range(len(body)):
+            inst = body[i]
+            mne = inst[0]
+            if mne == "call_fn":
+                out.append(["call", function_pointers[inst[1]]])
+            elif mne in PSEUDO_INSTRUCTIONS:
+                self.compile_pseudo_inst(inst, out, tl.LineFile(name, i + 1))
             else:
-                instructions = \
-                    [part for part in [part.strip() for part in line.split(" ")] if len(part) > 0]
-                for j in range(len(instructions)):
-                    part = instructions[j]
-                    if part == ";" or part.startswith(";", 0, -1):
-                        instructions = instructions[:j]
-                        break
-
-                if len(instructions) > 0:
-                    inst = instructions[0]
-                    if inst == "entry":
-                        cur_out = entry_out
-                        cur_out.append(orig_line)
-                    elif inst == "call_fn":
-                        fn_name = instructions[1]
-                        fn_ptr = function_pointers[fn_name]
-
-                        self.write_format(cur_out, "call", fn_ptr)
-                    elif inst == "fn":
-                        if "abstract" in instructions[2:]:
-                            if i < length - 2 and len(lines[i + 1].strip()) == 0:
-                                i += 1
-                        else:
-                            cur_out.append(orig_line)
-                    elif inst in PSEUDO_INSTRUCTIONS:
-                        self.compile_pseudo_inst(instructions, cur_out, lf)
-                    else:
-                        cur_out.append(orig_line)
-                else:
-                    cur_out.append(orig_line)
-
-            i += 1
-
-        return header_out + body_out + entry_out
+                out.append(inst)
+        return out
 
     def compile_pseudo_inst(self, inst_line, output: list, lf):
         inst = inst_line[0]
         tup = PSEUDO_INSTRUCTIONS[inst]
         num_inst = inst_to_num(inst_line, tup, lf)
+        lit_start = self.stack_size + self.global_length
         if inst == "load_lit":
-            lit_start = self.stack_size + self.global_length
-            self.write_format(output, "load", inst_line[1], "$" + str(num_inst[2] + lit_start))
+            output.append(["load", inst_line[1], "$" + str(num_inst[2] + lit_start)])
         elif inst == "loadc_lit":
-            lit_start = self.stack_size + self.global_length
-            self.write_format(output, "loadc", inst_line[1], "$" + str(num_inst[2] + lit_start))
+            output.append(["loadc", inst_line[1], "$" + str(num_inst[2] + lit_start)])
         elif inst == "loadb_lit":
-            lit_start = self.stack_size + self.global_length
-            self.write_format(output, "loadb", inst_line[1], "$" + str(num_inst[2] + lit_start))
+            output.append(["loadb", inst_line[1], "$" + str(num_inst[2] + lit_start)])
         elif inst == "lit_abs":
-            lit_start = self.stack_size + self.global_length
-            self.write_format(output, "aload", inst_line[1], "$" + str(num_inst[2] + lit_start))
-
-    def write_format(self, output: list, *inst):
-        output.append(self._format(*inst))
-
-    @staticmethod
-    def _format(*inst):
-        mne = inst[0]
-        s = "    " + mne
-        s += " " * max(14 - len(mne), 1)
-        for i in range(1, len(inst)):
-            x = str(inst[i])
-            s += x
-            s += " " * max(8 - len(x), 1)
-        return s.rstrip()
+            output.append(["aload", inst_line[1], "$" + str(num_inst[2] + lit_start)])
 
 
 class TpeCompiler:
-    def __init__(self, tpc_file: str):
-        self.tpc_file = tpc_file
-
-        self.stack_size = 0
-        self.global_length = 0
+    def __init__(self, tpc_program: asm.AsmProgram, object_code: dict = None):
+        """
+        :param object_code: function name: (bytes, relocations) assembled in an earlier compile, which are patched
+        instead of assembled, see 'assemble_function'. Functions mapped to None are assembled and filled in.
+        """
+        self.tpc_program = tpc_program
+        self.object_code = object_code
 
-    def compile(self, out_name=None):
-        if out_name is None:
-            out_name = util.replace_extension(self.tpc_file, "tpe")
+        self.stack_size = tpc_program.stack_size
+        self.global_length = tpc_program.global_length
 
+    def compile(self, out_name: str):
         compiled = self.compile_bytes()
         # print(compiled)
         with open(out_name, "wb") as wf:
@@ -325,9 +289,10 @@ class TpeCompiler:
 
         :return:
         """
-        version = 0
-        vm_bits = 0
-        literal = bytearray()
+        program = self.tpc_program
+        version = program.version
+        vm_bits = program.bits
+        literal = bytearray(program.literal)
         function_body_positions = {}
         function_pointers = {}
         function_list = []
@@ -336,141 +301,41 @@ class TpeCompiler:
         class_list = []
         class_bodies = bytearray()
         body = bytearray()  # body begins with index 'literal_length + global_length'
-        cur_fn_body = []
-        entry_part = None
-        labels = {}
-        jumps = {}
-        goto_count = 0
 
-        with open(self.tpc_file, "r") as rf:
-            lines = [line.strip() for line in rf.readlines()]
-            i = 0
-            length = len(lines)
-            while i < length:
-                line = lines[i]
-                lf = tl.LineFile(self.tpc_file, i + 1)
-                if line == "version":
-                    version = int(lines[i + 1])
-                    i += 1
-                elif line == "bits":
-                    vm_bits = int(lines[i + 1])
-                    i += 1
-                elif line == "stack_size":
-                    self.stack_size = int(lines[i + 1])
-                    i += 1
-                elif line == "global_length":
-                    self.global_length = int(lines[i + 1])
-                    i += 1
-                elif line == "literal":
-                    literal_str = lines[i + 1].split(" ")
-                    for lit in literal_str:
-                        literal.append(int(lit))
-                    i += 1
-                elif line == "classes":
-                    pass
-                elif line.startswith("class"):
-                    # format of class header:
-                    # Example in 64 bits
-                    # 0 ~ 8: len(mro)
-                    # 8 ~ 16: len(methods)
-                    # 16 ~ 16 + 8 * len(mro): pointers of mro
-                    # 16 + 8 * len(mro) ~ 16 + 8 * len(mro) + 8 * len(methods): method pointers
-                    # len(class_name)
-                    # class_name
-                    content = [part for part in [part.strip() for part in line.split(" ")] if len(part) > 0]
-                    method_start = content.index("methods")
-                    mro_str = content[3:method_start]
-                    methods_str = content[method_start + 1:]
-                    class_name = content[1]
-                    class_list.append(class_name)  # name
-                    class_ptr = int(mro_str[0][1:])
-                    class_pointers[class_name] = class_ptr
-
-                    class_header = bytearray()
-                    class_header.extend(util.int_to_bytes(len(mro_str)))  # len of mro
-                    class_header.extend(util.int_to_bytes(len(methods_str)))  # methods count
-
-                    for m in mro_str:
-                        class_header.extend(util.int_to_bytes(int(m[1:])))  # mro pointers
-                    for m in methods_str:
-                        class_header.extend(util.int_to_bytes(int(m[1:])))  # method pointers
-
-                    class_header.extend(util.string_to_bytes(class_name))  # class name
-                    class_header_lengths[class_name] = len(class_header)
-                    class_bodies.extend(class_header)
-                else:
-                    instructions = \
-                        [part for part in [part.strip() for part in line.split(" ")] if len(part) > 0]
-                    for j in range(len(instructions)):
-                        part = instructions[j]
-                        if part == ";" or part.startswith(";", 0, -1):
-                            instructions = instructions[:j]
-                            break
-                    if len(instructions) > 0:
-                        inst = instructions[0]
-                        if inst == "fn":
-                            cur_fn_name = instructions[1]
-                            if not instructions[2].startswith("$"):
-                                raise errs.TpaError("Incorrect number format. ", lf)
-                            cur_fn_ptr = int(instructions[2][1:])
-                            cur_fn_body = []
-                            function_pointers[cur_fn_name] = cur_fn_ptr
-                            function_list.append(cur_fn_name)
-                            function_body_positions[cur_fn_name] = len(body)
-                        elif inst == "entry":
-                            cur_fn_body = []
-                        elif inst == "args":
-                            pass
-                        # elif inst == "call_fn":
-                        #     fn_name = instructions[1]
-                        #     fn_ptr = function_pointers[fn_name]
-                        #     tup = INSTRUCTIONS["call"]
-                        #     cur_fn_body.append(tup[0])
-                        #     cur_fn_body.extend(util.int_to_bytes(fn_ptr))
-                        elif inst == "label":
-                            label_name = instructions[1]
-                            labels[label_name] = len(cur_fn_body)
-                        elif inst == "goto":
-                            label_name = instructions[1]
-                            cur_fn_body.append(STR_PSEUDO_INSTRUCTIONS["goto"])
-                            cur_fn_body.extend(util.int_to_bytes(goto_count))
-                            jumps[goto_count] = label_name
-                            goto_count += 1
-                        elif inst == "if_zero_goto":
-                            label_name = instructions[2]
-                            cur_fn_body.append(STR_PSEUDO_INSTRUCTIONS["if_zero_goto"])
-                            cur_fn_body.append(num_single(inst, instructions[1], 1, lf))
-                            cur_fn_body.extend(util.int_to_bytes(goto_count))
-                            jumps[goto_count] = label_name
-                            goto_count += 1
-                        elif inst == "stop":  # end of a function, not a 'return'
-                            compiled_fn_body = self.compile_function(cur_fn_body, labels, jumps)
-                            body.extend(compiled_fn_body)
-                            labels.clear()
-                            jumps.clear()
-                            goto_count = 0
-                        elif inst == "require":
-                            req_name = instructions[1]
-                            req_ptr_addr = num_single("require", instructions[2], util.PTR_LEN, lf)
-                            reg1 = instructions[3]
-                            reg2 = instructions[4]
-                            req_id, req_type = typ.NATIVE_FUNCTIONS[req_name]
-                            # function_pointers[req_name] = req_ptr_addr
-
-                            self.compile_inst("iload", ["iload", reg1, "$" + str(req_id)], cur_fn_body, lf)
-                            self.compile_inst("iload", ["iload", reg2, "$" + str(req_ptr_addr)], cur_fn_body, lf)
-                            self.compile_inst("store", ["store", reg2, reg1], cur_fn_body, lf)
-
-                        elif inst in INSTRUCTIONS:
-                            # real instructions
-                            self.compile_inst(inst, instructions, cur_fn_body, lf)
-
-                            if inst == "exit":  # end of program
-                                entry_part = self.compile_function(cur_fn_body, labels, jumps)
-
-                        else:
-                            raise errs.TpaError("Unknown instruction {}. ".format(inst), lf)
-                i += 1
+        for clazz in program.classes:
+            # format of class header:
+            # Example in 64 bits
+            # 0 ~ 8: len(mro)
+            # 8 ~ 16: len(methods)
+            # 16 ~ 16 + 8 * len(mro): pointers of mro
+            # 16 + 8 * len(mro) ~ 16 + 8 * len(mro) + 8 * len(methods): method pointers
+            # len(class_name)
+            # class_name
+            class_name = clazz.name
+            class_list.append(class_name)  # name
+            class_ptr = int(clazz.mro[0][1:])
+            class_pointers[class_name] = class_ptr
+
+            class_header = bytearray()
+            class_header.extend(util.int_to_bytes(len(clazz.mro)))  # len of mro
+            class_header.extend(util.int_to_bytes(len(clazz.methods)))  # methods count
+
+            for m in clazz.mro:
+                class_header.extend(util.int_to_bytes(int(m[1:])))  # mro pointers
+            for m in clazz.methods:
+                class_header.extend(util.int_to_bytes(int(m[1:])))  # method pointers
+
+            class_header.extend(util.string_to_bytes(class_name))  # class name
+            class_header_lengths[class_name] = len(class_header)
+            class_bodies.extend(class_header)
+
+        for fn in program.functions:
+            function_pointers[fn.name] = int(fn.ptr[1:])
+            function_list.append(fn.name)
+            function_body_positions[fn.name] = len(body)
+            body.extend(self.assemble_function(fn))
+
+        entry_part = self.assemble(program.entry, "entry")
 
         header = SIGNATURE + bytes((vm_bits,)) + util.u_short_to_bytes(version) + util.empty_bytes(9) + \
                  util.int_to_bytes(self.stack_size) + util.int_to_bytes(self.global_length) + \
@@ -502,11 +367,121 @@ class TpeCompiler:
         entry_len = len(entry_part) + len(class_assignments) + len(fn_assignments)
         return header + body + class_assignments + fn_assignments + entry_part + util.int_to_bytes(entry_len)
 
+    def assemble_function(self, fn: asm.AsmFunction) -> bytearray:
+        """
+        Assembles a function, or patches its bytes from 'object_code'.
+
+        The relocations of the bytes are (position in bytes, instruction index, operand index) of all address operands
+        of globals and literals, which are the only operands that differ between compiles of the same code.
+        """
+        if self.object_code is None or fn.name not in self.object_code:
+            return self.assemble(fn.body, fn.name)
+        code = self.object_code[fn.name]
+        if code is None:
+            relocations = []
+            assembled = self.assemble(fn.body, fn.name, relocations)
+            self.object_code[fn.name] = bytes(assembled), relocations
+            return assembled
+        assembled, relocations = code
+        patched = bytearray(assembled)
+        for pos, i, j in relocations:
+            patched[pos: pos + util.INT_LEN] = util.int_to_bytes(int(fn.body[i][j][1:]))
+        return patched
+
+    def assemble(self, insts: list, name: str, relocations: list = None) -> bytearray:
+        """
+        Assembles the instructions of a function or the entry to bytes.
+
+        :param insts: instructions
+        :param name: name of the function, for error messages
+        :param relocations: if not None, the relocations of the bytes are appended to it, see 'assemble_function'
+        """
+        cur_fn_body = []
+        labels = {}
+        jumps = {}
+        goto_count = 0
+
+        for i in range(len(insts)):
+            instructions = insts[i]
+            inst = instructions[0]
+            lf = tl.LineFile(name, i + 1)
+            if inst == "args" or inst == "stop" or inst.startswith(";"):
+                pass
+            # elif inst == "call_fn":
+            #     fn_name = instructions[1]
+            #     fn_ptr = function_pointers[fn_name]
+            #     tup = INSTRUCTIONS["call"]
+            #     cur_fn_body.append(tup[0])
+            #     cur_fn_body.extend(util.int_to_bytes(fn_ptr))
+            elif inst == "label":
+                label_name = instructions[1]
+                labels[label_name] = len(cur_fn_body)
+            elif inst == "goto":
+                label_name = instructions[1]
+                cur_fn_body.append(STR_PSEUDO_INSTRUCTIONS["goto"])
+                cur_fn_body.extend(util.int_to_bytes(goto_count))
+                jumps[goto_count] = label_name
+                goto_count += 1
+            elif inst == "if_zero_goto":
+                label_name = instructions[2]
+                cur_fn_body.append(STR_PSEUDO_INSTRUCTIONS["if_zero_goto"])
+                cur_fn_body.append(num_single(inst, instructions[1], 1, lf))
+                cur_fn_body.extend(util.int_to_bytes(goto_count))
+                jumps[goto_count] = label_name
+                goto_count += 1
+            elif inst in COMPARE_GOTOS:
+                label_name = instructions[3]
+                cur_fn_body.append(STR_PSEUDO_INSTRUCTIONS[inst])
+                cur_fn_body.append(num_single(inst, instructions[1], 1, lf))
+                cur_fn_body.append(num_single(inst, instructions[2], 1, lf))
+                cur_fn_body.extend(util.int_to_bytes(goto_count))
+                jumps[goto_count] = label_name
+                goto_count += 1
+            elif inst == "table_goto":
+                cur_fn_body.append(STR_PSEUDO_INSTRUCTIONS["table_goto"])
+                cur_fn_body.append(num_single(inst, instructions[1], 1, lf))
+                cur_fn_body.extend(util.int_to_bytes(num_single(inst, instructions[2], util.INT_LEN, lf)))
+                cur_fn_body.extend(util.int_to_bytes(len(instructions) - 4))  # count of labels except default
+                for label_name in instructions[3:]:
+                    cur_fn_body.extend(util.int_to_bytes(goto_count))
+                    jumps[goto_count] = label_name
+                    goto_count += 1
+            elif inst == "require":
+                req_name = instructions[1]
+                req_ptr_addr = num_single("require", instructions[2], util.PTR_LEN, lf)
+                reg1 = instructions[3]
+                reg2 = instructions[4]
+                req_id, req_type = typ.NATIVE_FUNCTIONS[req_name]
+                # function_pointers[req_name] = req_ptr_addr
+
+                self.compile_inst("iload", ["iload", reg1, "$" + str(req_id)], cur_fn_body, lf)
+                self.compile_inst("iload", ["iload", reg2, "$" + str(req_ptr_addr)], cur_fn_body, lf)
+                self.compile_inst("store", ["store", reg2, reg1], cur_fn_body, lf)
+
+            elif inst in INSTRUCTIONS:
+                # real instructions
+                tup = INSTRUCTIONS[inst]
+                if relocations is not None and len(instructions) == len(tup):
+                    pos = len(cur_fn_body) + 1
+                    for j in range(1, len(tup)):
+                        operand = instructions[j]
+                        if tup[j] == util.INT_LEN and operand[0] == "$" and int(operand[1:]) >= self.stack_size:
+                            relocations.append((pos, i, j))
+                        pos += tup[j]
+                self.compile_inst(inst, instructions, cur_fn_body, lf)
+            else:
+                raise errs.TpaError("Unknown instruction {}. ".format(inst), lf)
+
+        return self.compile_function(cur_fn_body, labels, jumps)
+
     def compile_function(self, body: iter, labels: dict, jumps: dict) -> bytearray:
         goto = STR_PSEUDO_INSTRUCTIONS["goto"]
         if_zero_goto = STR_PSEUDO_INSTRUCTIONS["if_zero_goto"]
         jump = INSTRUCTIONS["jump"]
         if_zero_jump = INSTRUCTIONS["if_zero_jump"]
+        table_goto = STR_PSEUDO_INSTRUCTIONS["table_goto"]
+        table_jump = INSTRUCTIONS["table_jump"]
+        compare_jumps = {STR_PSEUDO_INSTRUCTIONS[pseudo]: INSTRUCTIONS[real] for pseudo, real in COMPARE_GOTOS.items()}
         i = 0
         length = len(body)
         while i < length:
@@ -529,6 +504,23 @@ class TpeCompiler:
                 body[i] = if_zero_jump[0]
                 body[i + 2: i + 2 + util.INT_LEN] = util.int_to_bytes(jump_len)
                 i = end_len
+            elif b in compare_jumps:
+                goto_id = util.bytes_to_int(body[i + 3:i + 3 + util.INT_LEN])
+                tar_label = jumps[goto_id]
+                label_pos = labels[tar_label]
+                end_len = i + util.INT_LEN + 3
+                jump_len = label_pos - end_len
+                body[i] = compare_jumps[b][0]
+                body[i + 3: i + 3 + util.INT_LEN] = util.int_to_bytes(jump_len)
+                i = end_len
+            elif b == table_goto:
+                count = util.bytes_to_int(body[i + 2 + util.INT_LEN:i + 2 + util.INT_LEN * 2])
+                end_len = i + 2 + util.INT_LEN * (count + 3)
+                body[i] = table_jump[0]
+                for j in range(i + 2 + util.INT_LEN * 2, end_len, util.INT_LEN):
+                    goto_id = util.bytes_to_int(body[j:j + util.INT_LEN])
+                    body[j:j + util.INT_LEN] = util.int_to_bytes(labels[jumps[goto_id]] - end_len)
+                i = end_len
             else:
                 i += 1
         return bytearray(body)
@@ -567,7 +559,7 @@ def inst_to_num(actual_line: list, tup: tuple, lf) -> list:
 
 
 def num_single(inst: str, symbol: str, expected_len: int, lf) -> int:
-    if symbol.isdigit():
+    if symbol.lstrip("-").isdigit():
         if expected_len != util.INT_LEN:
             raise errs.TpaError("Instruction argument of {} length do not match. ".format(inst), lf)
         num = int(symbol)
@@ -582,5 +574,5 @@ def num_single(inst: str, symbol: str, expected_len: int, lf) -> int:
 if __name__ == '__main__':
     if len(sys.argv) > 1:
         file = sys.argv[1]
-        cmp = TpeCompiler(file)
-        cmp.compile()
+        cmp = TpeCompiler(asm.read_program(file))
+        cmp.compile(util.replace_extension(file, "tpe"))
@@ -1,107 +1,73 @@
 import sys
-import compilers.tokens_lib as tl
 import compilers.util as util
+import compilers.assembly as asm
+import compilers.tpc_compiler as tpc
 
 
 INLINE_MAX_INST = 200
 INLINE_MAX_STACK = util.INT_LEN * 8
 
+REGISTERS = ["%7", "%6", "%5", "%4", "%3", "%2", "%1", "%0"]  # the order of trying free registers
+
+# instructions that run another function, which may use all registers
+CALLS = {"call", "call_reg"}
+
+# instructions that never go on to the next instruction
+NO_FALL_THROUGH = {"goto", "table_goto", "ret", "stop", "exit", "exitv"}
+
+# instructions that only write their first register, without reading it
+PURE_DEFS = {"load", "iload", "aload", "aload_sp", "loadc", "loadb", "rload_abs", "rloadc_abs", "rloadb_abs", "move"}
+
+# instructions that read and write their first register, and only read the others
+IN_PLACE = {"addi", "subi", "muli", "divi", "modi", "eqi", "nei", "gti", "lti", "gei", "lei", "negi", "not", "lshift",
+            "rshift", "rshiftl", "and", "or", "xor", "addf", "subf", "mulf", "divf", "modf", "eqf", "nef", "gtf", "ltf",
+            "gef", "lef", "negf", "i_to_f", "f_to_i", "true_addr",
+            *[name for name in tpc.INSTRUCTIONS if name.endswith("_imm")]}
+
+# instructions that only read their registers
+READ_ONLY = {"store", "astore", "store_abs", "copy", "storec", "storec_abs", "storeb", "storeb_abs", "set_ret",
+             "put_ret", "call_reg", "exitv", "if_zero_goto", "table_goto", *tpc.COMPARE_GOTOS}
+
+LOOP_WEIGHT = 10  # a reference inside a loop counts as this many references outside
+
 
 class TpcOptimizer:
-    def __init__(self, tpc_file: str, opt_level: int):
-        self.tpc_file = tpc_file
+    def __init__(self, tpc_program: asm.AsmProgram, opt_level: int):
+        self.tpc_program = tpc_program
         self.opt_level = opt_level
 
         self.opt_literal = opt_level >= 1
         self.do_inline = opt_level >= 1
         self.unused_label = opt_level >= 1
+        self.reg_alloc = opt_level >= 1
         self.retract_literal = opt_level >= 2
 
-        self.bits = 0
-        self.stack_size = 0
-        self.global_length = 0
+        self.bits = tpc_program.bits
+        self.stack_size = tpc_program.stack_size
+        self.global_length = tpc_program.global_length
 
         self.inline_count = 0
 
-        self.header = []
         self.functions = {}
         self.function_orders = []
-        self.entry = []
 
     def addr_is_literal(self, addr):
         return self.stack_size + self.global_length <= addr
 
-    def optimize(self, out_name: str):
+    def optimize(self) -> asm.AsmProgram:
         self.read_instructions()
 
-        out_list = self.compile_to_list()
-        out_str = "\n".join(out_list)
-
-        with open(out_name, "w") as wf:
-            wf.write(out_str)
+        return self.compile_program()
 
     def read_instructions(self):
-        cur_out = []
-
-        with open(self.tpc_file, "r") as rf:
-            lines = [line.strip("\n") for line in rf.readlines()]
-            i = 0
-            length = len(lines)
-            while i < length:
-                orig_line = lines[i]
-                line = orig_line.strip()
-                lf = tl.LineFile(self.tpc_file, i + 1)
-
-                if line == "version":
-                    self.header.append(lines[i])
-                    self.header.append(lines[i + 1])
-                    i += 1
-                elif line == "bits":
-                    self.header.append(lines[i])
-                    self.header.append(lines[i + 1])
-                    self.bits = int(lines[i + 1])
-                    i += 1
-                elif line == "stack_size":
-                    self.header.append(lines[i])
-                    self.header.append(lines[i + 1])
-                    self.stack_size = int(lines[i + 1])
-                    i += 1
-                elif line == "global_length":
-                    self.header.append(lines[i])
-                    self.header.append(lines[i + 1])
-                    self.global_length = int(lines[i + 1])
-                    i += 1
-                elif line == "literal":
-                    self.header.append(lines[i])
-                    self.header.append(lines[i + 1])
-                    i += 1
-                elif line == "classes":
-                    self.header.append(line)
-                elif line.startswith("class "):
-                    self.header.append(line)
-                else:
-                    instructions = \
-                        [part for part in [part.strip() for part in line.split(" ")] if len(part) > 0]
-                    if len(instructions) > 0:
-                        inst = instructions[0]
-                        if inst == "fn":
-                            fn_name = instructions[1]
-                            fn_ptr = instructions[2]
-                            # need find by value to find ptr
-                            self.functions[fn_name] = (fn_ptr, cur_out, "inline" in instructions[2:])
-                            self.function_orders.append(fn_name)
-                        elif inst == "stop":
-                            cur_out.append(instructions)
-                            cur_out = []
-                        elif inst == "entry":
-                            cur_out = self.entry
-                            # cur_out.append(instructions)
-                        else:
-                            cur_out.append(instructions)
-                i += 1
-
-    def compile_to_list(self):
-        body = []
+        for fn in self.tpc_program.functions:
+            # need find by value to find ptr
+            self.functions[fn.name] = (fn.ptr, fn.body, fn.inline)
+            self.function_orders.append(fn.name)
+
+    def compile_program(self) -> asm.AsmProgram:
+        program = self.tpc_program.copy_header(True)
+        program.classes = self.tpc_program.classes
         for fn_name in self.function_orders:
             fn_ptr, fn_body, inline = self.functions[fn_name]
 
@@ -111,15 +77,14 @@ class TpcOptimizer:
                 fn_body = self.function_inline(fn_body, fn_ptr)
             if self.unused_label:
                 fn_body = self.remove_unused_label(fn_body)
+            if self.reg_alloc:
+                fn_body = self.allocate_registers(fn_body)
+                fn_body = fold_moves(fn_body)
 
-            body.append(f"\nfn {fn_name} {fn_ptr}")
-            for inst in fn_body:
-                self.write_format(body, *inst)
+            program.functions.append(asm.AsmFunction(fn_name, fn_ptr, fn_body, inline))
 
-        entry = ["\nentry"]
-        for inst in self.entry:
-            self.write_format(entry, *inst)
-        return self.header + body + entry
+        program.entry = self.tpc_program.entry
+        return program
 
     def function_inline(self, fn_body: list, caller_ptr: str):
         occupied_regs = 0
@@ -272,6 +237,10 @@ class TpcOptimizer:
             elif inst[0] == "if_zero_goto":
                 cond_addr = make_addr(inst[1]) if inst[1].startswith("$") else inst[1]
                 new_body.append([inst[0], cond_addr, f"{inst[2]}_{self.inline_count}"])
+            elif inst[0] in tpc.COMPARE_GOTOS:
+                new_body.append(inst[:3] + [f"{inst[3]}_{self.inline_count}"])
+            elif inst[0] == "table_goto":
+                new_body.append(inst[:3] + [f"{label}_{self.inline_count}" for label in inst[3:]])
             else:
                 new_inst = []
                 for item in inst:
@@ -330,19 +299,396 @@ class TpcOptimizer:
             i += 1
         return new_body
 
-    def write_format(self, output: list, *inst):
-        output.append(self._format(*inst))
-
-    @staticmethod
-    def _format(*inst):
-        mne = inst[0]
-        s = "    " + mne
-        s += " " * max(14 - len(mne), 1)
-        for i in range(1, len(inst)):
-            x = str(inst[i])
-            s += x
-            s += " " * max(8 - len(x), 1)
-        return s.rstrip()
+    def allocate_registers(self, func_body: list) -> list:
+        """
+        Keeps the frame slots of a function in registers, by linear scan over the live intervals of the slots.
+
+        A slot is a candidate if it is written by 'iload %a slot; store %a %v', read by 'load %r slot', does not
+        overlap other slots and lies below every address taken by 'aload'. Liveness of the candidates and of the
+        registers used by the code is solved over the control flow graph, so the interval of a slot used by a loop
+        covers the whole loop. Intervals are scanned in the order of their starts, each of them takes a register
+        that the code does not use during the interval. If no register is free, the one with the lowest spill cost
+        among the interval and the active ones is spilled, that is, it stays in its slot. The cost of a slot is its
+        number of references, a reference inside loops counts 'LOOP_WEIGHT' times for each loop.
+
+        A called function may use all registers, so slots live across a call are saved to the frame before the
+        call if written since the last save, and loaded again after it. Writes of slots never read again are
+        removed.
+
+        :return: the new function body
+        """
+        push_index = None
+        for i in range(len(func_body)):
+            if func_body[i][0] == "push":
+                push_index = i
+                break
+            if func_body[i][0] == "label" or func_body[i][0] in NO_FALL_THROUGH:
+                return func_body
+        if push_index is None:
+            return func_body
+        frame = int(func_body[push_index][1])
+
+        writes = {}  # index of store: slot
+        reads = {}  # index of load: slot
+        invalid = set()
+        referenced = set()
+        escaped = frame  # slots from the lowest address taken by 'aload' may be accessed through pointers
+        i = 0
+        while i < len(func_body):
+            inst = func_body[i]
+            slot = frame_slot(inst[2], frame) if len(inst) == 3 else None
+            if inst[0] == "iload" and slot is not None and i + 1 < len(func_body) and \
+                    func_body[i + 1][0] == "store" and func_body[i + 1][1] == inst[1] and \
+                    func_body[i + 1][2] != inst[1]:
+                writes[i + 1] = slot
+                i += 1
+            elif inst[0] == "load" and slot is not None:
+                reads[i] = slot
+            elif inst[0] != "push" and not inst[0].endswith("sp") and not inst[0].endswith("_imm"):
+                for item in inst[1:]:
+                    slot = frame_slot(item, frame)
+                    if slot is not None:
+                        invalid.add(slot)
+                        if inst[0] == "aload":
+                            escaped = min(escaped, slot)
+                slot = None
+            if slot is not None:
+                referenced.add(slot)
+            i += 1
+        referenced.update(invalid)
+        for slot in referenced:
+            for other in referenced:
+                if slot != other and abs(slot - other) < util.INT_LEN:
+                    invalid.add(slot)
+        candidates = sorted([slot for slot in referenced if slot not in invalid and slot < escaped])
+        if len(candidates) == 0:
+            return func_body
+
+        succ = control_flow(func_body)
+        if succ is None:
+            return func_body
+
+        # bit 0 to 7 are the registers, then one bit for each candidate slot
+        slot_bits = {slot: 1 << (len(REGISTERS) + k) for k, slot in enumerate(candidates)}
+        uses = [0] * len(func_body)
+        kills = [0] * len(func_body)
+        for i in range(len(func_body)):
+            uses[i], kills[i] = register_effects(func_body[i])
+            if i in writes:
+                kills[i] |= slot_bits.get(writes[i], 0)
+            elif i in reads:
+                uses[i] |= slot_bits.get(reads[i], 0)
+        live_in, live_out = solve_liveness(succ, uses, kills)
+
+        for i in writes:
+            # the address of the slot is used later
+            if live_out[i] & reg_bit(func_body[i][1]):
+                slot_bits.pop(writes[i], None)
+
+        depths = loop_depths(succ)
+        costs = {}  # slot: spill cost
+        for i, slot in [*writes.items(), *reads.items()]:
+            costs[slot] = costs.get(slot, 0) + LOOP_WEIGHT ** depths[i]
+
+        intervals = {}  # slot: [start, end]
+        for i in range(len(func_body)):
+            live = live_in[i] | live_out[i]
+            for slot, bit in slot_bits.items():
+                if live & bit:
+                    if slot in intervals:
+                        intervals[slot][1] = i
+                    else:
+                        intervals[slot] = [i, i]
+
+        busy = {}  # register: prefix counts of instructions where the code uses it
+        for reg in REGISTERS:
+            bit = reg_bit(reg)
+            counts = [0]
+            for i in range(len(func_body)):
+                counts.append(counts[-1] + bool((uses[i] | kills[i] | live_in[i] | live_out[i]) & bit))
+            busy[reg] = counts
+
+        assigned = {}  # slot: register
+        active = []  # [end, slot], slots having registers and alive at the current start
+        for slot in sorted(intervals, key=lambda s: intervals[s][0]):
+            start, end = intervals[slot]
+            active = [act for act in active if act[0] >= start]
+            usable = [reg for reg in REGISTERS if busy[reg][end + 1] == busy[reg][start]]
+            taken = {assigned[act[1]] for act in active}
+            free = [reg for reg in usable if reg not in taken]
+            if len(free) > 0:
+                assigned[slot] = free[0]
+                active.append([end, slot])
+                continue
+            victims = [act for act in active if assigned[act[1]] in usable]
+            if len(victims) > 0:
+                victim = min(victims, key=lambda act: (costs[act[1]], -act[0]))
+                if costs[victim[1]] < costs[slot]:
+                    assigned[slot] = assigned.pop(victim[1])
+                    active.remove(victim)
+                    active.append([end, slot])
+        if len(assigned) == 0 and len(slot_bits) == 0:
+            return func_body
+        assigned_bits = 0
+        for slot in assigned:
+            assigned_bits |= slot_bits[slot]
+
+        # slots saved before calls, and the registers holding their addresses while saving
+        scratches = {}  # index of call: scratch register
+        write_through = set()  # slots live across calls without free registers, always written to the frame
+        for i in range(len(func_body)):
+            if func_body[i][0] in CALLS and live_out[i] & assigned_bits:
+                in_use = {assigned[slot] for slot in assigned if live_in[i] & slot_bits[slot]}
+                for reg in reversed(REGISTERS):
+                    if reg not in in_use and not (uses[i] | live_in[i]) & reg_bit(reg):
+                        scratches[i] = reg
+                        break
+                else:
+                    write_through.update([slot for slot in assigned if live_out[i] & slot_bits[slot]])
+        dirty = [0] * len(func_body)  # slots written after the last save, before each instruction
+        gens = [0] * len(func_body)
+        for i in writes:
+            slot = writes[i]
+            if slot in assigned and slot not in write_through and live_out[i] & slot_bits[slot]:
+                gens[i] = slot_bits[slot]
+        solve_forward(succ, gens, [func_body[i][0] in CALLS for i in range(len(func_body))], dirty)
+
+        new_body = []
+        for i in range(len(func_body)):
+            inst = func_body[i]
+            if i in scratches:
+                for slot in assigned:
+                    if dirty[i] & live_out[i] & slot_bits[slot]:
+                        new_body.append(["iload", scratches[i], f"${slot}"])
+                        new_body.append(["store", scratches[i], assigned[slot]])
+            if i in writes and writes[i] in slot_bits:
+                slot = writes[i]
+                if not live_out[i] & slot_bits[slot]:  # never read again
+                    new_body.pop()
+                elif slot in write_through:
+                    new_body.append(inst)
+                    new_body.append(["move", assigned[slot], inst[2]])
+                elif slot in assigned:
+                    new_body.pop()
+                    new_body.append(["move", assigned[slot], inst[2]])
+                else:
+                    new_body.append(inst)
+            elif i in reads and reads[i] in assigned:
+                new_body.append(["move", inst[1], assigned[reads[i]]])
+            else:
+                new_body.append(inst)
+            if i == push_index or inst[0] in CALLS:
+                for slot in assigned:
+                    if live_out[i] & slot_bits[slot]:
+                        new_body.append(["load", assigned[slot], f"${slot}"])
+        return new_body
+
+
+def frame_slot(item: str, frame: int):
+    """
+    :return: the address if the operand is an address in the current stack frame, otherwise None
+    """
+    if item.startswith("$") and item[1:].isdigit() and int(item[1:]) < frame:
+        return int(item[1:])
+    return None
+
+
+def reg_bit(reg: str) -> int:
+    return 1 << int(reg[1:])
+
+
+def control_flow(func_body: list):
+    """
+    :return: indices of the successors of each instruction, or None if a jump target is not in this function
+    """
+    labels = {}
+    for i in range(len(func_body)):
+        if func_body[i][0] == "label":
+            labels[func_body[i][1]] = i
+    succ = []
+    for i in range(len(func_body)):
+        inst = func_body[i]
+        if inst[0] == "goto":
+            targets = [inst[1]]
+        elif inst[0] == "if_zero_goto":
+            targets = [inst[2]]
+        elif inst[0] in tpc.COMPARE_GOTOS:
+            targets = [inst[3]]
+        elif inst[0] == "table_goto":
+            targets = inst[3:]
+        else:
+            targets = []
+        if any(label not in labels for label in targets):
+            return None
+        nexts = [labels[label] for label in targets]
+        if inst[0] not in NO_FALL_THROUGH and i + 1 < len(func_body):
+            nexts.append(i + 1)
+        succ.append(nexts)
+    return succ
+
+
+def register_effects(inst: list) -> (int, int):
+    """
+    :return: bits of the registers read by the instruction, and bits of the registers it writes without reading
+    """
+    regs = [item for item in inst[1:] if item.startswith("%")]
+    kills = 0
+    if inst[0] in PURE_DEFS and inst[1] not in inst[2:]:
+        kills = reg_bit(inst[1])
+        regs = regs[1:]
+    uses = 0
+    for reg in regs:
+        uses |= reg_bit(reg)
+    return uses, kills
+
+
+def solve_liveness(succ: list, uses: list, kills: list) -> (list, list):
+    """
+    Solves the backward liveness of bit sets, for each instruction.
+
+    :return: the bits live before each instruction, and the bits live after each instruction
+    """
+    live_in = [0] * len(succ)
+    live_out = [0] * len(succ)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(succ) - 1, -1, -1):
+            out = 0
+            for j in succ[i]:
+                out |= live_in[j]
+            live_out[i] = out
+            new_in = uses[i] | (out & ~kills[i])
+            if new_in != live_in[i]:
+                live_in[i] = new_in
+                changed = True
+    return live_in, live_out
+
+
+def solve_forward(succ: list, gens: list, clears: list, reach: list):
+    """
+    Solves the bits that may reach each instruction, where bits are generated after 'gens[i]', and all bits are
+    cleared after the instructions where 'clears[i]' is True.
+
+    :param reach: filled with the bits reaching each instruction
+    """
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(succ)):
+            out = 0 if clears[i] else reach[i] | gens[i]
+            for j in succ[i]:
+                if out & ~reach[j]:
+                    reach[j] |= out
+                    changed = True
+
+
+def loop_depths(succ: list) -> list:
+    """
+    :return: the number of loops containing each instruction, a loop is the range from a label to the last
+    instruction jumping back to it
+    """
+    loop_ends = {}  # index of loop head: index of the last jump back
+    for i in range(len(succ)):
+        for j in succ[i]:
+            if j <= i:
+                loop_ends[j] = max(loop_ends.get(j, i), i)
+    changes = [0] * (len(succ) + 1)
+    for head, end in loop_ends.items():
+        changes[head] += 1
+        changes[end + 1] -= 1
+    depths = []
+    depth = 0
+    for i in range(len(succ)):
+        depth += changes[i]
+        depths.append(depth)
+    return depths
+
+
+def fold_moves(func_body: list) -> list:
+    """
+    Removes register moves by renaming registers, where the registers being removed are dead afterwards:
+
+    'move %x %y' followed by a read of %x in the same basic block reads %y instead,
+    'move %t %r; <op> %t ...; move %r %t' becomes '<op> %r ...' for instructions working in place,
+    '<load> %t ...; move %r %t' becomes '<load> %r ...',
+    and moves or loads to dead registers are removed.
+
+    :return: the new function body
+    """
+    changed = True
+    while changed:
+        changed = False
+        succ = control_flow(func_body)
+        if succ is None:
+            return func_body
+        effects = [register_effects(inst) for inst in func_body]
+        live_in, live_out = solve_liveness(succ, [eff[0] for eff in effects], [eff[1] for eff in effects])
+
+        def dead_after(reg_name, index):
+            return not live_out[index] & reg_bit(reg_name)
+
+        new_body = []
+        i = 0
+        while i < len(func_body):
+            inst = func_body[i]
+            nxt = func_body[i + 1] if i + 1 < len(func_body) else [""]
+            if inst[0] in PURE_DEFS and inst[1].startswith("%") and dead_after(inst[1], i):
+                changed = True
+            elif inst[0] == "move" and inst[1] == inst[2]:
+                changed = True
+            elif inst[0] in PURE_DEFS and nxt[0] == "move" and nxt[2] == inst[1] and nxt[1] not in inst[2:] and \
+                    inst[1] not in inst[2:] and dead_after(inst[1], i + 1):
+                new_body.append([inst[0], nxt[1], *inst[2:]])
+                changed = True
+                i += 1
+            elif inst[0] == "move" and nxt[0] in IN_PLACE and nxt[1] == inst[1] and i + 2 < len(func_body) and \
+                    func_body[i + 2] == ["move", inst[2], inst[1]] and dead_after(inst[1], i + 2):
+                new_body.append([inst[2] if item == inst[1] else item for item in nxt])
+                changed = True
+                i += 2
+            elif inst[0] == "move":
+                j = forward_target(func_body, succ, i)
+                if j is not None and dead_after(inst[1], j):
+                    new_body.extend(func_body[i + 1: j])
+                    new_body.append([inst[2] if item == inst[1] else item for item in func_body[j]])
+                    changed = True
+                    i = j
+                else:
+                    new_body.append(inst)
+            else:
+                new_body.append(inst)
+            i += 1
+        func_body = new_body
+    return func_body
+
+
+def forward_target(func_body: list, succ: list, index: int):
+    """
+    Finds the instruction that may read the source of 'move %x %y' at index instead of %x.
+
+    :return: index of the next instruction using %x or %y in the same basic block, if it only reads them,
+    otherwise None
+    """
+    dst, src = func_body[index][1], func_body[index][2]
+    j = index + 1
+    while j < len(func_body):
+        inst = func_body[j]
+        if dst in inst or src in inst:
+            if inst[0] in READ_ONLY:
+                read = inst[1:]
+            elif inst[0] in PURE_DEFS or inst[0] in IN_PLACE:
+                read = inst[2:]
+            else:
+                return None
+            if (dst in read or src in read) and \
+                    not (dst in inst[1:] and dst not in read) and not (src in inst[1:] and src not in read):
+                return j
+            return None
+        if succ[j] != [j + 1] or inst[0] in CALLS or inst[0] == "label":
+            return None
+        j += 1
+    return None
 
 
 def matches(tar_list: list, cur_index, fmt_list: list):
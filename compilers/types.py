@@ -5,6 +5,10 @@ import compilers.errors as errs
 class Type:
     def __init__(self, length: int):
         self.length = length
+        self.pointer = None  # the pointer type to this type, see 'pointer_type'
+        self.array = None  # the array type of this type, see 'array_type'
+        self.shared = False  # whether this type is shared by all compiles, see 'mark_shared'
+        self.conversions = {}  # (id(type), id(left_tar_type)): (type, left_tar_type, level), see 'conversion_level'
 
     def memory_length(self):
         """
@@ -45,6 +49,27 @@ class Type:
     def normal_convertible(self, left_tar_type):
         return self.strong_convertible(left_tar_type)
 
+    def conversion_level(self, left_tar_type) -> int:
+        """
+        Returns CONV_STRONG if strong_convertible, CONV_NORMAL if only normal_convertible, otherwise CONV_NONE.
+
+        The result is remembered by this type, or by the target type if only this one is shared, so that shared
+        types never keep the types of a compile alive.
+        """
+        owner = left_tar_type if self.shared and not left_tar_type.shared else self
+        key = id(self), id(left_tar_type)
+        entry = owner.conversions.get(key)
+        if entry is not None and entry[0] is self and entry[1] is left_tar_type:
+            return entry[2]
+        if self.strong_convertible(left_tar_type):
+            level = CONV_STRONG
+        elif self.normal_convertible(left_tar_type):
+            level = CONV_NORMAL
+        else:
+            level = CONV_NONE
+        owner.conversions[key] = self, left_tar_type, level
+        return level
+
     def convertible_to(self, left_tar_type, lf, normal=True, weak=True):
         """
         Returns True if strong_convertible or weak_convertible returns True.
@@ -57,9 +82,10 @@ class Type:
         :param weak whether 'weak_convertible' is counted as True
         :return:
         """
-        if self.strong_convertible(left_tar_type):
+        level = self.conversion_level(left_tar_type)
+        if level == CONV_STRONG:
             return True
-        elif normal and self.normal_convertible(left_tar_type):
+        elif normal and level == CONV_NORMAL:
             return True
         elif normal and weak and self.weak_convertible(left_tar_type):
             util.print_warning(f"implicit conversion from {self} to {left_tar_type}.", lf)
@@ -148,7 +174,7 @@ class PointerType(Type):
         return "*" + self.base.type_name()
 
     def __eq__(self, other):
-        return isinstance(other, PointerType) and self.base == other.base
+        return self is other or (isinstance(other, PointerType) and self.base == other.base)
 
     def __str__(self):
         return "*" + str(self.base)
@@ -256,11 +282,66 @@ class NativeFuncType(CallableType):
         super().__init__(param_types, rtype)
 
 
+class OverloadIndex(util.NaiveDict):
+    """
+    The overloads of a function or method name, keyed by function types.
+
+    Overloads are indexed by their parameter signatures, see 'signature_key', so that looking up a function type does
+    not check it against all overloads. Calls resolved by 'find_closet_func' are remembered until an overload is set.
+    """
+    def __init__(self, is_method: bool):
+        super().__init__(params_eq_methods if is_method else params_eq)
+
+        self.param_begin = 1 if is_method else 0
+        self.index = {}  # signature key: list of positions in keys
+        self.resolved = {}  # argument types key: result of find_closet_func
+
+    def find(self, key: CallableType) -> int:
+        """
+        :return: the position of the overload that has the same parameters as key, or -1 if there is no such one
+        """
+        for i in self.index.get(signature_key(key.param_types, self.param_begin), ()):
+            if self.check(self.keys[i], key):
+                return i
+        return -1
+
+    def copy(self):
+        cpy = OverloadIndex(self.param_begin == 1)
+        cpy.keys.extend(self.keys)
+        cpy.values.extend(self.values)
+        for sig in self.index:
+            cpy.index[sig] = self.index[sig].copy()
+        return cpy
+
+    def __contains__(self, item):
+        return self.find(item) != -1
+
+    def __getitem__(self, item):
+        i = self.find(item)
+        if i == -1:
+            raise IndexError(f"Key '{item}' is not in this OverloadIndex.")
+        return self.values[i]
+
+    def __setitem__(self, key, value):
+        self.resolved.clear()
+        i = self.find(key)
+        if i == -1:
+            sig = signature_key(key.param_types, self.param_begin)
+            if sig in self.index:
+                self.index[sig].append(len(self.keys))
+            else:
+                self.index[sig] = [len(self.keys)]
+            self.keys.append(key)
+            self.values.append(value)
+        else:
+            self.values[i] = value
+
+
 class FunctionPlacer(Type):
     def __init__(self, first_t: CallableType, first_addr: int):
         super().__init__(0)
 
-        self.poly = util.NaiveDict(params_eq)  # functions with same name | func_type: ptr
+        self.poly = OverloadIndex(False)  # functions with same name | func_type: ptr
 
         self.add_poly(first_t, first_addr)
 
@@ -311,9 +392,12 @@ class ClassType(Type):
 
         # this dict records all callable methods in this class, including methods in its superclass
         # methods with same name must have the same id, i.e. overriding methods have the same id
-        # note that in each NaiveDict, the key is the type of the most super method, real type is in the values
-        self.methods: {str: util.NaiveDict} = {}  # name: NaiveDict{func_type: (method_id, func_ptr, func_type)}
-        self.fields = {}  # name: (position, type, defined_class, const?, permission)
+        # note that in each OverloadIndex, the key is the type of the most super method, real type is in the values
+        # an OverloadIndex is shared with the superclass until this class changes it, see 'local_methods'
+        self.methods: {str: OverloadIndex} = {}  # name: OverloadIndex{func_type: (method_id, func_ptr, func_type)}
+        self.own_methods = set()  # names of methods whose OverloadIndex is not shared
+        self.fields = {}  # fields defined in this class | name: (position, type, defined_class, const?, permission)
+        self.field_table = {}  # all fields, including fields in superclasses, same format as 'fields'
 
         # records mapping for all templates
         # e.g. class A<AT>, class B<BK, BV(Number)>(A<BK>), class D<DT>, class C<CT>(B<CT, Integer>, D<CT>) =>
@@ -322,9 +406,13 @@ class ClassType(Type):
         # in D: {"DT": Object}
         # in C: {"CT": Object, "BK": "CT", "BV": Integer, "AT": "BK", "DT": "CT"}
         self.templates_map = templates_map
+        self.actual_templates = {}  # template name: result of 'get_actual_template_name'
 
         self.initializers = []  # nodes that will be executed in __new__
 
+        # substitutions of generic types made for generic class types of this class, see 'GenericClassType'
+        self.instances = {}  # key of actual generics: {(id(type), kind): (type, substituted type)}
+
     def type_name(self):
         return self.name
 
@@ -332,19 +420,55 @@ class ClassType(Type):
         return self.name_with_path
 
     def get_actual_template_name(self, template_name):
+        if template_name in self.actual_templates:
+            return self.actual_templates[template_name]
         if template_name not in self.templates_map:
             return None
         actual_tem = self.templates_map[template_name]
         if isinstance(actual_tem, str):
-            return self.get_actual_template_name(actual_tem)
+            res = self.get_actual_template_name(actual_tem)
         else:
-            return template_name
+            res = template_name
+        self.actual_templates[template_name] = res
+        return res
+
+    def inherit(self):
+        """
+        Takes the fields of all superclasses and the methods of the direct superclass.
+
+        Must be called after superclasses are compiled, and before adding any field or method.
+        """
+        for mro_t in reversed(self.mro[1:]):
+            self.field_table.update(mro_t.fields)
+        if len(self.mro) > 1:
+            self.methods.update(self.mro[1].methods)
+            self.method_rank.extend(self.mro[1].method_rank)
+
+    def add_field(self, name: str, field: tuple):
+        self.fields[name] = field
+        self.field_table[name] = field
+
+    def local_methods(self, name: str) -> OverloadIndex:
+        """
+        Returns the methods of this name, copied from the superclass if they are shared.
+        """
+        if name not in self.own_methods:
+            self.methods[name] = self.methods[name].copy()
+            self.own_methods.add(name)
+        return self.methods[name]
+
+    def add_methods(self, name: str, poly: OverloadIndex):
+        self.methods[name] = poly
+        self.own_methods.add(name)
+
+    def vtable(self) -> list:
+        """
+        Returns the actual types of all methods, ordered by method id.
+        """
+        return [self.methods[name][base_t][2] for name, base_t in self.method_rank]
 
     def has_field(self, name: str) -> bool:
-        for mro_t in self.mro:
-            if name in mro_t.fields:
-                return True
-        return False
+        return name in self.field_table
 
     def find_field(self, name: str, lf) -> (int, Type, Type, bool, int):
         """
@@ -354,14 +478,13 @@ class ClassType(Type):
         :param lf:
         :return:
         """
-        for mro_t in self.mro:
-            if name in mro_t.fields:
-                return mro_t.fields[name]
+        if name in self.field_table:
+            return self.field_table[name]
         raise errs.TplEnvironmentError(f"Class {self.name} does not have field '{name}'. ", lf)
 
     def _find_method(self, name, arg_types, lf):
         if name in self.methods:
-            poly: util.NaiveDict = self.methods[name]
+            poly: OverloadIndex = self.methods[name]
             return find_closet_func(poly, arg_types, name, True, lambda poly_d, i: poly_d.values[i][2], lf)[1]
 
         raise errs.TplEnvironmentError(f"Class {self.name} does not have method '{name}'. ", lf)
@@ -469,9 +592,60 @@ class GenericClassType(GenericType):
     def __init__(self, base: ClassType, generic: dict):
         super().__init__(base, generic)
 
+        self.substitutions = None  # shared by all generic class types with the same base and actual generics
+
     def type_name(self):
         return self.base.type_name()
 
+    def _substitutions(self):
+        if self.substitutions is None:
+            key = []
+            for name in sorted(self.generics):
+                gen = type_key(self.generics[name])
+                if gen is None:
+                    return None
+                key.append((name, gen))
+            key = tuple(key)
+            if key not in self.base.instances:
+                self.base.instances[key] = {}
+            self.substitutions = self.base.instances[key]
+        return self.substitutions
+
+    def _substitute(self, t, kind: int, substitute, lfp):
+        subs = self._substitutions()
+        if subs is None:
+            return substitute(t, lfp)
+        entry = subs.get((id(t), kind))
+        if entry is not None and entry[0] is t:
+            return entry[1]
+        res = substitute(t, lfp)
+        if not is_unchecked(t, self.generics):  # unchecked substitutions print warnings every time
+            subs[(id(t), kind)] = t, res
+        return res
+
+    def replace_generics(self, t: Type, lfp) -> Type:
+        """
+        Returns the type t in this generic class type, see 'replace_generics_if'.
+        """
+        return self._substitute(t, 0, lambda t_, lf: replace_generics_if(t_, self, lf), lfp)
+
+    def replace_generic_fields(self, t: Type, lfp) -> Type:
+        """
+        Returns the type t with its generics replaced by the actual ones, generic class types in t are not changed.
+        """
+        return self._substitute(t, 1, self._replace_generic_field, lfp)
+
+    def instantiate_method(self, method_t, lfp):
+        """
+        Returns a copy of method_t, with generics in its parameters replaced by the actual ones.
+        """
+        return self._substitute(method_t, 2, lambda t_, lf: instantiate_method(t_, self.generics, lf), lfp)
+
+    def _replace_generic_field(self, t, lfp):
+        if is_generic(t):
+            return replace_generic_with_real(t, self.generics, lfp)
+        return t
+
     def strong_convertible(self, left_tar_type):
         # print("000", self)
         # print("112", left_tar_type)
@@ -577,7 +751,37 @@ class ArrayType(Type):
         return hash(self.ele_type) + 1
 
     def __eq__(self, other):
-        return isinstance(other, ArrayType) and self.ele_type == other.ele_type
+        return self is other or (isinstance(other, ArrayType) and self.ele_type == other.ele_type)
+
+
+def pointer_type(base: Type) -> PointerType:
+    """
+    Returns the pointer type to base, pointers to the same type object are the same object.
+    """
+    if base.pointer is None:
+        base.pointer = PointerType(base)
+        base.pointer.shared = base.shared
+    return base.pointer
+
+
+def array_type(ele_type: Type) -> ArrayType:
+    """
+    Returns the array type of ele_type, arrays of the same type object are the same object.
+    """
+    if ele_type.array is None:
+        ele_type.array = ArrayType(ele_type)
+        ele_type.array.shared = ele_type.shared
+    return ele_type.array
+
+
+def mark_shared(*types):
+    """
+    Marks module level types, which are used by all compiles in the same process.
+
+    Pointer and array types of shared types are also shared, as they are interned by their base types.
+    """
+    for t in types:
+        t.shared = True
 
 
 def is_object_ptr(t: Type) -> bool:
@@ -603,9 +807,9 @@ def is_generic(t: Type) -> bool:
 
 def replace_generic_with_real(t: Type, real_generics: dict, lfp) -> Type:
     if isinstance(t, PointerType):
-        return PointerType(replace_generic_with_real(t.base, real_generics, lfp))
+        return pointer_type(replace_generic_with_real(t.base, real_generics, lfp))
     elif isinstance(t, ArrayType):
-        return ArrayType(replace_generic_with_real(t.ele_type, real_generics, lfp))
+        return array_type(replace_generic_with_real(t.ele_type, real_generics, lfp))
     elif isinstance(t, Generic):
         # print(t.simple_name(), real_generics)
         if real_generics is not None and t.full_name() in real_generics:
@@ -621,6 +825,39 @@ def replace_generic_with_real(t: Type, real_generics: dict, lfp) -> Type:
         raise errs.TplCompileError("Unexpected error. ", lfp)
 
 
+def is_unchecked(t: Type, real_generics: dict) -> bool:
+    """
+    Returns True if replacing generics in t with real_generics may produce an 'Unchecked call' warning.
+    """
+    if isinstance(t, PointerType):
+        return is_unchecked(t.base, real_generics)
+    elif isinstance(t, ArrayType):
+        return is_unchecked(t.ele_type, real_generics)
+    elif isinstance(t, Generic):
+        return real_generics is None or t.full_name() not in real_generics
+    elif isinstance(t, GenericClassType):
+        for value in t.generics.values():
+            if is_unchecked(value, real_generics):
+                return True
+    elif isinstance(t, CallableType):
+        for pt in t.param_types:
+            if is_unchecked(pt, real_generics):
+                return True
+    return False
+
+
+def instantiate_method(method_t: MethodType, real_generics: dict, lfp) -> MethodType:
+    """
+    Returns a copy of method_t, with generics in its parameters replaced by real_generics.
+    """
+    t = method_t.copy()
+    for i in range(len(t.param_types)):
+        pt = t.param_types[i]
+        if is_generic(pt):
+            t.param_types[i] = replace_generic_with_real(pt, real_generics, lfp)
+    return t
+
+
 def is_generic_type(t: Type) -> bool:
     if isinstance(t, PointerType):
         return is_generic_type(t.base)
@@ -631,9 +868,9 @@ def is_generic_type(t: Type) -> bool:
 
 def replace_callee_generic_class(t: Type, caller_class_t: GenericClassType, lfp) -> Type:
     if isinstance(t, PointerType):
-        return PointerType(replace_callee_generic_class(t.base, caller_class_t, lfp))
+        return pointer_type(replace_callee_generic_class(t.base, caller_class_t, lfp))
     elif isinstance(t, ArrayType):
-        return ArrayType(replace_callee_generic_class(t.ele_type, caller_class_t, lfp))
+        return array_type(replace_callee_generic_class(t.ele_type, caller_class_t, lfp))
     elif isinstance(t, GenericClassType):
         new_generics = {}
         for key in t.generics:
@@ -692,6 +929,63 @@ def type_eq_no_generic(t1: Type, t2: Type) -> bool:
     return t1_base == t2_base
 
 
+def signature_key(param_types: list, begin: int) -> tuple:
+    """
+    Returns a hashable key of parameter types, equal for parameter lists that 'type_eq_no_generic' treats as equal.
+
+    Pointers to classes are keyed by the class, other types are only keyed coarsely.
+
+    :param param_types:
+    :param begin: index of the first parameter in key
+    :return:
+    """
+    res = [len(param_types)]
+    for i in range(begin, len(param_types)):
+        t = param_types[i]
+        if isinstance(t, PointerType):
+            if isinstance(t.base, (ClassType, GenericClassType, Generic)):
+                res.append(get_class_type(t.base))
+            else:
+                res.append(PointerType)
+        elif isinstance(t, PrimitiveType):
+            res.append(t)
+        else:
+            res.append(t.__class__)
+    return tuple(res)
+
+
+def type_key(t: Type):
+    """
+    Returns a hashable key of a type, types with equal keys are convertible to same types.
+
+    :return: the key, or None if the type has no key
+    """
+    if isinstance(t, (PrimitiveType, ClassType)):
+        return t
+    elif isinstance(t, PointerType):
+        base = type_key(t.base)
+        return None if base is None else ("*", base)
+    elif isinstance(t, ArrayType):
+        ele = type_key(t.ele_type)
+        return None if ele is None else ("[]", ele)
+    elif isinstance(t, Generic):
+        return "#", t.full_name(), t.max_t
+    elif isinstance(t, GenericClassType):
+        res = ["<>", t.base]
+        for name in sorted(t.generics):
+            gen = type_key(t.generics[name])
+            if gen is None:
+                return None
+            res.append((name, gen))
+        return tuple(res)
+    elif isinstance(t, CallableType):
+        res = [t.__class__, type_key(t.rtype)]
+        for param in t.param_types:
+            res.append(type_key(param))
+        return None if None in res else tuple(res)
+    return None
+
+
 def params_eq(ft1: FuncType, ft2: FuncType) -> bool:
     if len(ft1.param_types) == len(ft2.param_types):
         for i in range(len(ft1.param_types)):
@@ -772,7 +1066,7 @@ def type_distance(left_type, right_real_type):
     return 0
 
 
-def find_closet_func(poly: util.NaiveDict, arg_types: [Type], name: str, is_method: bool,
+def find_closet_func(poly: OverloadIndex, arg_types: [Type], name: str, is_method: bool,
                      get_type_func, lf) -> (FuncType, object):
     """
     Returns the closet method.
@@ -790,6 +1084,13 @@ def find_closet_func(poly: util.NaiveDict, arg_types: [Type], name: str, is_meth
         (fn_type, (fn_type, fn_ptr)) for function
     """
     param_begin = 1 if is_method else 0
+    args_key = [len(arg_types)]
+    for j in range(param_begin, len(arg_types)):
+        args_key.append(type_key(arg_types[j]))
+    args_key = None if None in args_key else tuple(args_key)
+    if args_key in poly.resolved:
+        return poly.resolved[args_key]
+
     matched = {}
     for i in range(len(poly)):
         # fn_t = poly.keys[i]
@@ -823,21 +1124,29 @@ def find_closet_func(poly: util.NaiveDict, arg_types: [Type], name: str, is_meth
             min_tup = matched[dt]
     if min_tup is None:
         raise errs.TplCompileError(f"Cannot resolve call: {function_poly_name(name, arg_types, is_method)}. ", lf)
+    if args_key is not None:
+        poly.resolved[args_key] = min_tup
     return min_tup
 
 
 # def find_correspond_tem_name()
 
 
+CONV_NONE = 0
+CONV_NORMAL = 1
+CONV_STRONG = 2
+
+
 TYPE_INT = PrimitiveType("int", util.INT_LEN)
 TYPE_FLOAT = PrimitiveType("float", util.FLOAT_LEN)
 TYPE_CHAR = PrimitiveType("char", util.CHAR_LEN)
 TYPE_BYTE = PrimitiveType("byte", 1)
 TYPE_VOID = PrimitiveType("void", 0)
+mark_shared(TYPE_INT, TYPE_FLOAT, TYPE_CHAR, TYPE_BYTE, TYPE_VOID)
 
-TYPE_CHAR_ARR = ArrayType(TYPE_CHAR)
-TYPE_STRING_ARR = ArrayType(TYPE_CHAR_ARR)
-TYPE_VOID_PTR = PointerType(TYPE_VOID)
+TYPE_CHAR_ARR = array_type(TYPE_CHAR)
+TYPE_STRING_ARR = array_type(TYPE_CHAR_ARR)
+TYPE_VOID_PTR = pointer_type(TYPE_VOID)
 
 PRIMITIVE_TYPES = {"int": TYPE_INT, "float": TYPE_FLOAT, "char": TYPE_CHAR, "byte": TYPE_BYTE, "void": TYPE_VOID}
 
@@ -853,7 +1162,7 @@ NATIVE_FUNCTIONS = {
     "println_str": (9, NativeFuncType([TYPE_CHAR_ARR], TYPE_VOID)),
     "malloc": (10, NativeFuncType([TYPE_INT], TYPE_VOID_PTR)),
     "free": (11, NativeFuncType([TYPE_VOID_PTR], TYPE_VOID)),
-    "heap_array": (12, NativeFuncType([TYPE_INT, ArrayType(TYPE_INT)], TYPE_VOID_PTR)),
+    "heap_array": (12, NativeFuncType([TYPE_INT, array_type(TYPE_INT)], TYPE_VOID_PTR)),
     "nat_cos": (13, NativeFuncType([TYPE_FLOAT], TYPE_FLOAT)),
     "nat_log": (14, NativeFuncType([TYPE_FLOAT], TYPE_FLOAT)),
     "print_byte": (15, NativeFuncType([TYPE_BYTE], TYPE_VOID)),
@@ -862,3 +1171,4 @@ NATIVE_FUNCTIONS = {
     "mem_copy": (18, NativeFuncType([TYPE_VOID_PTR, TYPE_INT, TYPE_VOID_PTR, TYPE_INT, TYPE_INT], TYPE_VOID)),
     "exit": (19, NativeFuncType([TYPE_INT], TYPE_VOID))
 }
+mark_shared(*[func_t for _, func_t in NATIVE_FUNCTIONS.values()])
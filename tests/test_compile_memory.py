@@ -0,0 +1,53 @@
+"""
+Checks that repeated compiles in one process, as done by tpc_server.py and tpc_batch.py, do not keep memory of the
+previous compiles.
+"""
+
+import io
+import os
+import gc
+import sys
+import tempfile
+import unittest
+import contextlib
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tpc
+import compilers.text_preprocessor as txt_prep
+
+SOURCE = os.path.join(ROOT, "tp", "map_t.tp")
+WARM_UP_COMPILES = 3
+MEASURED_COMPILES = 6
+MAX_GROWTH = 64 * 1024  # one compile of the source keeps about 600 KB if anything leaks
+
+
+class CompileMemoryTest(unittest.TestCase):
+    def test_repeated_compiles(self):
+        module_cache = txt_prep.ModuleCache(None)
+        with tempfile.TemporaryDirectory() as out_dir:
+            args = tpc.parse_args([tpc.TPC_NAME, SOURCE, "-tpe", os.path.join(out_dir, "map_t.tpe")])
+
+            def compile_once():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    tpc.compile_tp(dict(args), module_cache)
+                gc.collect()
+
+            tracemalloc.start()
+            try:
+                for _ in range(WARM_UP_COMPILES):
+                    compile_once()
+                before = tracemalloc.get_traced_memory()[0]
+                for _ in range(MEASURED_COMPILES):
+                    compile_once()
+                after = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+
+        self.assertLess(after - before, MAX_GROWTH)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Checks that the code of unchanged imported modules is linked from their code objects, and that the linked program
+equals the program compiled from scratch.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tpc
+import compilers.linker as lnk
+import compilers.text_preprocessor as txt_prep
+
+MODULE = """import lang
+
+var counter: int = 7;
+const scale: float = 2.5;
+twice: fn(int) -> int = lambda(x: int) x * 2;
+
+class Acc {
+    total: int;
+
+    fn __new__(this: *Acc) void {
+        this.total = 100;
+    }
+
+    fn add(this: *Acc, v: int) int {
+        this.total = this.total + v + counter;
+        return this.total;
+    }
+}
+
+fn mfoo(y: int) int {
+    fn inner(x: int) int {
+        return x + %d;
+    }
+    half: fn(int) -> int = lambda(a: int) a / 2;
+    counter = counter + 1;
+    acc: *Acc = new Acc();
+    acc.add(y);
+    return inner(half(y)) + twice(y) + acc.add(1) + (scale * 2.0) as int;
+}
+
+export {
+    mfoo, Acc, counter
+}
+"""
+
+# 'main' has its own globals and literals before the import, so the module is linked at other addresses
+MAIN = """import lang
+%s
+import "m.tp"
+
+fn main() int {
+    println(mfoo(3));
+    a: *Acc = new Acc();
+    println(a.add(5));
+    println(counter);
+    return 0;
+}
+"""
+
+MAIN_GLOBALS = """var g1: int = 3;
+const s0: *String = "main literal before";
+const f0: float = 1.25;
+"""
+
+
+class LinkerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.write("m.tp", MODULE % 3)
+        self.write("main.tp", MAIN % "")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name: str, text: str):
+        with open(os.path.join(self.dir, name), "w") as wf:
+            wf.write(text)
+
+    def compile(self, module_cache: txt_prep.ModuleCache, opt_level: int = 0) -> (bytes, set):
+        """
+        :return: the tpe, and the files whose functions are linked
+        """
+        out_file = os.path.join(self.dir, "main.tpe")
+        args = tpc.parse_args([tpc.TPC_NAME, os.path.join(self.dir, "main.tp"), "-tpe", out_file,
+                               "-o" + str(opt_level)])
+        with mock.patch.object(lnk.Linker, "link", autospec=True, side_effect=lnk.Linker.link) as link:
+            with contextlib.redirect_stdout(io.StringIO()):
+                tpc.compile_tp(args, module_cache)
+        with open(out_file, "rb") as rf:
+            tpe = rf.read()
+        return tpe, {call.args[1].file for call in link.call_args_list}
+
+    def fresh(self, opt_level: int = 0) -> bytes:
+        return self.compile(txt_prep.ModuleCache(None), opt_level)[0]
+
+    def test_unchanged_module_is_linked(self):
+        module_file = os.path.join(self.dir, "m.tp")
+        for opt_level in (0, 1):
+            module_cache = txt_prep.ModuleCache(None)
+            _, linked = self.compile(module_cache, opt_level)
+            self.assertNotIn(module_file, linked)
+
+            tpe, linked = self.compile(module_cache, opt_level)
+            self.assertIn(module_file, linked)
+            self.assertEqual(self.fresh(opt_level), tpe)
+
+            # globals and literals of main move the module
+            self.write("main.tp", MAIN % MAIN_GLOBALS)
+            tpe, linked = self.compile(module_cache, opt_level)
+            self.assertIn(module_file, linked)
+            self.assertEqual(self.fresh(opt_level), tpe)
+            self.write("main.tp", MAIN % "")
+
+    def test_edited_module_is_compiled(self):
+        module_file = os.path.join(self.dir, "m.tp")
+        module_cache = txt_prep.ModuleCache(None)
+        self.compile(module_cache)
+        self.compile(module_cache)
+
+        self.write("m.tp", MODULE % 1234)
+        tpe, linked = self.compile(module_cache)
+        self.assertNotIn(module_file, linked)
+        self.assertEqual(self.fresh(), tpe)
+
+        tpe, linked = self.compile(module_cache)
+        self.assertIn(module_file, linked)
+        self.assertEqual(self.fresh(), tpe)
+
+
+if __name__ == '__main__':
+    unittest.main()
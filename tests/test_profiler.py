@@ -0,0 +1,40 @@
+"""
+Checks the memory figures written by 'tpc.py --profile'.
+"""
+
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tpc
+import compilers.text_preprocessor as txt_prep
+
+SOURCE = os.path.join(ROOT, "tp", "vec.tp")
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_peak_memory_covers_every_stage(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            profile_file = os.path.join(out_dir, "profile.json")
+            args = tpc.parse_args([tpc.TPC_NAME, SOURCE, "-tpe", os.path.join(out_dir, "vec.tpe"),
+                                   "--profile", profile_file])
+            with contextlib.redirect_stdout(io.StringIO()):
+                tpc.compile_tp(args, txt_prep.ModuleCache(None))
+            with open(profile_file, "r") as rf:
+                profile = json.load(rf)
+
+        mem_start = profile["memory_start"]
+        for stage in profile["stages"]:
+            self.assertGreaterEqual(profile["peak_memory"], stage["memory_after"] - mem_start, stage["name"])
+            self.assertGreaterEqual(profile["peak_memory"], stage["peak_memory"], stage["name"])
+
+
+if __name__ == '__main__':
+    unittest.main()
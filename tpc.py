@@ -9,7 +9,6 @@ tpe: Trash Program Executable
 
 import os
 import sys
-import time
 import compilers.tokens_lib as tl
 import compilers.compiler as cmp
 import compilers.tp_parser as psr
@@ -19,32 +18,59 @@ import compilers.tpc_compiler as tpc
 import compilers.tpc_optimizer as tpc_o
 import compilers.ast_preprocessor as prep
 import compilers.ast_optimizer as ast_o
+import compilers.profiler as prof
+import compilers.module_object as mobj
+import compilers.linker as lnk
 
 
 TPC_NAME = "tpc.py"
+CACHE_DIR_NAME = ".tpc_cache"
 
 
 USAGE = """Usage: python tpc.py [flags] source target
     flags:
+        -asm:            writes the assembly files (.tpa and .tpc) besides the executable
         -ast:            prints out the abstract syntax tree
+        -cache <dir>     directory of the imported module cache, default is .tpc_cache under the directory of tpc.py
+        -nc, --no-cache  do not read or write the imported module cache
         -nl, --no-lang   do not automatically import lang.tp
         -o<x>:           optimization level x
+        --profile <file> writes wall time, cpu time and peak memory of each compile stage to file, as json
+        --cprofile <dir> dumps the cProfile stats of each compile stage to dir
         -tk, --tokens    prints out the language tokens
+        -tpa <file>:     writes the .tpa assembly to file
+        -tpc <file>:     writes the .tpc assembly to file, and the optimized one to <file>.o.tpc if optimizing
+        -tpe <file>:     the executable file
 """
 
 
-def parse_args():
-    args_dict = {"py": sys.argv[0], "src_file": None, "tpc_file": None, "tpa_file": None, "tpe_file": None,
-                 "optimize": 0, "no_lang": False, "tokens": False, "ast": False, "delete": False, "timer": False}
+def parse_args(argv: list = None):
+    if argv is None:
+        argv = sys.argv
+    args_dict = {"py": argv[0], "src_file": None, "tpc_file": None, "tpa_file": None, "tpe_file": None,
+                 "optimize": 0, "no_lang": False, "tokens": False, "ast": False, "delete": False, "timer": False,
+                 "emit_tpa": False, "emit_tpc": False, "profile_file": None, "cprofile_dir": None,
+                 "cache_dir": os.path.join(get_tpc_dir(), CACHE_DIR_NAME)}
     i = 1
-    while i < len(sys.argv):
-        arg = sys.argv[i]
+    while i < len(argv):
+        arg = argv[i]
         if arg[0] == "-":
             flag = arg[1:].lower()
             if len(flag) == 0:
                 print("Illegal syntax")
             elif flag == "nl" or flag == "-no-lang":
                 args_dict["no_lang"] = True
+            elif flag == "nc" or flag == "-no-cache":
+                args_dict["cache_dir"] = None
+            elif flag == "cache":
+                args_dict["cache_dir"] = argv[i + 1]
+                i += 1
+            elif flag == "-profile":
+                args_dict["profile_file"] = argv[i + 1]
+                i += 1
+            elif flag == "-cprofile":
+                args_dict["cprofile_dir"] = argv[i + 1]
+                i += 1
             elif flag == "del":
                 args_dict["delete"] = True
             elif arg[1].lower() == "o":
@@ -55,18 +81,23 @@ def parse_args():
                     print("Illegal optimize level")
             elif flag == "tk" or flag == "-tokens":
                 args_dict["tokens"] = True
+            elif flag == "asm":
+                args_dict["emit_tpa"] = True
+                args_dict["emit_tpc"] = True
             elif flag == "ast":
                 args_dict["ast"] = True
             elif flag == "t" or flag == "-timer":
                 args_dict["timer"] = True
             elif flag == "tpa":
-                args_dict["tpa_file"] = sys.argv[i + 1]
+                args_dict["tpa_file"] = argv[i + 1]
+                args_dict["emit_tpa"] = True
                 i += 1
             elif flag == "tpc":
-                args_dict["tpc_file"] = sys.argv[i + 1]
+                args_dict["tpc_file"] = argv[i + 1]
+                args_dict["emit_tpc"] = True
                 i += 1
             elif flag == "tpe":
-                args_dict["tpe_file"] = sys.argv[i + 1]
+                args_dict["tpe_file"] = argv[i + 1]
                 i += 1
             else:
                 print("Unknown flag '{}'".format(arg))
@@ -105,90 +136,160 @@ def replace_extension(orig_name: str, ext: str):
     return orig_name[:orig_name.rfind(".")] + ext
 
 
-if __name__ == '__main__':
-    t_begin = time.time()
-
-    args = parse_args()
-    if args is None:
-        exit(1)
-
-    # with open(args["src_file"], "r") as rf:
-    src_abs_path = os.path.abspath(args["src_file"])
-    lexer = lex.FileTokenizer(src_abs_path, not args["no_lang"])
-    tokens = lexer.tokenize()
+def compile_tp(args: dict, module_cache: txt_prep.ModuleCache = None):
+    """
+    Compiles the source file described by the parsed arguments, from .tp all the way to .tpe
 
-    if args["tokens"]:
-        print(tokens)
+    :param args: parsed arguments, as returned by 'parse_args'
+    :param module_cache: cache of preprocessed imported modules, kept between compilations
+    :return: seconds used by each stage
+    """
+    profiler = prof.StageProfiler(trace_memory=args["profile_file"] is not None, cprofile_dir=args["cprofile_dir"])
+    try:
+        return compile_stages(args, module_cache, profiler)
+    finally:
+        profiler.stop()
 
-    txt_p = txt_prep.FileTextPreprocessor(tokens,
-                                          {"tpc_dir": get_tpc_dir(),
-                                           "main_dir": os.path.dirname(src_abs_path),
-                                           "import_lang": not args["no_lang"]})
-    processed_tks = txt_p.preprocess()
 
-    t_preprocess_end = time.time()
+def generate_tpa(args: dict, processed_tks, module_objects: mobj.ModuleObjects, src_abs_path: str,
+                 profiler: prof.StageProfiler):
+    """
+    Runs the stages from parsing to codegen.
 
-    parser = psr.Parser(processed_tks)
-    fake_root = parser.parse()
+    :return: the tpa program, and the linker that linked the code objects of unchanged modules into it
+    """
+    with profiler.stage("parse"):
+        parser = psr.Parser(processed_tks, module_objects)
+        fake_root = parser.parse()
 
     if args["optimize"] > 0:
-        ast_opt = ast_o.AstOptimizer(fake_root, args["optimize"])
-        fake_root = ast_opt.optimize()
-
-    tree_pre = prep.AstPreprocessor(fake_root)
-    root, literal, str_lit_pos = tree_pre.preprocess()
+        with profiler.stage("ast optimize"):
+            ast_opt = ast_o.AstOptimizer(fake_root, args["optimize"])
+            fake_root = ast_opt.optimize()
 
-    t_parse_end = time.time()
+    with profiler.stage("ast preprocess"):
+        tree_pre = prep.AstPreprocessor(fake_root, module_objects)
+        root, literal, str_lit_pos = tree_pre.preprocess()
 
     if args["ast"]:
         print(root)
         print("========== End of AST ==========")
 
-    compiler = cmp.Compiler(root, literal, str_lit_pos, src_abs_path, args["optimize"])
-    tpa_content = compiler.compile()
+    with profiler.stage("codegen"):
+        linker = lnk.Linker(module_objects, tree_pre, args["optimize"])
+        compiler = cmp.Compiler(root, literal, str_lit_pos, src_abs_path, args["optimize"], linker)
+        tpa_program = compiler.compile()
 
-    tpc_name = args["tpc_file"]
-    tpa_name = args["tpa_file"]
-    tpe_name = args["tpe_file"]
+    return tpa_program, linker
 
-    rem_file = [tpc_name, tpa_name]
 
-    with open(tpa_name, "w") as tpa_file:
-        tpa_file.write(tpa_content)
+def compile_stages(args: dict, module_cache: txt_prep.ModuleCache, profiler: prof.StageProfiler):
+    """
+    Runs all stages of 'compile_tp', each of them recorded by the profiler.
+    """
+    profiling = args["profile_file"] is not None
 
-    t_compile_end = time.time()
+    if module_cache is None:
+        module_cache = txt_prep.ModuleCache(args["cache_dir"])
 
-    tpc_cmp = tpc.TpcCompiler(tpa_name)
-    tpc_cmp.compile(tpc_name)
+    src_abs_path = os.path.abspath(args["src_file"])
 
-    final_tpc_name = tpc_name
+    with profiler.stage("tokenize"):
+        lexer = lex.FileTokenizer(src_abs_path, not args["no_lang"])
+        tokens = lexer.tokenize()
 
-    if args["optimize"] > 0:
-        opt = tpc_o.TpcOptimizer(tpc_name, args["optimize"])
-        opt_file = replace_extension(tpc_name, ".o.tpc")
-        rem_file.append(opt_file)
-        opt.optimize(opt_file)
+    if args["tokens"]:
+        print(tokens)
+
+    with profiler.stage("text preprocess"):
+        txt_p = txt_prep.FileTextPreprocessor(tokens,
+                                              {"tpc_dir": get_tpc_dir(),
+                                               "main_dir": os.path.dirname(src_abs_path),
+                                               "import_lang": not args["no_lang"]},
+                                              module_cache=module_cache)
+        processed_tks = txt_p.preprocess()
+
+    module_objects = mobj.ModuleObjects(module_cache, txt_p.module_keys, args["optimize"])
+
+    try:
+        tpa_program, linker = generate_tpa(args, processed_tks, module_objects, src_abs_path, profiler)
+    except lnk.StaleObjectError:
+        module_objects.link_code = False
+        tpa_program, linker = generate_tpa(args, processed_tks, module_objects, src_abs_path, profiler)
+
+    tpc_name = args["tpc_file"]
+    tpa_name = args["tpa_file"]
+    tpe_name = args["tpe_file"]
 
-        final_tpc_name = opt_file
+    rem_file = []
 
-    t_tpc_end = time.time()
+    if args["emit_tpa"]:
+        with profiler.stage("write tpa"):
+            tpa_program.write(tpa_name)
+        rem_file.append(tpa_name)
 
-    tpe_cmp = tpc.TpeCompiler(final_tpc_name)
-    tpe_cmp.compile(tpe_name)
+    with profiler.stage("tpc compile"):
+        tpc_cmp = tpc.TpcCompiler(tpa_program)
+        tpc_program = tpc_cmp.compile()
 
-    t_end = time.time()
+    if args["emit_tpc"]:
+        with profiler.stage("write tpc"):
+            tpc_program.write(tpc_name)
+        rem_file.append(tpc_name)
+
+    if args["optimize"] > 0:
+        with profiler.stage("tpc optimize"):
+            opt = tpc_o.TpcOptimizer(tpc_program, args["optimize"])
+            tpc_program = opt.optimize()
+
+        if args["emit_tpc"]:
+            opt_file = replace_extension(tpc_name, ".o.tpc")
+            with profiler.stage("write optimized tpc"):
+                tpc_program.write(opt_file)
+            rem_file.append(opt_file)
+
+    with profiler.stage("tpe assembly"):
+        tpe_cmp = tpc.TpeCompiler(tpc_program, linker.object_code)
+        tpe_cmp.compile(tpe_name)
+
+    with profiler.stage("store code objects"):
+        linker.store()
+
+    times = {"preprocess": profiler.wall_of("tokenize", "text preprocess"),
+             "parse": profiler.wall_of("parse", "ast optimize", "ast preprocess"),
+             "compile": profiler.wall_of("codegen"),
+             "tpc compile": profiler.wall_of("tpc compile", "tpc optimize"),
+             "tpe compile": profiler.wall_of("tpe assembly", "store code objects"),
+             "total": profiler.total_wall()}
 
     if args["timer"]:
         print(f"Time used: \n"
-              f"preprocess: {round(t_preprocess_end - t_begin, 4)} s, "
-              f"parse: {round(t_parse_end - t_preprocess_end, 4)} s, "
-              f"compile: {round(t_compile_end - t_preprocess_end, 4)} s, "
-              f"tpc compile: {round(t_tpc_end - t_compile_end, 4)} s, "
-              f"tpe compile: {round(t_end - t_tpc_end, 4)} s.")
-
-    print(f"Compilation finished in {round(t_end - t_begin, 4)} seconds.")
+              f"preprocess: {round(times['preprocess'], 4)} s, "
+              f"parse: {round(times['parse'], 4)} s, "
+              f"compile: {round(times['compile'], 4)} s, "
+              f"tpc compile: {round(times['tpc compile'], 4)} s, "
+              f"tpe compile: {round(times['tpe compile'], 4)} s.")
+        print(module_cache.stats())
+
+    if profiling:
+        profiler.write_json(args["profile_file"], {"source": src_abs_path,
+                                                   "optimize": args["optimize"],
+                                                   "module_cache": {"hits": module_cache.hits,
+                                                                    "disk_hits": module_cache.disk_hits,
+                                                                    "misses": module_cache.misses}})
+
+    print(f"Compilation finished in {round(times['total'], 4)} seconds.")
 
     if args["delete"]:
         for f in rem_file:
             os.remove(f)
 
+    return times
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args is None:
+        exit(1)
+
+    compile_tp(args)
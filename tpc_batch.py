@@ -0,0 +1,179 @@
+"""
+Compiles many Trash Programs in parallel.
+
+Sources can be files, directories (all *.tp directly inside) or glob patterns. Flags other than the ones listed in
+USAGE are passed to tpc.py for every source, so each source is compiled to its own .tpe as 'python tpc.py' would do.
+
+Each worker process keeps its own in-memory module cache, and all of them share the on-disk module cache.
+"""
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import traceback
+import contextlib
+import concurrent.futures
+import tpc
+import compilers.text_preprocessor as txt_prep
+
+
+USAGE = """Usage: python tpc_batch.py [flags] sources...
+    flags:
+        -j <n>:            number of worker processes, default is the cpu count
+        --json <file>:     writes the summary as json to file, use '-' for stdout
+        --cprofile <dir>:  dumps the cProfile stats of each source to its own subdirectory of dir
+        other flags are passed to tpc.py, except -tpa, -tpc, -tpe and --profile
+"""
+
+_module_cache = None
+
+
+def collect_sources(patterns: list) -> list:
+    sources = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matched = glob.glob(os.path.join(pattern, "*.tp"))
+        elif os.path.isfile(pattern):
+            matched = [pattern]
+        else:
+            matched = glob.glob(pattern, recursive=True)
+        for src in sorted(matched):
+            if src not in sources:
+                sources.append(src)
+    return sources
+
+
+def cprofile_dirs(sources: list, cprofile_dir) -> dict:
+    """
+    :return: source: the directory of its cProfile stats, named by the source file, or None for every source
+    """
+    dirs = {}
+    used = set()
+    for src in sources:
+        if cprofile_dir is None:
+            dirs[src] = None
+            continue
+        name = os.path.splitext(os.path.basename(src))[0]
+        sub = name
+        i = 1
+        while sub in used:
+            sub = f"{name}_{i}"
+            i += 1
+        used.add(sub)
+        dirs[src] = os.path.join(cprofile_dir, sub)
+    return dirs
+
+
+def _init_worker(cache_dir):
+    global _module_cache
+    _module_cache = txt_prep.ModuleCache(cache_dir)
+
+
+def compile_one(src: str, flags: list, cprofile_dir=None) -> dict:
+    """
+    Compiles one source in a worker process.
+
+    :param cprofile_dir: directory of the cProfile stats of this source, or None if not profiling
+    :return: the result entry of this source in the summary
+    """
+    if cprofile_dir is not None:
+        flags = flags + ["--cprofile", cprofile_dir]
+    out = io.StringIO()
+    result = {"source": src, "success": False, "times": None, "output": ""}
+    try:
+        with contextlib.redirect_stdout(out):
+            args = tpc.parse_args([tpc.TPC_NAME] + flags + [src])
+            if args is not None:
+                result["times"] = tpc.compile_tp(args, _module_cache)
+                result["success"] = True
+                result["tpe_file"] = args["tpe_file"]
+    except Exception:
+        out.write(traceback.format_exc())
+    result["output"] = out.getvalue()
+    return result
+
+
+def compile_all(sources: list, flags: list, workers: int, cache_dir, cprofile_dir=None) -> dict:
+    t_begin = time.time()
+    prof_dirs = cprofile_dirs(sources, cprofile_dir)
+    if cprofile_dir is not None:
+        os.makedirs(cprofile_dir, exist_ok=True)  # workers only create their own subdirectories
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=_init_worker,
+                                                initargs=(cache_dir,)) as pool:
+        futures = [pool.submit(compile_one, src, flags, prof_dirs[src]) for src in sources]
+        for future in futures:
+            results.append(future.result())
+    succeeded = sum([1 for res in results if res["success"]])
+    return {"workers": workers,
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "wall_time": time.time() - t_begin,
+            "results": results}
+
+
+def print_summary(summary: dict):
+    for res in summary["results"]:
+        if res["success"]:
+            print(f"OK    {res['source']}  {round(res['times']['total'], 4)} s")
+        else:
+            print(f"FAIL  {res['source']}")
+            print(res["output"])
+    print(f"{summary['succeeded']} succeeded, {summary['failed']} failed, "
+          f"in {round(summary['wall_time'], 4)} seconds with {summary['workers']} workers.")
+
+
+if __name__ == '__main__':
+    workers = os.cpu_count()
+    json_out = None
+    cprofile_out = None
+    passed_flags = []
+    patterns = []
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "-j":
+            workers = int(sys.argv[i + 1])
+            i += 1
+        elif arg == "--json":
+            json_out = sys.argv[i + 1]
+            i += 1
+        elif arg == "--cprofile":
+            cprofile_out = sys.argv[i + 1]
+            i += 1
+        elif arg in ("-tpa", "-tpc", "-tpe", "--profile"):
+            print(USAGE)
+            exit(1)
+        elif arg == "-cache":
+            passed_flags.extend(sys.argv[i: i + 2])
+            i += 1
+        elif arg.startswith("-"):
+            passed_flags.append(arg)
+        else:
+            patterns.append(arg)
+        i += 1
+
+    srcs = collect_sources(patterns)
+    if len(srcs) == 0:
+        print(USAGE)
+        exit(1)
+
+    shared_args = tpc.parse_args([tpc.TPC_NAME] + passed_flags + [srcs[0]])
+    if shared_args is None:
+        exit(1)
+    res_summary = compile_all(srcs, passed_flags, workers, shared_args["cache_dir"], cprofile_out)
+
+    if json_out == "-":
+        print(json.dumps(res_summary, indent=2))
+    else:
+        print_summary(res_summary)
+        if json_out is not None:
+            with open(json_out, "w") as wf:
+                json.dump(res_summary, wf, indent=2)
+
+    exit(0 if res_summary["failed"] == 0 else 1)
@@ -0,0 +1,51 @@
+"""
+Thin client of tpc_server.py, accepts exactly the same flags as tpc.py.
+
+The socket of the server is read from environment variable 'TPC_SERVER', or the default path of tpc_server.py.
+If no server is running, the source is compiled in this process, just like tpc.py does.
+"""
+
+import os
+import sys
+import json
+import socket
+import tempfile
+
+
+def default_socket_path():
+    return os.path.join(tempfile.gettempdir(), "tpc_server.sock")
+
+
+def request_server(path: str, argv: list):
+    """
+    Sends a compile request to the server.
+
+    :return: the response dict, or None if server is not reachable
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(path)
+    except OSError:
+        return None
+    with conn, conn.makefile("rw", encoding="utf-8") as stream:
+        stream.write(json.dumps({"argv": argv, "cwd": os.getcwd()}) + "\n")
+        stream.flush()
+        line = stream.readline()
+    return json.loads(line) if line else None
+
+
+if __name__ == '__main__':
+    sock_path = os.environ.get("TPC_SERVER", default_socket_path())
+    response = request_server(sock_path, sys.argv[1:])
+    if response is None:
+        import tpc
+
+        args = tpc.parse_args()
+        if args is None:
+            exit(1)
+        tpc.compile_tp(args)
+    else:
+        sys.stdout.write(response["output"])
+        exit(response["code"])
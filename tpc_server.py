@@ -0,0 +1,111 @@
+"""
+Long-lived compile server of tpc.py
+
+The server loads the compiler once and keeps preprocessed imported modules (such as lib/lang.tp) in memory, then
+serves compile requests from 'tpc_client.py', or from stdin if started with '--stdio'.
+
+Protocol: one json object per line.
+    request:  {"argv": [flags and source, same as tpc.py], "cwd": "working directory of the client"}
+    response: {"code": exit code, "output": "everything tpc.py would print"}
+"""
+
+import io
+import os
+import sys
+import json
+import socket
+import traceback
+import contextlib
+import tpc
+import tpc_client
+import compilers.text_preprocessor as txt_prep
+
+
+USAGE = """Usage: python tpc_server.py [flags]
+    flags:
+        -s, --socket <path>:  unix socket to listen on, default is tpc_server.sock in the temp directory
+        --stdio:              read requests from stdin and write responses to stdout
+"""
+
+
+class CompileServer:
+    def __init__(self):
+        self.module_cache = txt_prep.ModuleCache(os.path.join(tpc.get_tpc_dir(), tpc.CACHE_DIR_NAME))
+
+    def handle(self, request: dict) -> dict:
+        argv = [tpc.TPC_NAME] + request["argv"]
+        out = io.StringIO()
+        orig_cwd = os.getcwd()
+        code = 0
+        try:
+            os.chdir(request.get("cwd", orig_cwd))
+            with contextlib.redirect_stdout(out):
+                args = tpc.parse_args(argv)
+                if args is None:
+                    code = 1
+                else:
+                    tpc.compile_tp(args, self.module_cache)
+        except Exception:
+            out.write(traceback.format_exc())
+            code = 1
+        finally:
+            os.chdir(orig_cwd)
+        return {"code": code, "output": out.getvalue()}
+
+    def handle_line(self, line: str) -> str:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return json.dumps({"code": 1, "output": "Invalid request. \n"})
+        return json.dumps(self.handle(request))
+
+    def serve_stdio(self):
+        for line in sys.stdin:
+            if len(line.strip()) == 0:
+                continue
+            sys.stdout.write(self.handle_line(line) + "\n")
+            sys.stdout.flush()
+
+    def serve_socket(self, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        print(f"Compile server listening on '{path}'. ")
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile("rw", encoding="utf-8") as stream:
+                    line = stream.readline()
+                    if line:
+                        stream.write(self.handle_line(line) + "\n")
+                        stream.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    sock_path = tpc_client.default_socket_path()
+    stdio = False
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == "-s" or arg == "--socket":
+            sock_path = sys.argv[i + 1]
+            i += 1
+        elif arg == "--stdio":
+            stdio = True
+        else:
+            print(USAGE)
+            exit(1)
+        i += 1
+
+    cs = CompileServer()
+    if stdio:
+        cs.serve_stdio()
+    else:
+        cs.serve_socket(sock_path)
@@ -640,6 +640,9 @@ void tvm_mainloop() {
                 pc += bytes_to_int(MEMORY + pc) + INT_LEN;
                 break;
             case 11:  // move
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                regs[reg1] = regs[reg2];
                 break;
             case 12:  // push
             push(bytes_to_int(MEMORY + pc))
@@ -966,6 +969,211 @@ void tvm_mainloop() {
                 reg1 = MEMORY[pc++];
                 ERROR_CODE = bytes_to_int(MEMORY + true_addr(regs[reg1].int_value));
                 break;
+            case 86:  // addi_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value + bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 87:  // subi_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value - bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 88:  // muli_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value * bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 89:  // divi_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value / bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 90:  // modi_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value % bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 91:  // eqi_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value == bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 92:  // nei_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value != bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 93:  // gti_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value > bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 94:  // lti_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value < bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 95:  // gei_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value >= bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 96:  // lei_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value <= bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 97:  // lshift_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value << bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 98:  // rshift_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value >> bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 99:  // rshiftl_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = rshift_logical(regs[reg1].int_value, bytes_to_int(MEMORY + pc));
+                pc += INT_LEN;
+                break;
+            case 100:  // and_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value & bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 101:  // or_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value | bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 102:  // xor_imm
+                reg1 = MEMORY[pc++];
+                regs[reg1].int_value = regs[reg1].int_value ^ bytes_to_int(MEMORY + pc);
+                pc += INT_LEN;
+                break;
+            case 103: {  // table_jump  %reg1  low  count  default  offsets...
+                reg1 = MEMORY[pc++];
+                tp_int index = regs[reg1].int_value - bytes_to_int(MEMORY + pc);
+                tp_int count = bytes_to_int(MEMORY + pc + INT_LEN);
+                tp_int end = pc + (count + 3) * INT_LEN;
+                if (index >= 0 && index < count) {
+                    pc = end + bytes_to_int(MEMORY + pc + (index + 3) * INT_LEN);
+                } else {
+                    pc = end + bytes_to_int(MEMORY + pc + 2 * INT_LEN);
+                }
+                break;
+            }
+            case 104:  // if_eqi_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].int_value == regs[reg2].int_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 105:  // if_nei_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].int_value != regs[reg2].int_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 106:  // if_lti_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].int_value < regs[reg2].int_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 107:  // if_lei_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].int_value <= regs[reg2].int_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 108:  // if_gti_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].int_value > regs[reg2].int_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 109:  // if_gei_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].int_value >= regs[reg2].int_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 110:  // if_eqf_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].double_value == regs[reg2].double_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 111:  // if_nef_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].double_value != regs[reg2].double_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 112:  // if_ltf_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].double_value < regs[reg2].double_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 113:  // if_lef_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].double_value <= regs[reg2].double_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 114:  // if_gtf_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].double_value > regs[reg2].double_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
+            case 115:  // if_gef_jump
+                reg1 = MEMORY[pc++];
+                reg2 = MEMORY[pc++];
+                if (regs[reg1].double_value >= regs[reg2].double_value) {
+                    pc += bytes_to_int(MEMORY + pc) + INT_LEN;
+                } else {
+                    pc += INT_LEN;
+                }
+                break;
             default:
                 fprintf(stderr, "%d: ", instruction);
                 ERROR_CODE = ERR_INSTRUCTION;